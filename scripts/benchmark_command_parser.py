@@ -0,0 +1,61 @@
+"""Micro-benchmark of the command parser against the previous character scanning implementation.
+
+Run from the repository root: python -m scripts.benchmark_command_parser
+"""
+import timeit
+
+from smrt.bot.pipeline import PipelineHelper
+
+
+def legacy_extract_command_full(data: str) -> tuple[str, str, str] | None:
+    """Previous implementation of PipelineHelper.extract_command_full for comparison"""
+    left_over = data.strip()
+    if not left_over.startswith("#"):
+        return None
+    length = 0
+    for i in range(1, len(left_over)):
+        if left_over[i].isalnum() or left_over[i] == "_":
+            length += 1
+        else:
+            break
+    if length == 0:
+        return None
+    command = left_over[1:1 + length]
+    left_over = left_over[1 + length:]
+
+    params = ""
+    if len(left_over) > 0 and left_over[0] == "(":
+        end_parentesis = left_over.find(")")
+        if end_parentesis == -1:
+            return None
+        params = left_over[1:end_parentesis]
+        left_over = left_over[end_parentesis+1:]
+
+    left_over = left_over.strip()
+    return (command, params, left_over)
+
+
+# typical message sizes seen in whatsapp and signal chats
+MESSAGES = {
+    "short command": "#help",
+    "command with params": "#tinder(be funny) what should I answer?",
+    "plain text 200": "Hey, are we still meeting later today? " * 5,
+    "forwarded text 4k": "Forwarded: " + "lorem ipsum dolor sit amet " * 150,
+    "command with long text": "#gpt " + "please summarize this for me " * 140,
+    "long command name": "#" + "a" * 64 + "(x) rest",
+}
+
+
+def main():
+    number = 100000
+    print(f"{'message':<24} {'chars':>6} {'legacy us':>10} {'regex us':>10} {'speedup':>8}")
+    for name, text in MESSAGES.items():
+        assert tuple(PipelineHelper.extract_command_full(text) or ()) == tuple(legacy_extract_command_full(text) or ())
+        legacy = timeit.timeit(lambda: legacy_extract_command_full(text), number=number)
+        regex = timeit.timeit(lambda: PipelineHelper.extract_command_full(text), number=number)
+        print(f"{name:<24} {len(text):>6} {legacy / number * 1e6:>10.3f} "
+              f"{regex / number * 1e6:>10.3f} {legacy / regex:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Micro-benchmark of logging an inbound message before and after lazy, size capped rendering.
+
+Run from the repository root: python -m scripts.benchmark_logging
+"""
+import base64
+import io
+import logging
+import os
+import timeit
+
+from smrt.utils import Truncated
+
+
+def legacy_log_message(data: dict) -> None:
+    """Previous logging of WhatsappMessageQueue.on_new_message for comparison"""
+    max_length = 750
+    if len(str(data)) > max_length:
+        logging.info(f"Message: {str(data)[:int(max_length/2)]}...{str(data)[-int(max_length/2):]}")
+    else:
+        logging.info(f"Message: {data}")
+
+
+def log_message(data: dict) -> None:
+    logging.info("Message: %s", Truncated(data))
+
+
+def whatsapp_message(body: str, media_size: int = 0) -> dict:
+    response = {
+        "session": "smrt",
+        "id": "false_491712345678@c.us_3EB0C767D26A1D0B3D2F",
+        "body": body,
+        "type": "chat",
+        "sender": {"id": "491712345678@c.us", "pushname": "Pete"},
+        "chatId": "491712345678@c.us",
+        "isGroupMsg": False,
+    }
+    if media_size > 0:
+        # wppconnect sends the media base64 encoded in the body
+        response["type"] = "image"
+        response["body"] = base64.b64encode(os.urandom(media_size)).decode()
+        response["caption"] = body
+    return {"response": response}
+
+
+# typical inbound messages of whatsapp
+MESSAGES = {
+    "short text": whatsapp_message("#help"),
+    "long text 4k": whatsapp_message("lorem ipsum dolor sit amet " * 150),
+    "image 100k": whatsapp_message("look at this", 100 * 1024),
+    "image 2M": whatsapp_message("look at this", 2 * 1024 * 1024),
+}
+
+
+def measure(level: int, number: int) -> None:
+    logging.getLogger().setLevel(level)
+    print(f"root level {logging.getLevelName(level)}")
+    print(f"{'message':<16} {'legacy us':>12} {'truncated us':>13} {'speedup':>8}")
+    for name, data in MESSAGES.items():
+        legacy = timeit.timeit(lambda: legacy_log_message(data), number=number)
+        truncated = timeit.timeit(lambda: log_message(data), number=number)
+        print(f"{name:<16} {legacy / number * 1e6:>12.2f} "
+              f"{truncated / number * 1e6:>13.2f} {legacy / truncated:>7.1f}x")
+
+
+def main():
+    # the output is discarded, only rendering and formatting are measured
+    handler = logging.StreamHandler(io.StringIO())
+    handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)-8s %(message)s'))
+    root = logging.getLogger()
+    root.handlers = [handler]
+    measure(logging.INFO, 200)
+    print()
+    measure(logging.WARNING, 200)
+
+
+if __name__ == "__main__":
+    main()
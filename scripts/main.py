@@ -4,7 +4,7 @@ import time
 import logging
 logging.basicConfig(
     format='%(asctime)s %(levelname)-8s %(message)s',
-    level=logging.DEBUG,
+    level=logging.INFO,
     datefmt='%Y-%m-%d %H:%M:%S'
 )
 
@@ -17,11 +17,12 @@ from cerberus import Validator
 from igitur import GaudeamCalendar, GaudeamSession, GaudeamMembers
 
 import smrt.db
+import smrt.utils
 import smrt.bot.pipeline as pipeline
 import smrt.bot.messenger as messenger
 from smrt.web.galleryweb import GalleryFlaskApp
 import smrt.bot.tools
-from smrt.libtranscript import FasterWhisperTranscript, WyomingTranscript, Qwen35Transcript
+from smrt.libtranscript import FasterWhisperTranscript, WyomingTranscript, Qwen35Transcript, ProcessTranscript
 from smrt.bot.tools.question_bot import (
     QuestionBotInterface,
     QuestionBotOllama,
@@ -34,7 +35,10 @@ schema["storage_path"] = {"type": "string", "required": False}
 
 schema["article_summary"] = {
     "type": "dict",
-    "schema": {"summary_bot": {"type": "string", "required": True}},
+    "schema": {
+        "summary_bot": {"type": "string", "required": True},
+        "worker_processes": {"type": "integer", "min": 0, "required": False},
+    },
     "required": False,
 }
 
@@ -65,13 +69,158 @@ schema["debug"] = {
     "required": False,
 }
 
+LOG_LEVELS = ["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"]
+schema["logging"] = {
+    "type": "dict",
+    "schema": {
+        "level": {"type": "string", "allowed": LOG_LEVELS, "required": False},
+        "json": {"type": "boolean", "required": False},
+        "modules": {
+            "type": "dict",
+            "keysrules": {"type": "string"},
+            "valuesrules": {"type": "string", "allowed": LOG_LEVELS},
+            "required": False,
+        },
+    },
+    "nullable": True,  # Accepts `null` or empty dict as valid
+    "required": False,
+}
+
+schema["dispatcher"] = {
+    "type": "dict",
+    "schema": {
+        "max_workers": {"type": "integer", "min": 1, "required": False},
+        "max_queue_size": {"type": "integer", "min": 1, "required": False},
+        "ordered_chats": {"type": "boolean", "required": False},
+        "pipeline_concurrency": {
+            "type": "dict",
+            "keysrules": {"type": "string"},
+            "valuesrules": {"type": "integer", "min": 1},
+            "required": False,
+        },
+        "reserved_workers": {
+            "type": "dict",
+            "keysrules": {"type": "string", "allowed": pipeline.PipelineInterface.PRIORITIES},
+            "valuesrules": {"type": "integer", "min": 0},
+            "required": False,
+        },
+        "pipeline_priority": {
+            "type": "dict",
+            "keysrules": {"type": "string"},
+            "valuesrules": {"type": "string", "allowed": pipeline.PipelineInterface.PRIORITIES},
+            "required": False,
+        },
+        "starvation_timeout": {"type": "number", "min": 0, "required": False},
+        "status_window": {"type": "number", "min": 0, "required": False},
+        "pipeline_queues": {
+            "type": "dict",
+            "keysrules": {"type": "string"},
+            "valuesrules": {
+                "type": "dict",
+                "schema": {
+                    "max_queued": {"type": "integer", "min": 1, "required": False},
+                    "overflow": {
+                        "type": "string",
+                        "allowed": pipeline.PipelineDispatcher.OVERFLOW_POLICIES,
+                        "required": False,
+                    },
+                },
+            },
+            "required": False,
+        },
+        "persistent_jobs": {
+            "type": "dict",
+            "schema": {
+                "pipelines": {"type": "list", "schema": {"type": "string"}, "required": True},
+                "lease_timeout": {"type": "number", "min": 1, "required": False},
+                "max_attempts": {"type": "integer", "min": 1, "required": False},
+            },
+            "required": False,
+        },
+    },
+    "nullable": True,  # Accepts `null` or empty dict as valid
+    "required": False,
+}
+
+# rate limits of messages the bot sends on its own, e.g. notifications
+outbound_limits_schema = {
+    "rate": {"type": "number", "min": 0.001, "required": False},
+    "burst": {"type": "integer", "min": 1, "required": False},
+    "chat_rate": {"type": "number", "min": 0.001, "required": False},
+    "chat_burst": {"type": "integer", "min": 1, "required": False},
+    "max_retries": {"type": "integer", "min": 0, "required": False},
+    "retry_backoff": {"type": "number", "min": 0, "required": False},
+    "max_queue_size": {"type": "integer", "min": 1, "required": False},
+    "workers": {"type": "integer", "min": 1, "required": False},
+}
+
+schema["outbound"] = {
+    "type": "dict",
+    "schema": {
+        "enabled": {"type": "boolean", "required": False},
+        **outbound_limits_schema,
+        "messengers": {
+            "type": "dict",
+            "keysrules": {"type": "string"},
+            "valuesrules": {"type": "dict", "schema": outbound_limits_schema},
+            "required": False,
+        },
+    },
+    "nullable": True,  # Accepts `null` or empty dict as valid
+    "required": False,
+}
+
+schema["audio_transcoding"] = {
+    "type": "dict",
+    "schema": {
+        "max_processes": {"type": "integer", "min": 1, "required": False},
+        "cache_size_mb": {"type": "number", "min": 0, "required": False},
+    },
+    "nullable": True,  # Accepts `null` or empty dict as valid
+    "required": False,
+}
+
+schema["deduplication"] = {
+    "type": "dict",
+    "schema": {
+        "max_entries": {"type": "integer", "min": 1, "required": False},
+        "persist": {"type": "boolean", "required": False},
+        "retention_days": {"type": "number", "min": 1, "required": False},
+    },
+    "nullable": True,  # Accepts `null` or empty dict as valid
+    "required": False,
+}
+
 ## messenger configuration schemas
+# connection pool of the REST api of a messenger
+http_session_schema = {
+    "type": "dict",
+    "schema": {
+        "pool_size": {"type": "integer", "min": 1, "required": False},
+        "retries": {"type": "integer", "min": 0, "required": False},
+        "backoff_factor": {"type": "number", "min": 0, "required": False},
+        "connect_timeout": {"type": "number", "min": 0, "required": False},
+        "read_timeout": {"type": "number", "min": 0, "required": False},
+    },
+    "required": False,
+}
+
 schema["signal"] = {
     "type": "dict",
     "schema": {
         "host": {"type": "string", "required": True},
         "port": {"type": "integer", "required": True},
         "number": {"type": "string", "required": True},
+        "http": http_session_schema,
+        "group_cache": {
+            "type": "dict",
+            "schema": {
+                "ttl": {"type": "number", "min": 0, "required": False},
+                "negative_ttl": {"type": "number", "min": 0, "required": False},
+                "warm_up": {"type": "boolean", "required": False},
+            },
+            "required": False,
+        },
     },
     "required": False,
 }
@@ -83,6 +232,7 @@ schema["whatsapp"] = {
         "wppconnect_session_name": {"type": "string", "required": True},
         "wppconnect_server": {"type": "string", "required": True},
         "lid": {"type": "string", "required": False},
+        "http": http_session_schema,
     },
     "required": False,
 }
@@ -91,6 +241,7 @@ schema["telegram"] = {
     "type": "dict",
     "schema": {
         "telegram_api_key": {"type": "string", "required": True},
+        "http": http_session_schema,
     },
     "required": False,
 }
@@ -107,7 +258,9 @@ schema["telethon"] = {
 
 schema["text_to_speech"] = {
     "type": "dict",
-    "schema": {},
+    "schema": {
+        "worker_processes": {"type": "integer", "min": 0, "required": False},
+    },
     "nullable": True,  # Accepts `null` or empty dict as valid
     "required": False,
 }
@@ -139,6 +292,7 @@ schema["voice_transcription"] = {
         "transcribe_group_chats": {"type": "boolean", "required": False},
         "transcribe_private_chats": {"type": "boolean", "required": False},
         "mark_unseen_after_processing": {"type": "boolean", "required": False},
+        "worker_processes": {"type": "integer", "min": 0, "required": False},
         "chat_id_blacklist": {
             "type": "list",
             "schema": {"type": "string"},
@@ -172,6 +326,7 @@ schema["gallery"] = {
     "schema": {
         "base_url": {"type": "string", "required": True},
         "port": {"type": "integer", "required": True},
+        "worker_processes": {"type": "integer", "min": 0, "required": False},
         "chat_id_whitelist": {
             "type": "list",
             "schema": {"type": "string"},
@@ -285,6 +440,21 @@ schema["ai"] = {
 }
 
 
+def create_http_session(config_http: dict|None, read_timeout: float) -> messenger.PooledHttpSession:
+    config_http = config_http or {}
+    return messenger.PooledHttpSession(
+        pool_size=config_http.get("pool_size", messenger.PooledHttpSession.DEFAULT_POOL_SIZE),
+        retries=config_http.get("retries", messenger.PooledHttpSession.DEFAULT_RETRIES),
+        backoff_factor=config_http.get(
+            "backoff_factor", messenger.PooledHttpSession.DEFAULT_BACKOFF_FACTOR
+        ),
+        connect_timeout=config_http.get(
+            "connect_timeout", messenger.PooledHttpSession.DEFAULT_CONNECT_TIMEOUT
+        ),
+        read_timeout=config_http.get("read_timeout", read_timeout),
+    )
+
+
 def validate_config(config, schema) -> bool:
     validator = Validator(schema)
     if validator.validate(config):
@@ -324,6 +494,13 @@ def run():
     if not validate_config(configuration, schema):
         exit(1)
 
+    config_logging = configuration.get("logging") or {}
+    smrt.utils.configure_logging(
+        level=config_logging.get("level", "INFO"),
+        levels=config_logging.get("modules"),
+        json_output=config_logging.get("json", False),
+    )
+
     CONFIG_DEBUG = "debug"
     debug_flag = False
     if CONFIG_DEBUG in configuration:
@@ -332,8 +509,61 @@ def run():
     logging.info(f"Using storage path: {storage_path}")
 
     # create main pipeline
-
-    main_pipe = pipeline.MainPipeline()
+    CONFIG_DISPATCHER = "dispatcher"
+    config_dispatcher = configuration.get(CONFIG_DISPATCHER) or {}
+    # persist jobs of heavy pipelines to replay them after a restart
+    config_persistent_jobs = config_dispatcher.get("persistent_jobs") or {}
+    job_store = None
+    if len(config_persistent_jobs.get("pipelines", [])) > 0:
+        job_store = smrt.db.JobQueueDatabase(storage_path)
+    # progress marks of fast pipelines are merged, only the final reaction is sent
+    status_window = config_dispatcher.get("status_window", messenger.StatusCoalescer.DEFAULT_WINDOW)
+    status_coalescer = messenger.StatusCoalescer(status_window) if status_window > 0 else None
+    dispatcher = pipeline.PipelineDispatcher(
+        max_workers=config_dispatcher.get(
+            "max_workers", pipeline.PipelineDispatcher.DEFAULT_MAX_WORKERS
+        ),
+        max_queue_size=config_dispatcher.get(
+            "max_queue_size", pipeline.PipelineDispatcher.DEFAULT_MAX_QUEUE_SIZE
+        ),
+        pipeline_concurrency=config_dispatcher.get("pipeline_concurrency", {}),
+        ordered_chats=config_dispatcher.get("ordered_chats", False),
+        job_store=job_store,
+        persistent_pipelines=config_persistent_jobs.get("pipelines", []),
+        lease_timeout=config_persistent_jobs.get(
+            "lease_timeout", pipeline.PipelineDispatcher.DEFAULT_LEASE_TIMEOUT
+        ),
+        max_attempts=config_persistent_jobs.get(
+            "max_attempts", pipeline.PipelineDispatcher.DEFAULT_MAX_ATTEMPTS
+        ),
+        reserved_workers=config_dispatcher.get("reserved_workers", {}),
+        pipeline_priority=config_dispatcher.get("pipeline_priority", {}),
+        starvation_timeout=config_dispatcher.get(
+            "starvation_timeout", pipeline.PipelineDispatcher.DEFAULT_STARVATION_TIMEOUT
+        ),
+        pipeline_queues=config_dispatcher.get("pipeline_queues", {}),
+        status_coalescer=status_coalescer,
+    )
+    schedule.every(10).minutes.do(
+        lambda: logging.info(f"Dispatcher stats: {dispatcher.get_stats()}")
+    )
+
+    # drop messages that are delivered again, e.g. after a reconnect of a messenger
+    CONFIG_DEDUPLICATION = "deduplication"
+    config_dedup = configuration.get(CONFIG_DEDUPLICATION) or {}
+    seen_db = None
+    if config_dedup.get("persist", False):
+        seen_db = smrt.db.SeenMessageDatabase(storage_path)
+        retention_s = config_dedup.get("retention_days", 7) * 24 * 3600
+        schedule.every().day.do(lambda: seen_db.delete_older_than(time.time() - retention_s))
+    deduplicator = pipeline.MessageDeduplicator(
+        config_dedup.get("max_entries", pipeline.MessageDeduplicator.DEFAULT_MAX_ENTRIES), seen_db
+    )
+    schedule.every(10).minutes.do(
+        lambda: logging.info(f"Deduplication stats: {deduplicator.get_stats()}")
+    )
+
+    main_pipe = pipeline.MainPipeline(dispatcher, deduplicator)
     # database = db.Database("data")
 
     # questionbot_image = questionbot.QuestionBotOllama("llava")
@@ -476,10 +706,14 @@ def run():
         vt_min_words_for_summary = config_vt.get("min_words_for_summary", 10)
         vt_chat_id_blacklist = config_vt.get("chat_id_blacklist", [])
         asr_engine = config_vt.get("asr_engine", "faster_whisper")
-        if asr_engine == "faster_whisper":
-            vt_transcriber = FasterWhisperTranscript()
-        elif asr_engine == "qwen":
-            vt_transcriber = Qwen35Transcript()
+        # local models can run in worker processes to not block the bot while transcribing
+        vt_worker_processes = config_vt.get("worker_processes", 0)
+        if asr_engine in ("faster_whisper", "qwen"):
+            transcript_class = FasterWhisperTranscript if asr_engine == "faster_whisper" else Qwen35Transcript
+            if vt_worker_processes > 0:
+                vt_transcriber = ProcessTranscript(transcript_class, workers=vt_worker_processes)
+            else:
+                vt_transcriber = transcript_class()
         else:
             if not asr_engine.startswith("tcp://"):
                 raise ValueError(
@@ -509,7 +743,10 @@ def run():
 
     CONFIG_TTS = "text_to_speech"
     if CONFIG_TTS in configuration:
-        tts_pipeline = pipeline.TextToSpeechPipeline(storage_path / "custom_models")
+        config_tts = configuration[CONFIG_TTS] or {}
+        tts_pipeline = pipeline.TextToSpeechPipeline(
+            storage_path / "custom_models", config_tts.get("worker_processes", 0)
+        )
         main_pipe.add_pipeline(tts_pipeline)
 
     # load tinder pipeline if configured
@@ -533,7 +770,10 @@ def run():
         article_summary_bot = bot_loader.get_bot(config_article_summary["summary_bot"])
         article_summarizer = smrt.bot.tools.QuestionBotSummary(article_summary_bot)
         article_summary_pipeline = pipeline.URLSummaryPipeline(
-            article_summarizer, chat_id_whitelist, chat_id_blacklist
+            article_summarizer,
+            chat_id_whitelist,
+            chat_id_blacklist,
+            worker_processes=config_article_summary.get("worker_processes", 0),
         )
         main_pipe.add_pipeline(article_summary_pipeline)
 
@@ -579,7 +819,11 @@ def run():
         gallery_db = smrt.db.GalleryDatabase(storage_path)
 
         gallery_pipe = pipeline.GalleryPipeline(
-            gallery_db, base_url, chat_id_whitelist, chat_id_blacklist
+            gallery_db,
+            base_url,
+            chat_id_whitelist,
+            chat_id_blacklist,
+            worker_processes=config_gallery.get("worker_processes", 0),
         )
         main_pipe.add_pipeline(gallery_pipe)
         gallery_delete_pipe = pipeline.GalleryDeletePipeline(
@@ -652,22 +896,69 @@ def run():
         # run in background thread as we want to schedule internally
         threading.Thread(target=netcup_task.run, daemon=True).start()
 
+    # encoding of voice replies, shared by all messengers
+    config_transcoding = configuration.get("audio_transcoding") or {}
+    audio_transcoder = smrt.utils.AudioTranscoder(
+        max_processes=config_transcoding.get(
+            "max_processes", smrt.utils.AudioTranscoder.DEFAULT_MAX_PROCESSES
+        ),
+        cache_size=int(
+            config_transcoding.get(
+                "cache_size_mb", smrt.utils.AudioTranscoder.DEFAULT_CACHE_SIZE / (1024 * 1024)
+            )
+            * 1024
+            * 1024
+        ),
+    )
+    schedule.every(10).minutes.do(
+        lambda: logging.info(f"Audio transcoding stats: {audio_transcoder.get_stats()}")
+    )
+
     # load all messengers
     CONFIG_SIGNAL = "signal"
     if CONFIG_SIGNAL in configuration:
         config_signal = configuration[CONFIG_SIGNAL]
+        config_group_cache = config_signal.get("group_cache") or {}
         signal_messenger = messenger.SignalMessenger(
-            config_signal["number"], config_signal["host"], int(config_signal["port"])
+            config_signal["number"],
+            config_signal["host"],
+            int(config_signal["port"]),
+            http_session=create_http_session(
+                config_signal.get("http"), messenger.SignalMessenger.DEFAULT_TIMEOUT
+            ),
+            group_cache_ttl=config_group_cache.get("ttl", messenger.GroupIdCache.DEFAULT_TTL),
+            group_cache_negative_ttl=config_group_cache.get(
+                "negative_ttl", messenger.GroupIdCache.DEFAULT_NEGATIVE_TTL
+            ),
+            transcoder=audio_transcoder,
+        )
+        if config_group_cache.get("warm_up", False):
+            # fetch the groups in the background, a slow signal-cli should not delay the start
+            threading.Thread(target=signal_messenger.warm_up_group_cache, daemon=True).start()
+        schedule.every(10).minutes.do(
+            lambda: logging.info(
+                f"Signal http stats: {signal_messenger.get_http_stats()}, "
+                f"group cache stats: {signal_messenger.get_group_cache_stats()}"
+            )
         )
         messenger_manager.add_messenger(signal_messenger)
         signal_queue = messenger.SignalMessageQueue(signal_messenger, main_pipe.process)
         signal_queue.run_async()
+        schedule.every(10).minutes.do(
+            lambda: logging.info(f"Signal intake stats: {signal_queue.get_stats()}")
+        )
 
     CONFIG_TELEGRAM = "telegram"
     if CONFIG_TELEGRAM in configuration:
         config_telegram = configuration[CONFIG_TELEGRAM]
         telegram_messenger = messenger.TelegramMessenger(
-            config_telegram["telegram_api_key"]
+            config_telegram["telegram_api_key"],
+            http_session=create_http_session(
+                config_telegram.get("http"), messenger.PooledHttpSession.DEFAULT_READ_TIMEOUT
+            ),
+        )
+        schedule.every(10).minutes.do(
+            lambda: logging.info(f"Telegram http stats: {telegram_messenger.get_http_stats()}")
         )
         messenger_manager.add_messenger(telegram_messenger)
         telegram_queue = messenger.TelegramMessageQueue(
@@ -682,12 +973,18 @@ def run():
             config_telethon["api_id"],
             config_telethon["api_key"],
             config_telethon["bot_token"],
+            transcoder=audio_transcoder,
         )
         messenger_manager.add_messenger(telethon_messenger)
         telethon_queue = messenger.TelethonMessageQueue(
             telethon_messenger, main_pipe.process
         )
         telethon_queue.run_async()
+        schedule.every(10).minutes.do(
+            lambda: logging.info(
+                f"Telethon stats: {telethon_queue.get_stats()}, sends: {telethon_messenger.get_send_stats()}"
+            )
+        )
 
     CONFIG_WHATSAPP = "whatsapp"
     if CONFIG_WHATSAPP in configuration:
@@ -699,11 +996,21 @@ def run():
             config_whatsapp["wppconnect_session_name"],
             config_whatsapp["wppconnect_api_key"],
             lid,
+            http_session=create_http_session(
+                config_whatsapp.get("http"), messenger.WhatsappMessenger.DEFAULT_TIMEOUT
+            ),
+            transcoder=audio_transcoder,
+        )
+        schedule.every(10).minutes.do(
+            lambda: logging.info(f"Whatsapp http stats: {whatsapp.get_http_stats()}")
         )
 
         messenger_manager.add_messenger(whatsapp)
         whatsapp_queue = messenger.WhatsappMessageQueue(whatsapp, main_pipe.process)
         whatsapp_queue.run_async()
+        schedule.every(10).minutes.do(
+            lambda: logging.info(f"Whatsapp intake stats: {whatsapp_queue.get_stats()}")
+        )
 
         try:
             whatsapp.start_session()
@@ -713,6 +1020,39 @@ def run():
         # mainpipe.add_pipeline(stock_notifier)
         # stock_notifier.run_async()
 
+    # notifications and broadcasts are sent through rate limited queues per messenger
+    CONFIG_OUTBOUND = "outbound"
+    config_outbound = configuration.get(CONFIG_OUTBOUND) or {}
+    if config_outbound.get("enabled", True):
+        for outbound_messenger in messenger_manager.get_messengers():
+            config_limits = dict(config_outbound)
+            config_limits.update((config_outbound.get("messengers") or {}).get(outbound_messenger.get_name(), {}))
+            messenger_manager.set_outbound_queue(
+                messenger.OutboundQueue(
+                    outbound_messenger,
+                    rate=config_limits.get("rate", messenger.OutboundQueue.DEFAULT_RATE),
+                    burst=config_limits.get("burst", messenger.OutboundQueue.DEFAULT_BURST),
+                    chat_rate=config_limits.get("chat_rate", messenger.OutboundQueue.DEFAULT_CHAT_RATE),
+                    chat_burst=config_limits.get("chat_burst", messenger.OutboundQueue.DEFAULT_CHAT_BURST),
+                    max_retries=config_limits.get("max_retries", messenger.OutboundQueue.DEFAULT_MAX_RETRIES),
+                    retry_backoff=config_limits.get(
+                        "retry_backoff", messenger.OutboundQueue.DEFAULT_RETRY_BACKOFF
+                    ),
+                    max_queue_size=config_limits.get(
+                        "max_queue_size", messenger.OutboundQueue.DEFAULT_MAX_QUEUE_SIZE
+                    ),
+                    workers=config_limits.get("workers", messenger.OutboundQueue.DEFAULT_WORKERS),
+                )
+            )
+        schedule.every(10).minutes.do(
+            lambda: logging.info(f"Outbound stats: {messenger_manager.get_outbound_stats()}")
+        )
+
+    # replay persisted jobs once all messengers are known, later on only jobs with expired leases
+    if job_store is not None:
+        main_pipe.replay_jobs(messenger_manager)
+        schedule.every(1).minutes.do(lambda: main_pipe.replay_jobs(messenger_manager))
+
     # run scheduled tasks continuously in background
     stop_run_continuously = run_schedule_continuously()
 
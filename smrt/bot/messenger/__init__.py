@@ -4,17 +4,32 @@ from .telegram import TelegramMessenger, TelegramMessageQueue
 from .telethonage import TelethonMessenger, TelethonMessageQueue
 from .messenger import MessengerInterface, MessengerManager
 from .message_server import MessageServerFlaskApp
+from .http_session import PooledHttpSession
+from .group_cache import GroupIdCache
+from .status_coalescer import StatusCoalescer, StatusCoalescingMessenger
+from .outbound import OutboundQueue, TokenBucket
+from .media import MediaTooLargeError
+from .intake import MessageHandOff, ReconnectBackoff
 
 __all__ = [
+    "GroupIdCache",
     "MessengerInterface",
     "MessengerManager",
+    "MediaTooLargeError",
+    "MessageHandOff",
     "MessageServerFlaskApp",
+    "OutboundQueue",
+    "PooledHttpSession",
+    "ReconnectBackoff",
     "SignalMessenger",
     "SignalMessageQueue",
+    "StatusCoalescer",
+    "StatusCoalescingMessenger",
     "TelegramMessenger",
     "TelegramMessageQueue",
     "TelethonMessenger",
     "TelethonMessageQueue",
+    "TokenBucket",
     "WhatsappMessenger",
     "WhatsappMessageQueue",
 ]
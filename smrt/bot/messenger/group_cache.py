@@ -0,0 +1,126 @@
+"""Cache that maps internal group ids of a messenger to the ids its REST api expects. """
+import logging
+import threading
+import time
+from typing import Callable
+
+
+class GroupIdCache():
+    """Thread-safe cache of group ids that is refreshed from the full group list of the server.
+
+    The whole list expires after a TTL. Ids that are not part of the list are remembered as
+    missing for a shorter time, so unknown ids do not fetch the list again for every message.
+    Concurrent misses share a single refresh: threads that waited for a running refresh use
+    its result instead of fetching the list again. If a refresh fails, the previous entries
+    are kept and still returned, and the list is not fetched again for the shorter of both
+    TTLs, so a server that is down does not get a request for every message.
+    """
+    DEFAULT_TTL = 3600
+    DEFAULT_NEGATIVE_TTL = 300
+
+    def __init__(self, fetch_groups: Callable[[], dict[str, str]],
+                 ttl: float = DEFAULT_TTL,
+                 negative_ttl: float = DEFAULT_NEGATIVE_TTL) -> None:
+        """Creates the cache, the list is fetched on the first lookup or on warm up.
+
+        Args:
+            fetch_groups (Callable[[], dict[str, str]]): Returns all groups as internal id -> group id
+            ttl (float): Seconds until the group list is fetched again
+            negative_ttl (float): Seconds an unknown id is remembered as missing
+        """
+        self._fetch_groups = fetch_groups
+        self._ttl = ttl
+        self._negative_ttl = negative_ttl
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._groups: dict[str, str] = {}
+        self._missing: dict[str, float] = {}
+        self._expires = 0.0
+        self._generation = 0
+        self._last_refresh_ok = False
+        self._hits = 0
+        self._misses = 0
+        self._refreshes = 0
+        self._errors = 0
+
+    def get_group_id(self, internal_id: str) -> str|None:
+        """Looks up the group id for an internal id, refreshes the list if needed.
+
+        Args:
+            internal_id (str): The internal id of the group, e.g. from an incoming message
+
+        Returns:
+            str | None: The group id or None if the server does not know the group
+        """
+        with self._lock:
+            now = time.monotonic()
+            if now < self._expires:
+                if not self._last_refresh_ok:
+                    # backing off after a failed refresh, serve what is known
+                    self._hits += 1
+                    return self._groups.get(internal_id)
+                if internal_id in self._groups:
+                    self._hits += 1
+                    return self._groups[internal_id]
+                if self._missing.get(internal_id, 0.0) > now:
+                    self._hits += 1
+                    return None
+            self._misses += 1
+            generation = self._generation
+        self._refresh(generation)
+        with self._lock:
+            group_id = self._groups.get(internal_id)
+            if group_id is None and self._last_refresh_ok:
+                self._missing[internal_id] = time.monotonic() + self._negative_ttl
+            return group_id
+
+    def warm_up(self) -> bool:
+        """Fetches the group list ahead of the first message.
+
+        Returns:
+            bool: True if the list could be fetched
+        """
+        with self._lock:
+            generation = self._generation
+        self._refresh(generation)
+        with self._lock:
+            return self._last_refresh_ok
+
+    def _refresh(self, generation: int) -> None:
+        with self._refresh_lock:
+            with self._lock:
+                if self._generation != generation:
+                    # another thread refreshed while we were waiting, use its result
+                    return
+            try:
+                groups = self._fetch_groups()
+            except Exception as ex:
+                logging.warning(f"Failed to refresh group cache: {ex}")
+                with self._lock:
+                    self._expires = time.monotonic() + min(self._ttl, self._negative_ttl)
+                    self._generation += 1
+                    self._errors += 1
+                    self._last_refresh_ok = False
+                return
+            with self._lock:
+                now = time.monotonic()
+                self._groups = dict(groups)
+                self._missing = {key: expires for key, expires in self._missing.items()
+                                 if expires > now and key not in self._groups}
+                self._expires = now + self._ttl
+                self._generation += 1
+                self._refreshes += 1
+                self._last_refresh_ok = True
+            logging.debug(f"Refreshed group cache with {len(groups)} groups")
+
+    def get_stats(self) -> dict:
+        """Returns lookups served from the cache, misses and fetches of the group list. """
+        with self._lock:
+            return {
+                "groups": len(self._groups),
+                "missing": len(self._missing),
+                "hits": self._hits,
+                "misses": self._misses,
+                "refreshes": self._refreshes,
+                "errors": self._errors,
+            }
@@ -0,0 +1,123 @@
+"""Shared HTTP session with connection pooling for messenger REST APIs. """
+import logging
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class PooledHttpSession():
+    """Thread-safe HTTP session that keeps connections to the messenger server alive.
+
+    All calls share one connection pool, so a processed message does not open a new
+    TCP connection for every reaction, typing indicator and reply. Connection errors are
+    retried with exponential backoff for all methods, 502/503/504 responses only for
+    idempotent methods. Read timeouts and gateway errors of posts are not retried, the
+    server might already have executed the call, e.g. sent a message.
+    """
+    DEFAULT_POOL_SIZE = 10
+    DEFAULT_RETRIES = 3
+    DEFAULT_BACKOFF_FACTOR = 0.5
+    DEFAULT_CONNECT_TIMEOUT = 5
+    DEFAULT_READ_TIMEOUT = 60
+
+    def __init__(self, pool_size: int = DEFAULT_POOL_SIZE,
+                 retries: int = DEFAULT_RETRIES,
+                 backoff_factor: float = DEFAULT_BACKOFF_FACTOR,
+                 connect_timeout: float = DEFAULT_CONNECT_TIMEOUT,
+                 read_timeout: float = DEFAULT_READ_TIMEOUT,
+                 headers: dict|None = None) -> None:
+        """Creates the session.
+
+        Args:
+            pool_size (int): Maximum number of connections kept open per host
+            retries (int): Number of retries after connection errors or 502/503/504 of idempotent methods
+            backoff_factor (float): Base of the exponential backoff between retries in seconds
+            connect_timeout (float): Default timeout to establish a connection in seconds
+            read_timeout (float): Default timeout to wait for a response in seconds
+            headers (dict | None): Headers sent with every request, e.g. authorization
+        """
+        retry = Retry(total=retries,
+                      connect=retries,
+                      read=0,
+                      status=retries,
+                      backoff_factor=backoff_factor,
+                      # only for idempotent methods, a gateway error can come after a post was executed
+                      status_forcelist=(502, 503, 504),
+                      raise_on_status=False)
+        self._adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self._session = requests.Session()
+        self._session.mount("http://", self._adapter)
+        self._session.mount("https://", self._adapter)
+        if headers is not None:
+            self._session.headers.update(headers)
+        self._timeout = (connect_timeout, read_timeout)
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._errors = 0
+
+    def set_headers(self, headers: dict) -> None:
+        """Adds headers that are sent with every request, e.g. authorization. """
+        self._session.headers.update(headers)
+
+    def request(self, method: str, url: str, timeout: float|tuple[float, float]|None = None, **kwargs) -> requests.Response:
+        """Sends a request over the pooled connections.
+
+        Args:
+            method (str): HTTP method, e.g. 'GET' or 'POST'
+            url (str): The url to call
+            timeout (float | tuple[float, float] | None): Timeout for this call, None for the default
+            kwargs: Further arguments for requests, e.g. json or stream
+
+        Returns:
+            requests.Response: The response of the server
+        """
+        with self._lock:
+            self._requests += 1
+        try:
+            return self._session.request(method, url, timeout=timeout if timeout is not None else self._timeout, **kwargs)
+        except requests.RequestException:
+            with self._lock:
+                self._errors += 1
+            raise
+
+    def get(self, url: str, timeout: float|tuple[float, float]|None = None, **kwargs) -> requests.Response:
+        return self.request("GET", url, timeout=timeout, **kwargs)
+
+    def post(self, url: str, timeout: float|tuple[float, float]|None = None, **kwargs) -> requests.Response:
+        return self.request("POST", url, timeout=timeout, **kwargs)
+
+    def put(self, url: str, timeout: float|tuple[float, float]|None = None, **kwargs) -> requests.Response:
+        return self.request("PUT", url, timeout=timeout, **kwargs)
+
+    def delete(self, url: str, timeout: float|tuple[float, float]|None = None, **kwargs) -> requests.Response:
+        return self.request("DELETE", url, timeout=timeout, **kwargs)
+
+    def get_stats(self) -> dict:
+        """Returns how many requests were sent and how many connections had to be opened for them.
+
+        Returns:
+            dict: requests, errors, connections opened and requests that reused a connection
+        """
+        connections = 0
+        pool_requests = 0
+        # each host has its own pool in urllib3 that counts opened connections and requests
+        for key in list(self._adapter.poolmanager.pools.keys()):
+            pool = self._adapter.poolmanager.pools.get(key)
+            if pool is None:
+                continue
+            connections += pool.num_connections
+            pool_requests += pool.num_requests
+        with self._lock:
+            return {
+                "requests": self._requests,
+                "errors": self._errors,
+                "connections": connections,
+                "reused": max(0, pool_requests - connections),
+            }
+
+    def close(self) -> None:
+        """Closes all pooled connections. """
+        logging.debug("Closing pooled http session")
+        self._session.close()
@@ -3,6 +3,7 @@ import logging
 import threading
 import time
 import random
+from collections import OrderedDict
 from typing import override, Callable
 from pathlib import Path
 from datetime import datetime, timedelta
@@ -10,6 +11,7 @@ from instagrapi import Client
 from instagrapi.types import DirectMessage
 
 from .messenger import MessengerInterface
+from smrt.utils import Truncated
 from smrt.db import InstaMessageSeenDB
 
 class InstagramMessenger(MessengerInterface):
@@ -42,27 +44,27 @@ class InstagramMessenger(MessengerInterface):
         pass
 
     @override
-    def mark_in_progress_50(self, message: dict | telebot.types.Message):
+    def mark_in_progress_50(self, message: dict | DirectMessage):
         #self._telebot.set_message_reaction(message.chat.id, message.message_id, telebot.types.ReactionTypeCustomEmoji(self.REACT_HOURGLASS_HALF))
         pass
 
     @override
-    def mark_in_progress_done(self, message: dict | telebot.types.Message):
+    def mark_in_progress_done(self, message: dict | DirectMessage):
         #self._telebot.set_message_reaction(message.chat.id, message.message_id, telebot.types.ReactionTypeCustomEmoji(self.REACT_CHECKMARK))
         pass
 
     @override
-    def mark_in_progress_fail(self, message: dict | telebot.types.Message):
+    def mark_in_progress_fail(self, message: dict | DirectMessage):
         #self._telebot.set_message_reaction(message.chat.id, message.message_id, telebot.types.ReactionTypeCustomEmoji(self.REACT_FAIL))
         pass
 
     @override
-    def mark_seen(self, message: dict | telebot.types.Message) -> None:
+    def mark_seen(self, message: dict | DirectMessage) -> None:
         # TODO
         return
 
     @override
-    def is_group_message(self, message: dict | telebot.types.Message) -> bool:
+    def is_group_message(self, message: dict | DirectMessage) -> bool:
         return message.chat.type in ['group', 'supergroup']
 
     @override
@@ -78,17 +80,17 @@ class InstagramMessenger(MessengerInterface):
         self._telebot.send_message(chat_id, text, parse_mode='Markdown')
 
     @override
-    def send_message_to_group(self, group_message: dict | telebot.types.Message, text: str):
+    def send_message_to_group(self, group_message: dict | DirectMessage, text: str):
         self._telebot.send_message(group_message.chat.id, text, parse_mode='Markdown')
 
     @override
-    def send_message_to_individual(self, message: dict | telebot.types.Message, text: str):
+    def send_message_to_individual(self, message: dict | DirectMessage, text: str):
         # user needs to send at least one message to the bot before we can send messages to them
         user_id = message.from_user.id
         self._telebot.send_message(user_id, text, parse_mode='Markdown')
 
     @override
-    def reply_message(self, message: dict | telebot.types.Message, text: str) -> None:
+    def reply_message(self, message: dict | DirectMessage, text: str) -> None:
         self._telebot.reply_to(message, text, parse_mode='Markdown')
 
     @override
@@ -100,23 +102,23 @@ class InstagramMessenger(MessengerInterface):
         pass
 
     @override
-    def send_image_to_group(self, group_message: dict | telebot.types.Message, file_name, binary_data, caption = ""):
+    def send_image_to_group(self, group_message: dict | DirectMessage, file_name, binary_data, caption = ""):
         # TODO: test
         self._send_image(group_message.chat.id, file_name, binary_data, caption)
 
 
     @override
-    def send_image_to_individual(self, message: dict | telebot.types.Message, file_name, binary_data, caption = ""):
+    def send_image_to_individual(self, message: dict | DirectMessage, file_name, binary_data, caption = ""):
         # TODO: test
         user_id = message.from_user.id
         self._send_image(user_id, file_name, binary_data, caption)
 
     @override
-    def send_audio_to_group(self, group_message: dict | telebot.types.Message, audio_file_path):
+    def send_audio_to_group(self, group_message: dict | DirectMessage, audio_file_path):
         pass
 
     @override
-    def send_audio_to_individual(self, message: dict | telebot.types.Message, audio_file_path):
+    def send_audio_to_individual(self, message: dict | DirectMessage, audio_file_path):
         pass
 
     @override
@@ -135,15 +137,19 @@ class InstagramMessenger(MessengerInterface):
         return False
 
     @override
-    def get_message_text(self, message: dict | telebot.types.Message) -> str:
+    def get_message_text(self, message: dict | DirectMessage) -> str:
         return message.text
 
+    @override
+    def get_message_id(self, message: DirectMessage) -> str|None:
+        return str(message.id)
+
     @override
     def get_chat_id(self, message: dict|DirectMessage) -> str:
         return f"instagram://{message.thread_id}"
 
     @override
-    def get_sender_name(self, message: telebot.types.Message) -> str:
+    def get_sender_name(self, message: DirectMessage) -> str:
         return message.from_user.first_name if message.from_user else "Unknown"
 
     @override
@@ -157,47 +163,144 @@ class InstagramMessenger(MessengerInterface):
         return
 
 class InstagramMessageQueue():
-
-    def __init__(self, messenger_instance: InstagramMessenger, seen_db: InstaMessageSeenDB, callback: Callable[[MessengerInterface, dict], None]) -> None:
+    """Polls the direct threads of the account for new messages.
+
+    Messages of a thread are only fetched if the thread had activity since the last poll,
+    and only messages newer than the last seen message of the thread are processed. Seen
+    message ids are checked in memory before the database, new ids are written in one
+    transaction per poll.
+    """
+    DEFAULT_THREAD_COUNT = 10
+    DEFAULT_MESSAGE_COUNT = 5
+    DEFAULT_SEEN_CACHE_SIZE = 10000
+    MAX_MESSAGE_AGE = timedelta(days=1)
+
+    def __init__(self, messenger_instance: InstagramMessenger, seen_db: InstaMessageSeenDB,
+                 callback: Callable[[MessengerInterface, dict], None],
+                 thread_count: int = DEFAULT_THREAD_COUNT,
+                 message_count: int = DEFAULT_MESSAGE_COUNT,
+                 seen_cache_size: int = DEFAULT_SEEN_CACHE_SIZE) -> None:
+        """Creates the queue.
+
+        Args:
+            messenger_instance (InstagramMessenger): The messenger to poll
+            seen_db (InstaMessageSeenDB): Remembers processed message ids across restarts
+            callback (Callable[[MessengerInterface, dict], None]): Processes a new message
+            thread_count (int): Number of most recent threads to poll
+            message_count (int): Number of most recent messages to fetch from a thread with activity
+            seen_cache_size (int): Number of seen message ids kept in memory
+        """
         self._messenger = messenger_instance
         self._seen_db = seen_db
         self._callback = callback
         self._thread = None
-        
+        self._thread_count = thread_count
+        self._message_count = message_count
+        self._seen_cache_size = seen_cache_size
+        # thread id -> (last activity of the thread, id of the newest fetched message)
+        self._cursors: dict[str, tuple[datetime, str]] = {}
+        self._seen: OrderedDict[str, None] = OrderedDict()
+        self._stats = {
+            "polls": 0,
+            "thread_fetches": 0,
+            "db_lookups": 0,
+            "new_messages": 0,
+        }
 
     def run_async(self):
         self._thread = threading.Thread(target=self.run)
         self._thread.start()
 
     def on_new_message(self, data):
-        logging.info(f"Received new message: {data}")
+        logging.info("Received new message: %s", Truncated(data))
         self._callback(self._messenger, data)
 
+    def _remember(self, message_id: str) -> None:
+        self._seen[message_id] = None
+        self._seen.move_to_end(message_id)
+        if len(self._seen) > self._seen_cache_size:
+            self._seen.popitem(last=False)
+
+    def _filter_unseen(self, messages: list[DirectMessage]) -> list[DirectMessage]:
+        """Returns the messages that were not seen before and remembers all of them. """
+        candidates = [message for message in messages if message.id not in self._seen]
+        if len(candidates) == 0:
+            return []
+        # one query for all messages the memory does not know
+        self._stats["db_lookups"] += 1
+        seen_before = self._seen_db.get_seen_messages([message.id for message in candidates])
+        for message in candidates:
+            self._remember(message.id)
+        return [message for message in candidates if message.id not in seen_before]
+
+    def _fetch_new_messages(self, thread) -> tuple[list[DirectMessage], tuple[datetime, str]|None]:
+        """Returns the messages of a thread after the cursor, oldest first, and the new cursor.
+
+        The cursor is not stored here, it must only move once the messages were processed.
+        """
+        cursor = self._cursors.get(thread.id)
+        if cursor is not None and cursor[0] == thread.last_activity_at:
+            # nothing happened in the thread since the last poll
+            return ([], None)
+        self._stats["thread_fetches"] += 1
+        messages = self._messenger.get_instagrapi().direct_messages(int(thread.id), amount=self._message_count)
+        if len(messages) == 0:
+            return ([], None)
+        new_messages = []
+        # newest first, stop at the newest message of the last poll
+        for message in messages:
+            if cursor is not None and message.id == cursor[1]:
+                break
+            new_messages.append(message)
+        return (list(reversed(new_messages)), (thread.last_activity_at, messages[0].id))
+
+    def poll(self) -> int:
+        """Fetches new messages of all threads and passes them to the callback.
+
+        Returns:
+            int: Number of new messages
+        """
+        self._stats["polls"] += 1
+        threads = self._messenger.get_instagrapi().direct_threads(self._thread_count)
+        fetched = []
+        cursors = {}
+        for thread in threads:
+            logging.debug(f"Polling thread {thread.id} {thread.thread_title} {thread.thread_type}")
+            try:
+                messages, cursor = self._fetch_new_messages(thread)
+            except Exception as ex:
+                # e.g. rate limited, the remaining threads are fetched in the next poll
+                logging.error(f"Could not fetch messages of thread {thread.id}: {ex}")
+                break
+            fetched.extend(messages)
+            if cursor is not None:
+                cursors[thread.id] = cursor
+
+        new_messages = self._filter_unseen(fetched)
+        self._seen_db.add_seen_messages([message.id for message in new_messages])
+        self._stats["new_messages"] += len(new_messages)
+
+        for message in new_messages:
+            # skip messages that are older than 1 day
+            # TODO figure out timezone issues here
+            if datetime.now() - message.timestamp > self.MAX_MESSAGE_AGE:
+                logging.info(f"Skipping old message {message.id}")
+                continue
+            self.on_new_message(message)
+        # only threads whose messages were handed to the callback move on
+        self._cursors.update(cursors)
+        return len(new_messages)
+
+    def get_stats(self) -> dict:
+        """Returns the number of polls, fetched threads, database lookups and new messages. """
+        return dict(self._stats)
 
     def run(self):
-        cl = self._messenger.get_instagrapi()
         while True:
             try:
-                threads = cl.direct_threads(10) #, selected_filter="unread")
-                for thread in threads:
-                    print(thread.id, thread.thread_title, thread.thread_type)
-                    messages = cl.direct_messages(int(thread.id), amount=5)
-                    messages = reversed(messages)
-                    for message in messages:
-                        # skip messages that we have already seen
-                        if self._seen_db.has_seen_message(message.id):
-                            logging.info(f"Skipping seen message {message.id}")
-                            continue
-                        self._seen_db.add_seen_message(message.id)
-
-                        # skip messages that are older than 1 day
-                        # TODO figure out timezone issues here
-                        if datetime.now() - message.timestamp > timedelta(days=1):
-                            logging.info(f"Skipping old message {message.id}")
-                            continue
-                        self.on_new_message(message)
+                self.poll()
             except Exception as e:
                 logging.error(f"Error in InstagramMessageQueue: {e}")
             
             # random 45 to 75 seconds sleep to avoid rate limiting
-            time.sleep(random.randint(45, 75))
\ No newline at end of file
+            time.sleep(random.randint(45, 75))
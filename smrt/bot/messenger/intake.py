@@ -0,0 +1,136 @@
+"""Helpers to receive messages from a messenger backend without blocking its connection. """
+import logging
+import queue
+import random
+import threading
+import time
+from typing import Callable
+
+from .messenger import MessengerInterface
+
+
+class ReconnectBackoff():
+    """Exponential backoff with jitter between reconnect attempts. """
+    DEFAULT_INITIAL_DELAY = 1.0
+    DEFAULT_MAX_DELAY = 60.0
+
+    def __init__(self, initial_delay: float = DEFAULT_INITIAL_DELAY, max_delay: float = DEFAULT_MAX_DELAY) -> None:
+        """Creates the backoff.
+
+        Args:
+            initial_delay (float): Seconds before the first reconnect attempt
+            max_delay (float): Maximum seconds between two reconnect attempts
+        """
+        self._initial_delay = initial_delay
+        self._max_delay = max_delay
+        self._attempts = 0
+
+    def next_delay(self) -> float:
+        """Returns the seconds to wait before the next attempt and counts the attempt. """
+        delay = min(self._max_delay, self._initial_delay * (2 ** self._attempts))
+        self._attempts += 1
+        # jitter, so several bots don't hammer a restarted server at the same time
+        return delay * random.uniform(0.5, 1.0)
+
+    def reset(self) -> None:
+        """Starts again with the initial delay, e.g. after a stable connection. """
+        self._attempts = 0
+
+    def get_attempts(self) -> int:
+        return self._attempts
+
+
+class MessageHandOff():
+    """Bounded queue between the thread receiving messages and the callback processing them.
+
+    The receiving thread only puts messages into the queue, a worker thread calls the
+    callback. A slow callback therefore never blocks the connection to the backend. If
+    the queue is full, new messages are dropped and counted instead of blocking.
+    """
+    DEFAULT_MAX_PENDING = 1000
+
+    def __init__(self, messenger_instance: MessengerInterface,
+                 callback: Callable[[MessengerInterface, dict], None],
+                 max_pending: int = DEFAULT_MAX_PENDING) -> None:
+        """Creates the hand-off.
+
+        Args:
+            messenger_instance (MessengerInterface): The messenger passed to the callback
+            callback (Callable[[MessengerInterface, dict], None]): Processes a received message
+            max_pending (int): Maximum number of messages waiting for the callback
+        """
+        self._messenger = messenger_instance
+        self._callback = callback
+        self._queue: queue.Queue[tuple[float, dict]|None] = queue.Queue(maxsize=max_pending)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stats = {
+            "received": 0,
+            "processed": 0,
+            "failed": 0,
+            "dropped": 0,
+            "last_wait": 0.0,
+            "max_wait": 0.0,
+        }
+
+    def start(self) -> None:
+        """Starts the worker thread calling the callback. """
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._work, name=f"HandOff-{self._messenger.get_name()}", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stops the worker thread after the messages that are already waiting. """
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+
+    def put(self, message: dict) -> bool:
+        """Hands a received message over to the worker thread.
+
+        Args:
+            message (dict): The received message
+
+        Returns:
+            bool: False if the queue was full and the message was dropped
+        """
+        try:
+            self._queue.put_nowait((time.monotonic(), message))
+        except queue.Full:
+            with self._lock:
+                self._stats["dropped"] += 1
+            logging.warning(f"{self._messenger.get_name()}: too many messages waiting, dropped a message")
+            return False
+        with self._lock:
+            self._stats["received"] += 1
+        return True
+
+    def _work(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            received, message = item
+            # time the message waited for the callback, grows if processing falls behind
+            wait = time.monotonic() - received
+            with self._lock:
+                self._stats["last_wait"] = wait
+                self._stats["max_wait"] = max(self._stats["max_wait"], wait)
+            try:
+                self._callback(self._messenger, message)
+                with self._lock:
+                    self._stats["processed"] += 1
+            except Exception as ex:
+                with self._lock:
+                    self._stats["failed"] += 1
+                logging.critical(ex, exc_info=True)
+
+    def get_stats(self) -> dict:
+        """Returns counters of the hand-off and the number of waiting messages. """
+        with self._lock:
+            stats = dict(self._stats)
+        stats["pending"] = self._queue.qsize()
+        return stats
@@ -0,0 +1,184 @@
+"""Helpers to write downloaded media to disk chunk by chunk. """
+import base64
+import binascii
+import json
+import os
+import re
+from typing import BinaryIO, Iterable
+
+
+class MediaTooLargeError(ValueError):
+    """Raised when a download exceeds the allowed size. """
+
+
+class LimitedFileWriter():
+    """Writes chunks to a file and fails once more than max_size bytes were written. """
+
+    def __init__(self, file: BinaryIO, max_size: int|None = None) -> None:
+        self._file = file
+        self._max_size = max_size
+        self._size = 0
+
+    def get_size(self) -> int:
+        return self._size
+
+    def write(self, data: bytes) -> None:
+        self._size += len(data)
+        if self._max_size is not None and self._size > self._max_size:
+            raise MediaTooLargeError(f"Media is larger than {self._max_size} bytes")
+        self._file.write(data)
+
+
+class Base64StreamDecoder():
+    """Decodes base64 text that arrives in chunks of any length. """
+
+    def __init__(self, writer: LimitedFileWriter) -> None:
+        self._writer = writer
+        self._rest = b""
+        self._pending = b""
+
+    def write(self, text: bytes) -> None:
+        data = self._pending + text
+        # an escape sequence might be split between chunks
+        self._pending = b""
+        if data.endswith(b"\\") and not data.endswith(b"\\\\"):
+            self._pending = b"\\"
+            data = data[:-1]
+        # json escapes '/' and line breaks, only full 4 character groups can be decoded
+        data = data.replace(b"\\/", b"/").replace(b"\\n", b"").replace(b"\\r", b"")
+        data = self._rest + data.replace(b"\n", b"").replace(b"\r", b"")
+        usable = len(data) - len(data) % 4
+        self._rest = data[usable:]
+        if usable > 0:
+            self._writer.write(base64.b64decode(data[:usable], validate=True))
+
+    def close(self) -> None:
+        if len(self._rest) > 0 or len(self._pending) > 0:
+            raise binascii.Error("Incomplete base64 data")
+
+
+class JsonBase64FieldDecoder():
+    """Streams a json object and decodes one base64 string field of it to a file.
+
+    The other fields are kept as text, they are expected to be small, e.g. the mime type.
+    The base64 field is never held in memory completely.
+    """
+    _STATE_SEARCH = 0
+    _STATE_VALUE = 1
+    _STATE_DONE = 2
+
+    def __init__(self, field_name: str, writer: LimitedFileWriter) -> None:
+        self._start = re.compile(rb'"' + re.escape(field_name.encode()) + rb'"\s*:\s*"')
+        self._decoder = Base64StreamDecoder(writer)
+        self._state = self._STATE_SEARCH
+        self._buffer = b""
+        self._other = b""
+
+    def feed(self, chunk: bytes) -> None:
+        if self._state == self._STATE_DONE:
+            self._other += chunk
+            return
+        if self._state == self._STATE_SEARCH:
+            self._buffer += chunk
+            match = self._start.search(self._buffer)
+            if match is None:
+                # keep a tail, the field name might be split between chunks
+                split = max(0, len(self._buffer) - 64)
+                self._other += self._buffer[:split]
+                self._buffer = self._buffer[split:]
+                return
+            self._other += self._buffer[:match.start()]
+            chunk = self._buffer[match.end():]
+            self._buffer = b""
+            self._state = self._STATE_VALUE
+        # base64 has no quotes or escaped quotes, so the first quote ends the string
+        end = chunk.find(b'"')
+        if end < 0:
+            self._decoder.write(chunk)
+            return
+        self._decoder.write(chunk[:end])
+        self._decoder.close()
+        self._state = self._STATE_DONE
+        self._other += chunk[end + 1:]
+
+    def is_complete(self) -> bool:
+        return self._state == self._STATE_DONE
+
+    def get_text_field(self, field_name: str) -> str|None:
+        """Returns the value of a small string field outside of the base64 field. """
+        match = re.search(rb'"' + re.escape(field_name.encode()) + rb'"\s*:\s*"([^"]*)"', self._other + self._buffer)
+        if match is None:
+            return None
+        return match.group(1).decode("utf-8")
+
+
+def write_chunks(chunks: Iterable[bytes], file_path: str, max_size: int|None = None) -> int:
+    """Writes chunks to a file.
+
+    Args:
+        chunks (Iterable[bytes]): The data, e.g. response.iter_content()
+        file_path (str): The file to write
+        max_size (int | None): Maximum number of bytes, None for no limit
+
+    Returns:
+        int: The number of written bytes
+    """
+    with open(file_path, "wb") as file:
+        writer = LimitedFileWriter(file, max_size)
+        for chunk in chunks:
+            if chunk:
+                writer.write(chunk)
+        return writer.get_size()
+
+
+class Base64JsonBody():
+    """Json request body with base64 encoded media that is encoded while the body is sent.
+
+    The body is built from a dict that contains MEDIA once as placeholder for the base64 string.
+    Only one chunk of the media is encoded at a time, instead of holding the raw data, the base64
+    string and the json text in memory at once. The length is known upfront, so requests sends a
+    Content-Length instead of chunked encoding. The body can be iterated again for retries.
+    """
+    MEDIA = "\u0000media\u0000"
+    CHUNK_SIZE = 48 * 1024  # multiple of 3, so the chunks encode without padding
+
+    def __init__(self, body: dict, source: str|bytes, data_prefix: str = "") -> None:
+        """Creates the body.
+
+        Args:
+            body (dict): The json body with MEDIA where the base64 string belongs
+            source (str | bytes): Path of the media file or the media itself
+            data_prefix (str): Text in front of the base64 data, e.g. 'data:image/png;base64,'
+        """
+        text = json.dumps(body)
+        placeholder = json.dumps(self.MEDIA)
+        if text.count(placeholder) != 1:
+            raise ValueError("The body must contain the media placeholder exactly once")
+        prefix, suffix = text.split(placeholder)
+        self._prefix = (prefix + json.dumps(data_prefix)[:-1]).encode("utf-8")
+        self._suffix = ('"' + suffix).encode("utf-8")
+        self._source = source
+        size = len(source) if isinstance(source, bytes) else os.path.getsize(source)
+        self._length = len(self._prefix) + 4 * ((size + 2) // 3) + len(self._suffix)
+
+    def __len__(self) -> int:
+        return self._length
+
+    def _iter_source(self):
+        if isinstance(self._source, bytes):
+            view = memoryview(self._source)
+            for start in range(0, len(view), self.CHUNK_SIZE):
+                yield view[start:start + self.CHUNK_SIZE]
+            return
+        with open(self._source, "rb") as file:
+            while True:
+                chunk = file.read(self.CHUNK_SIZE)
+                if not chunk:
+                    return
+                yield chunk
+
+    def __iter__(self):
+        yield self._prefix
+        for chunk in self._iter_source():
+            yield base64.b64encode(chunk)
+        yield self._suffix
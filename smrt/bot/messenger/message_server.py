@@ -1,29 +1,112 @@
+import concurrent.futures
 import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
 from flask import Flask, request, jsonify
 import smrt.bot.messenger as messenger
+from smrt.utils import Truncated
 
 class MessageServerFlaskApp:
     """
     A flask application that serves as a message server for sending messages 
     via different messengers.
     """
-    def __init__(self, messenger_manager: messenger.MessengerManager):
+    SEND_TIMEOUT = 60
+    DEFAULT_MAX_WORKERS = 8
+    DEFAULT_MAX_JOBS = 1000
+    RESULT_SENT = "sent"
+    RESULT_QUEUED = "queued"
+    RESULT_ERROR = "error"
+
+    def __init__(self, messenger_manager: messenger.MessengerManager,
+                 max_workers: int = DEFAULT_MAX_WORKERS,
+                 max_jobs: int = DEFAULT_MAX_JOBS):
         self._app = Flask(__name__)
         self._messenger_manager = messenger_manager
+        # sends to all chats of a request at the same time, bounded over all requests
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers,
+                                                               thread_name_prefix="MessageServer")
+        # results of asynchronous requests, the oldest are forgotten first
+        self._jobs: OrderedDict[str, dict] = OrderedDict()
+        self._jobs_lock = threading.Lock()
+        self._max_jobs = max_jobs
         self._register_routes()
         self._app.logger.setLevel(logging.INFO)
 
     def get_app(self) -> Flask:
         return self._app
 
+    def _fan_out(self, chat_ids: list[str], message: str) -> dict[str, dict]:
+        """Sends the message to all chats in parallel.
+
+        Args:
+            chat_ids (list[str]): The chats to send to
+            message (str): The message text
+
+        Returns:
+            dict[str, dict]: Result per chat id with status 'sent', 'queued' or 'error'
+        """
+        submitted = {chat_id: self._executor.submit(self._messenger_manager.send_message, chat_id, message)
+                     for chat_id in chat_ids}
+        deadline = time.monotonic() + self.SEND_TIMEOUT
+        results = {}
+        for chat_id, submit_future in submitted.items():
+            try:
+                delivery = submit_future.result(timeout=max(0, deadline - time.monotonic()))
+                delivery.result(timeout=max(0, deadline - time.monotonic()))
+                results[chat_id] = {'status': self.RESULT_SENT}
+            except concurrent.futures.TimeoutError:
+                # still waiting for the rate limit, it will be sent in the background
+                results[chat_id] = {'status': self.RESULT_QUEUED}
+            except ValueError as e:
+                self._app.logger.warning(str(e))
+                results[chat_id] = {'status': self.RESULT_ERROR, 'error': str(e)}
+            except Exception as e:
+                self._app.logger.error(f"Failed to send message to {chat_id}: {e}")
+                results[chat_id] = {'status': self.RESULT_ERROR, 'error': f"Error sending message to {chat_id}: {str(e)}"}
+        return results
+
+    def _summarize(self, results: dict[str, dict]) -> dict:
+        summary = {
+            'sent_to': [chat_id for chat_id, result in results.items() if result['status'] == self.RESULT_SENT],
+            'queued': [chat_id for chat_id, result in results.items() if result['status'] == self.RESULT_QUEUED],
+            'results': results,
+        }
+        errors = [result['error'] for result in results.values() if result['status'] == self.RESULT_ERROR]
+        if len(errors) > 0:
+            summary['status'] = 'error'
+            summary['message'] = "".join(f"{error}\n" for error in errors)
+        else:
+            summary['status'] = 'success'
+        return summary
+
+    def _run_job(self, job_id: str, chat_ids: list[str], message: str) -> None:
+        summary = self._summarize(self._fan_out(chat_ids, message))
+        with self._jobs_lock:
+            if job_id in self._jobs:
+                self._jobs[job_id].update(summary)
+                self._jobs[job_id]['state'] = 'done'
+
+    def _start_job(self, chat_ids: list[str], message: str) -> str:
+        job_id = str(uuid.uuid4())
+        with self._jobs_lock:
+            self._jobs[job_id] = {'job_id': job_id, 'state': 'running'}
+            while len(self._jobs) > self._max_jobs:
+                self._jobs.popitem(last=False)
+        # not on the pool, the job waits for sends that run on the pool
+        threading.Thread(target=self._run_job, args=(job_id, chat_ids, message), daemon=True).start()
+        return job_id
+
     def _register_routes(self):
         @self._app.route('/send_message', methods=['POST'])
         def send_message():
             data = request.get_json()
-            self._app.logger.debug(f"Received data: {data}")
+            self._app.logger.debug("Received data: %s", Truncated(data))
             if not data or 'chatIds' not in data or 'message' not in data:
                 self._app.logger.error("Missing required fields in request data, expected 'chatIds' and 'message'")
-                self._app.logger.error(f"Message data: {data}")
+                self._app.logger.error("Message data: %s", Truncated(data))
                 return jsonify({'error': 'Missing required fields: chatIds and message'}), 400
 
             chat_ids = data['chatIds']
@@ -32,27 +115,24 @@ class MessageServerFlaskApp:
             if not isinstance(chat_ids, list) or not isinstance(message, str):
                 return jsonify({'error': 'Invalid types: chatids must be a list, message must be a string'}), 400
 
-            logging.debug(f"Sending message '{message}' to chat IDs: {chat_ids}")
-            error=""
-            sent_to = []
-            for chat_id in chat_ids:
-                messenger_from_chat_id = self._messenger_manager.get_messenger_by_chatid(chat_id)
-                if messenger_from_chat_id:
-                    try:
-                        messenger_from_chat_id.send_message(chat_id, message)
-                        sent_to.append(chat_id)
-                    except Exception as e:
-                        error_message = f"Error sending message to {chat_id}: {str(e)}"
-                        error += f"{error_message}\n"
-                        self._app.logger.error(f"Failed to send message to {chat_id}: {e}")
-                else:
-                    error_message = f"No messenger found for chat ID: {chat_id}"
-                    self._app.logger.warning(error_message)
-                    error+= f"{error_message}\n"
-
-            if len(error) > 0:
-                return jsonify({'status': 'error', 'message': error, 'sent_to': sent_to}), 500
-            return jsonify({'status': 'success', 'sent_to': sent_to}), 200
+            logging.debug("Sending message %s to chat IDs: %s", Truncated(message), Truncated(chat_ids))
+            if data.get('async', False):
+                job_id = self._start_job(chat_ids, message)
+                return jsonify({'status': 'accepted', 'job_id': job_id}), 202
+
+            summary = self._summarize(self._fan_out(chat_ids, message))
+            if summary['status'] == 'error':
+                return jsonify(summary), 500
+            return jsonify(summary), 200
+
+        @self._app.route('/send_message/<job_id>', methods=['GET'])
+        def get_send_message_job(job_id: str):
+            with self._jobs_lock:
+                job = self._jobs.get(job_id)
+                job = dict(job) if job is not None else None
+            if job is None:
+                return jsonify({'error': f'Unknown job id: {job_id}'}), 404
+            return jsonify(job), 200
 
     def run(self, **kwargs):
         self._app.run(**kwargs)
@@ -1,9 +1,15 @@
 """Messenger implementations for various messengers like Whatsapp. """
+import os
 from abc import ABC, abstractmethod
+from concurrent.futures import Future
 from typing import Tuple
 
+from .media import write_chunks
+
 class MessengerInterface(ABC):
     """Interface for messengers to communicate with the underlying framework. """
+    # voice notes and images are far below, larger files are most likely not meant for the bot
+    DEFAULT_MAX_MEDIA_SIZE = 50 * 1024 * 1024
 
     @abstractmethod
     def get_name(self) -> str:
@@ -13,6 +19,10 @@ class MessengerInterface(ABC):
             str: The name of the messenger
         """
 
+    def get_wrapped(self) -> "MessengerInterface":
+        """Returns the messenger implementation, wrappers return the messenger they wrap. """
+        return self
+
     @abstractmethod
     def mark_in_progress_0(self, message: dict) -> None:
         """Marks a message that it is currently in processing. """
@@ -114,6 +124,17 @@ class MessengerInterface(ABC):
     def get_message_text(self, message: dict) -> str:
         """Returns the text of the given message. """
 
+    def get_message_id(self, message: dict) -> str|None:
+        """Returns an identifier of the message that stays the same if the message is delivered again. 
+
+        Args:
+            message (dict): The incoming message
+
+        Returns:
+            str | None: unique id of the message within this messenger or None if not available
+        """
+        return None
+
     @abstractmethod
     def get_chat_id(self, message: dict) -> str:
         """Returns a unique identifier to identify the chat, e.g. a group id or sender id
@@ -145,6 +166,34 @@ class MessengerInterface(ABC):
     def send_image_to_individual(self, message, file_name, binary_data, caption = ""):
         """Sends an image to the sender of the original message in a direct chat. """
 
+    def send_image_file_to_group(self, group_message: dict, file_path: str, caption: str = ""):
+        """Sends an image file to the group of the original message.
+
+        Messengers that can stream uploads override this, the default reads the file into memory.
+
+        Args:
+            group_message (dict): The original message
+            file_path (str): Path of the image, the file name is sent along
+            caption (str): Text shown with the image
+        """
+        with open(file_path, "rb") as file:
+            binary_data = file.read()
+        self.send_image_to_group(group_message, os.path.basename(file_path), binary_data, caption)
+
+    def send_image_file_to_individual(self, message: dict, file_path: str, caption: str = ""):
+        """Sends an image file to the sender of the original message in a direct chat.
+
+        Messengers that can stream uploads override this, the default reads the file into memory.
+
+        Args:
+            message (dict): The original message
+            file_path (str): Path of the image, the file name is sent along
+            caption (str): Text shown with the image
+        """
+        with open(file_path, "rb") as file:
+            binary_data = file.read()
+        self.send_image_to_individual(message, os.path.basename(file_path), binary_data, caption)
+
     @abstractmethod
     def send_audio_to_group(self, group_message: dict, audio_file_path: str):
         """Sends an audio message to the group of the original message. """
@@ -164,6 +213,29 @@ class MessengerInterface(ABC):
             Tuple[str, bytes]: mime type and binary data of the downloaded media
         """
 
+    def download_media_to(self, message: dict, file_path: str, max_size: int|None = DEFAULT_MAX_MEDIA_SIZE) -> str|None:
+        """Downloads the media of a message into a file without keeping it in memory.
+
+        Messengers that can stream downloads override this, the default writes the result of download_media.
+
+        Args:
+            message (dict): The message with the media
+            file_path (str): The file to write the media to
+            max_size (int | None): Maximum size of the media in bytes, None for no limit
+
+        Returns:
+            str | None: mime type of the media or None if the message has no media
+
+        Raises:
+            MediaTooLargeError: If the media is larger than max_size
+        """
+        media = self.download_media(message)
+        if media is None:
+            return None
+        mime_type, binary_data = media
+        write_chunks([binary_data], file_path, max_size)
+        return mime_type
+
     @abstractmethod
     def send_typing(self, message: dict, typing: bool) -> None:
         """Sends a typing event that the we are typing. 
@@ -177,10 +249,58 @@ class MessengerManager():
     def __init__(self):
 
         self._messengers = {}
+        self._outbound_queues = {}
 
     def add_messenger(self, messenger: MessengerInterface):
         self._messengers[messenger.get_name()] = messenger
 
+    def get_messengers(self) -> list[MessengerInterface]:
+        return list(self._messengers.values())
+
+    def set_outbound_queue(self, outbound_queue) -> None:
+        """Sends messages of send_message to the messenger of the queue through the queue.
+
+        Args:
+            outbound_queue (OutboundQueue): Rate limited queue of a messenger
+        """
+        self._outbound_queues[outbound_queue.get_messenger().get_name()] = outbound_queue
+
+    def get_outbound_stats(self) -> dict:
+        return {name: outbound_queue.get_stats() for name, outbound_queue in self._outbound_queues.items()}
+
+    def send_message(self, chat_id: str, text: str) -> Future:
+        """Sends a message to a chat of any messenger, rate limited if the messenger has an outbound queue.
+
+        Args:
+            chat_id (str): The unique identifier of the chat, e.g. 'signal://+4912345'
+            text (str): The message text to send
+
+        Returns:
+            Future: Resolves to the number of attempts once the message was sent or holds the error if sending failed
+
+        Raises:
+            ValueError: If no messenger is configured for the chat id
+        """
+        messenger = self.get_messenger_by_chatid(chat_id)
+        if messenger is None:
+            raise ValueError(f"No messenger found for chat ID: {chat_id}")
+        outbound_queue = self._outbound_queues.get(messenger.get_name())
+        if outbound_queue is not None:
+            return outbound_queue.send_message(chat_id, text)
+        # without a queue the message is sent right away in a single attempt, the future
+        # holds the result like the one of the queue
+        future = Future()
+        try:
+            messenger.send_message(chat_id, text)
+        except Exception as ex:
+            future.set_exception(ex)
+            return future
+        future.set_result(1)
+        return future
+
+    def get_messenger_by_name(self, name: str) -> MessengerInterface | None:
+        return self._messengers.get(name)
+
     def get_messenger_by_chatid(self, chat_id: str) -> MessengerInterface | None:
         identifier = chat_id.split("://")[0]  # Extract the identifier from the chat_id
         if identifier in self._messengers:
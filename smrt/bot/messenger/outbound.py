@@ -0,0 +1,303 @@
+"""Rate limited queue for messages the bot sends on its own, e.g. notifications and broadcasts. """
+import logging
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import requests
+
+from .messenger import MessengerInterface
+
+
+class TokenBucket():
+    """Allows bursts of up to burst calls and rate calls per second on average. Not thread-safe. """
+
+    def __init__(self, rate: float, burst: int) -> None:
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        if burst < 1:
+            raise ValueError("burst must be at least 1")
+        self._rate = rate
+        self._burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        # now can be taken shortly before the bucket was created
+        if now <= self._updated:
+            return
+        self._tokens = min(self._burst, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+    def get_wait_time(self, now: float) -> float:
+        """Returns the seconds until a token is available, 0 if one is available now. """
+        self._refill(now)
+        if self._tokens >= 1:
+            return 0.0
+        return (1 - self._tokens) / self._rate
+
+    def consume(self, now: float) -> None:
+        """Takes a token, get_wait_time must have returned 0 before. """
+        self._refill(now)
+        self._tokens -= 1
+
+    def is_full(self, now: float) -> bool:
+        """Returns True if the bucket did not limit anything recently and can be forgotten. """
+        self._refill(now)
+        return self._tokens >= self._burst
+
+
+class OutboundJob():
+    """A message waiting to be sent. """
+    __slots__ = ("chat_id", "text", "future", "attempts", "not_before", "throttled")
+
+    def __init__(self, chat_id: str, text: str) -> None:
+        self.chat_id = chat_id
+        self.text = text
+        self.future: Future = Future()
+        self.attempts = 0
+        self.not_before = 0.0
+        self.throttled = False
+
+
+class OutboundQueue():
+    """Sends messages of one messenger in the background within rate limits.
+
+    A global token bucket limits the messages of the account, one bucket per chat limits
+    the messages to a single chat. Messages to the same chat are sent in the order they were
+    queued. Rate limit (429) and server errors (5xx) as well as connection errors are
+    retried with exponential backoff and jitter, other errors fail the message right away.
+    The caller gets a future that resolves once the message was sent or finally failed.
+    """
+    DEFAULT_RATE = 5.0
+    DEFAULT_BURST = 10
+    DEFAULT_CHAT_RATE = 1.0
+    DEFAULT_CHAT_BURST = 5
+    DEFAULT_MAX_RETRIES = 3
+    DEFAULT_RETRY_BACKOFF = 1.0
+    DEFAULT_MAX_QUEUE_SIZE = 1000
+    # sends to different chats overlap, the buckets still limit the rate
+    DEFAULT_WORKERS = 4
+
+    def __init__(self, messenger: MessengerInterface,
+                 rate: float = DEFAULT_RATE,
+                 burst: int = DEFAULT_BURST,
+                 chat_rate: float = DEFAULT_CHAT_RATE,
+                 chat_burst: int = DEFAULT_CHAT_BURST,
+                 max_retries: int = DEFAULT_MAX_RETRIES,
+                 retry_backoff: float = DEFAULT_RETRY_BACKOFF,
+                 max_queue_size: int = DEFAULT_MAX_QUEUE_SIZE,
+                 workers: int = DEFAULT_WORKERS) -> None:
+        """Creates the queue, worker threads start with the first message.
+
+        Args:
+            messenger (MessengerInterface): The messenger to send with
+            rate (float): Messages per second over all chats
+            burst (int): Messages that may be sent at once over all chats
+            chat_rate (float): Messages per second to a single chat
+            chat_burst (int): Messages that may be sent at once to a single chat
+            max_retries (int): Retries of a message after rate limit, server or connection errors
+            retry_backoff (float): Seconds before the first retry, doubled for every further retry
+            max_queue_size (int): Maximum number of waiting messages
+            workers (int): Number of threads sending in parallel, one chat is always sent in order
+        """
+        if max_retries < 0:
+            raise ValueError("max_retries must not be negative")
+        if max_queue_size < 1:
+            raise ValueError("max_queue_size must be at least 1")
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        self._messenger = messenger
+        self._bucket = TokenBucket(rate, burst)
+        self._chat_rate = chat_rate
+        self._chat_burst = chat_burst
+        # validate the chat limits right away instead of with the first message
+        TokenBucket(chat_rate, chat_burst)
+        self._chat_buckets: dict[str, TokenBucket] = {}
+        self._max_retries = max_retries
+        self._retry_backoff = retry_backoff
+        self._max_queue_size = max_queue_size
+        self._worker_count = workers
+        self._workers: list[threading.Thread] = []
+        self._condition = threading.Condition()
+        self._pending: deque[OutboundJob] = deque()
+        self._busy_chats: set[str] = set()
+        self._running = True
+        self._queued = 0
+        self._sent = 0
+        self._failed = 0
+        self._retried = 0
+        self._rejected = 0
+        self._throttled = 0
+
+    def get_messenger(self) -> MessengerInterface:
+        return self._messenger
+
+    def send_message(self, chat_id: str, text: str) -> Future:
+        """Queues a message to a chat.
+
+        Args:
+            chat_id (str): The unique identifier of the chat
+            text (str): The message text to send
+
+        Returns:
+            Future: Resolves to the number of attempts once sent, or to the error of the last attempt
+        """
+        job = OutboundJob(chat_id, text)
+        with self._condition:
+            if not self._running:
+                job.future.set_exception(RuntimeError(f"Outbound queue of {self._messenger.get_name()} is stopped"))
+                return job.future
+            if len(self._pending) >= self._max_queue_size:
+                self._rejected += 1
+                logging.warning(f"Outbound queue of {self._messenger.get_name()} is full, dropping message to {chat_id}")
+                job.future.set_exception(RuntimeError(f"Outbound queue of {self._messenger.get_name()} is full"))
+                return job.future
+            self._queued += 1
+            self._pending.append(job)
+            if len(self._workers) < self._worker_count:
+                self._start_worker()
+            self._condition.notify()
+        return job.future
+
+    def stop(self, timeout: float|None = None) -> None:
+        """Sends the waiting messages and stops the worker threads.
+
+        Args:
+            timeout (float | None): Seconds to wait for every worker, None to wait until done
+        """
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+            workers = list(self._workers)
+        for worker in workers:
+            worker.join(timeout)
+
+    def get_stats(self) -> dict:
+        """Returns the number of queued, sent, failed, retried, rejected and rate limited messages. """
+        with self._condition:
+            return {
+                "queue_depth": len(self._pending),
+                "queued": self._queued,
+                "sent": self._sent,
+                "failed": self._failed,
+                "retried": self._retried,
+                "rejected": self._rejected,
+                "throttled": self._throttled,
+            }
+
+    def _start_worker(self) -> None:
+        worker = threading.Thread(target=self._work, name=f"Outbound-{self._messenger.get_name()}", daemon=True)
+        self._workers.append(worker)
+        worker.start()
+
+    def _get_chat_bucket(self, chat_id: str) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(self._chat_rate, self._chat_burst)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    def _next_job(self) -> tuple[OutboundJob|None, float|None]:
+        # returns the next sendable job or the time to wait until one might be sendable
+        now = time.monotonic()
+        wait_time = None
+        blocked_chats = set(self._busy_chats)
+        for job in self._pending:
+            if job.chat_id in blocked_chats:
+                continue
+            # later messages of a chat must not overtake this one
+            blocked_chats.add(job.chat_id)
+            limit_wait = max(self._get_chat_bucket(job.chat_id).get_wait_time(now),
+                             self._bucket.get_wait_time(now))
+            if limit_wait > 0 and not job.throttled:
+                # counted once per job, not on every wake-up while it waits
+                job.throttled = True
+                self._throttled += 1
+            job_wait = max(job.not_before - now, limit_wait)
+            if job_wait <= 0:
+                self._pending.remove(job)
+                self._bucket.consume(now)
+                self._get_chat_bucket(job.chat_id).consume(now)
+                self._busy_chats.add(job.chat_id)
+                return (job, None)
+            wait_time = job_wait if wait_time is None else min(wait_time, job_wait)
+        return (None, wait_time)
+
+    def _forget_idle_chats(self) -> None:
+        now = time.monotonic()
+        waiting_chats = {job.chat_id for job in self._pending} | self._busy_chats
+        for chat_id in list(self._chat_buckets.keys()):
+            if chat_id not in waiting_chats and self._chat_buckets[chat_id].is_full(now):
+                del self._chat_buckets[chat_id]
+
+    def _work(self) -> None:
+        while True:
+            with self._condition:
+                job, wait_time = self._next_job()
+                while job is None:
+                    if not self._running and len(self._pending) == 0:
+                        return
+                    self._condition.wait(wait_time)
+                    job, wait_time = self._next_job()
+
+            job.attempts += 1
+            error = None
+            try:
+                self._messenger.send_message(job.chat_id, job.text)
+            except Exception as ex:
+                error = ex
+
+            retry = error is not None and self._is_retryable(error) and job.attempts <= self._max_retries
+            with self._condition:
+                self._busy_chats.discard(job.chat_id)
+                if error is None:
+                    self._sent += 1
+                elif retry:
+                    self._retried += 1
+                    delay = self._get_retry_delay(error, job.attempts)
+                    logging.warning(f"Sending to {job.chat_id} failed ({error}), retrying in {delay:.1f}s")
+                    job.not_before = time.monotonic() + delay
+                    # keep the position, so the chat stays in order
+                    self._pending.appendleft(job)
+                else:
+                    self._failed += 1
+                    logging.error(f"Failed to send message to {job.chat_id} after {job.attempts} attempts: {error}")
+                if len(self._chat_buckets) > self._max_queue_size:
+                    self._forget_idle_chats()
+                self._condition.notify_all()
+            if error is None:
+                job.future.set_result(job.attempts)
+            elif not retry:
+                job.future.set_exception(error)
+
+    @staticmethod
+    def _get_status_code(error: Exception) -> int|None:
+        response = getattr(error, "response", None)
+        if response is not None and hasattr(response, "status_code"):
+            return response.status_code
+        # e.g. telebot reports the http status as error_code
+        error_code = getattr(error, "error_code", None)
+        if isinstance(error_code, int):
+            return error_code
+        return None
+
+    def _is_retryable(self, error: Exception) -> bool:
+        if isinstance(error, (requests.ConnectionError, requests.Timeout, ConnectionError, TimeoutError)):
+            return True
+        status_code = self._get_status_code(error)
+        return status_code is not None and (status_code == 429 or status_code >= 500)
+
+    def _get_retry_delay(self, error: Exception, attempts: int) -> float:
+        response = getattr(error, "response", None)
+        headers = getattr(response, "headers", None) or {}
+        retry_after = headers.get("Retry-After")
+        if retry_after is not None:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        # jitter, so many chats hitting the limit at once don't retry at the same time
+        return self._retry_backoff * (2 ** (attempts - 1)) * random.uniform(0.5, 1.5)
@@ -2,16 +2,16 @@ import logging
 import threading
 import time
 import json
-import base64
-import subprocess
-import tempfile
-import os
-import requests
 import websockets.sync.client as wsclient
 import websockets.exceptions
 from typing import Tuple, override, Callable
 
 from .messenger import MessengerInterface
+from .http_session import PooledHttpSession
+from .group_cache import GroupIdCache
+from .media import Base64JsonBody, MediaTooLargeError, write_chunks
+from .intake import MessageHandOff, ReconnectBackoff
+from smrt.utils import AudioTranscoder
 
 class SignalMessenger(MessengerInterface):
     """Interface for messengers to communicate with the underlying framework. """
@@ -21,13 +21,24 @@ class SignalMessenger(MessengerInterface):
     REACT_CHECKMARK = "\u2714\ufe0f"
     REACT_SKIP = "\U0001F4A4"
     REACT_FAIL = "\u274c"
+    DOWNLOAD_CHUNK_SIZE = 64 * 1024
 
-    def __init__(self, number: str, host:str, port: int) -> None:
+    def __init__(self, number: str, host:str, port: int,
+                 http_session: PooledHttpSession|None = None,
+                 group_cache_ttl: float = GroupIdCache.DEFAULT_TTL,
+                 group_cache_negative_ttl: float = GroupIdCache.DEFAULT_NEGATIVE_TTL,
+                 transcoder: AudioTranscoder|None = None) -> None:
         super().__init__()
         self._number = number
         self._host = host
         self._port = port
-        self._group_cache = {}
+        if http_session is None:
+            http_session = PooledHttpSession(read_timeout=self.DEFAULT_TIMEOUT)
+        self._http = http_session
+        self._group_cache = GroupIdCache(self._fetch_groups,
+                                         ttl=group_cache_ttl,
+                                         negative_ttl=group_cache_negative_ttl)
+        self._transcoder = transcoder if transcoder is not None else AudioTranscoder()
 
     def get_host(self) -> str:
         return self._host
@@ -38,6 +49,22 @@ class SignalMessenger(MessengerInterface):
     def get_number(self) -> str:
         return self._number
 
+    def get_http_stats(self) -> dict:
+        """Returns request and connection reuse statistics of the http session to signal-cli. """
+        return self._http.get_stats()
+
+    def get_group_cache_stats(self) -> dict:
+        """Returns hit, miss and refresh statistics of the group id cache. """
+        return self._group_cache.get_stats()
+
+    def warm_up_group_cache(self) -> bool:
+        """Fetches the groups of the account, so the first group messages don't have to wait for it.
+
+        Returns:
+            bool: True if the groups could be fetched
+        """
+        return self._group_cache.warm_up()
+
     def _endpoint_url(self, endpoint, endpoint_param = None) -> str:
         if endpoint_param is not None:
             return f"http://{self._host}:{self._port}/{endpoint}/{endpoint_param}"
@@ -49,9 +76,10 @@ class SignalMessenger(MessengerInterface):
 
     def _get_group_id_from_message(self, message: dict):
         internal_id = message["envelope"]["dataMessage"]["groupInfo"]["groupId"]
-        if internal_id not in self._group_cache:
-            self._update_group_cache()
-        return self._group_cache[internal_id]
+        group_id = self._group_cache.get_group_id(internal_id)
+        if group_id is None:
+            raise KeyError(f"Unknown signal group: {internal_id}")
+        return group_id
 
     def _react(self, message: dict, reaction_text):
         if self.is_group_message(message):
@@ -65,9 +93,8 @@ class SignalMessenger(MessengerInterface):
             "timestamp": message["envelope"]["timestamp"]
         }
 
-        requests.post(self._endpoint_url("v1/reactions", self._number),
-                      json=data,
-                      timeout=self.DEFAULT_TIMEOUT)
+        self._http.post(self._endpoint_url("v1/reactions", self._number),
+                      json=data)
     @override
     def mark_in_progress_0(self, message: dict):
         self._react(message, self.REACT_HOURGLASS_FULL)
@@ -103,9 +130,8 @@ class SignalMessenger(MessengerInterface):
             "timestamp": message["envelope"]["timestamp"]
         }
         endpoint = "v1/receipts"
-        response = requests.post(self._endpoint_url(endpoint, self._number),
-                      json=data,
-                      timeout=self.DEFAULT_TIMEOUT)
+        response = self._http.post(self._endpoint_url(endpoint, self._number),
+                      json=data)
         if response.status_code != 204:
             logging.warning(f"Failed to send receipt: {response.text} on {endpoint}, code: {response.status_code}")
 
@@ -124,12 +150,10 @@ class SignalMessenger(MessengerInterface):
         # TODO: we currently don't get messages we send ourselves, but we could double check
         return False
 
-    def _update_group_cache(self):
-        response = requests.get(self._endpoint_url("v1/groups", self._number),
-                                timeout=self.DEFAULT_TIMEOUT)
-        groups = response.json()
-        for group in groups:
-            self._group_cache[group["internal_id"]] = group["id"]
+    def _fetch_groups(self) -> dict[str, str]:
+        response = self._http.get(self._endpoint_url("v1/groups", self._number))
+        response.raise_for_status()
+        return {group["internal_id"]: group["id"] for group in response.json()}
 
     @override
     def send_message(self, chat_id: str, text: str):
@@ -141,10 +165,8 @@ class SignalMessenger(MessengerInterface):
             recipient = chat_id
 
         if not recipient.startswith("+"):
-            # do group cache handling
-            if recipient not in self._group_cache:
-                self._update_group_cache()
-            recipient = self._group_cache.get(recipient, recipient)
+            # internal group ids have to be mapped to the group id, others are passed as they are
+            recipient = self._group_cache.get_group_id(recipient) or recipient
 
         data = {
             "message": text,
@@ -154,10 +176,10 @@ class SignalMessenger(MessengerInterface):
                 recipient
             ]
         }
-        #TODO: handle error codes
-        requests.post(self._endpoint_url("v2/send"),
-                      json=data,
-                      timeout=self.DEFAULT_TIMEOUT)
+        response = self._http.post(self._endpoint_url("v2/send"),
+                      json=data)
+        # let callers retry on rate limits and server errors
+        response.raise_for_status()
 
     @override
     def send_message_to_group(self, group_message: dict, text: str):
@@ -169,9 +191,8 @@ class SignalMessenger(MessengerInterface):
                 self._get_group_id_from_message(group_message)
             ]
         }
-        requests.post(self._endpoint_url("v2/send"),
-                      json=data,
-                      timeout=self.DEFAULT_TIMEOUT)
+        self._http.post(self._endpoint_url("v2/send"),
+                      json=data)
 
     @override
     def send_message_to_individual(self, message: dict, text: str):
@@ -183,9 +204,8 @@ class SignalMessenger(MessengerInterface):
                 message["envelope"]["sourceNumber"]
             ]
         }
-        requests.post(self._endpoint_url("v2/send"),
-                      json=data,
-                      timeout=self.DEFAULT_TIMEOUT)
+        self._http.post(self._endpoint_url("v2/send"),
+                      json=data)
 
     @override
     def reply_message(self, message: dict, text: str) -> None:
@@ -204,9 +224,8 @@ class SignalMessenger(MessengerInterface):
                 recipient
             ]
         }
-        requests.post(self._endpoint_url("v2/send"),
-                    json=data,
-                    timeout=self.DEFAULT_TIMEOUT)
+        self._http.post(self._endpoint_url("v2/send"),
+                    json=data)
 
     @override
     def delete_message(self, message: dict):
@@ -259,6 +278,13 @@ class SignalMessenger(MessengerInterface):
             return message["envelope"]["dataMessage"]["message"]
         return ""
 
+    @override
+    def get_message_id(self, message: dict) -> str|None:
+        # signal identifies messages by sender and timestamp, e.g. for reactions and quotes
+        envelope = message["envelope"]
+        sender = envelope.get("sourceUuid") or envelope.get("sourceNumber") or envelope.get("source")
+        return f"{sender}:{envelope['timestamp']}"
+
     @override
     def get_chat_id(self, message: dict) -> str:
         if self.is_group_message(message):
@@ -271,72 +297,48 @@ class SignalMessenger(MessengerInterface):
     def get_sender_name(self, message: dict):
         return message["envelope"]["sourceName"]
 
-    @override
-    def send_image_to_group(self, group_message: dict, file_name: str,
-                            binary_data: bytes, caption: str = ""):
-        base64data = base64.b64encode(binary_data).decode('utf-8')
-        if file_name.endswith('.webp'):
-            data_type="image/webp"
-        else:
-            data_type="image/png"
-
+    def _send_attachment(self, recipient: str, source: str|bytes, data_prefix: str):
         data = {
             "base64_attachments": [
-                f"data:{data_type};base64,{base64data}"
+                Base64JsonBody.MEDIA
             ],
             "number": self._number,
             "recipients": [
-                self._get_group_id_from_message(group_message)
+                recipient
             ]
         }
-        requests.post(self._endpoint_url("v2/send"),
-                      json=data,
-                      timeout=self.DEFAULT_TIMEOUT)
+        # the attachment is base64 encoded while it is sent instead of building the whole json in memory
+        self._http.post(self._endpoint_url("v2/send"),
+                      data=Base64JsonBody(data, source, data_prefix),
+                      headers={"Content-Type": "application/json"})
 
-    @override
-    def send_image_to_individual(self, message, file_name, binary_data, caption = ""):
-        base64data = base64.b64encode(binary_data).decode('utf-8')
+    def _send_image(self, recipient: str, file_name: str, source: str|bytes):
         if file_name.endswith('.webp'):
             data_type="image/webp"
         else:
             data_type="image/png"
+        self._send_attachment(recipient, source, f"data:{data_type};base64,")
 
-        data = {
-            "base64_attachments": [
-                f"data:{data_type};base64,{base64data}"
-            ],
-            "number": self._number,
-            "recipients": [
-                message["envelope"]["sourceNumber"]
-            ]
-        }
-        requests.post(self._endpoint_url("v2/send"),
-                      json=data,
-                      timeout=self.DEFAULT_TIMEOUT)
+    @override
+    def send_image_to_group(self, group_message: dict, file_name: str,
+                            binary_data: bytes, caption: str = ""):
+        self._send_image(self._get_group_id_from_message(group_message), file_name, binary_data)
+
+    @override
+    def send_image_to_individual(self, message, file_name, binary_data, caption = ""):
+        self._send_image(message["envelope"]["sourceNumber"], file_name, binary_data)
+
+    @override
+    def send_image_file_to_group(self, group_message: dict, file_path: str, caption: str = ""):
+        self._send_image(self._get_group_id_from_message(group_message), file_path, file_path)
+
+    @override
+    def send_image_file_to_individual(self, message: dict, file_path: str, caption: str = ""):
+        self._send_image(message["envelope"]["sourceNumber"], file_path, file_path)
 
     def _send_audio(self, recipient, audio_file_path):
-        with tempfile.TemporaryDirectory() as tmp:
-            #output_file = os.path.join(tmp, 'output.ogg')
-            #subprocess.run(["oggenc", "-o", output_file, audio_file_path], check=True)
-            output_file = os.path.join(tmp, 'output.m4a')
-            subprocess.run(["ffmpeg", "-i", audio_file_path, "-c:a", "aac", output_file, ], check=True)
-            file = open(output_file,mode='rb')
-            binary_data = file.read()
-            file.close()
-        base64data = base64.b64encode(binary_data).decode('utf-8')
-        data = {
-            "base64_attachments": [
-                #f"data:audio/ogg;base64,{base64data}"
-                f"data:audio/aac;base64,{base64data}"
-            ],
-            "number": self._number,
-            "recipients": [
-                recipient
-            ]
-        }
-        requests.post(self._endpoint_url("v2/send"),
-                      json=data,
-                      timeout=self.DEFAULT_TIMEOUT)
+        encoded = self._transcoder.encode_file(audio_file_path, AudioTranscoder.FORMAT_AAC)
+        self._send_attachment(recipient, encoded, "data:audio/aac;base64,")
 
     @override
     def send_audio_to_group(self, group_message, audio_file_path):
@@ -356,11 +358,25 @@ class SignalMessenger(MessengerInterface):
             attachment = message["envelope"]["dataMessage"]["attachments"][0]
             content_type = attachment["contentType"]
             attachment_id = attachment["id"]
-            response = requests.get(self._endpoint_url("v1/attachments", attachment_id),
-                            timeout=self.DEFAULT_TIMEOUT)
+            response = self._http.get(self._endpoint_url("v1/attachments", attachment_id))
             return (content_type, response.content)
         return None
 
+    @override
+    def download_media_to(self, message: dict, file_path: str,
+                          max_size: int|None = MessengerInterface.DEFAULT_MAX_MEDIA_SIZE) -> str|None:
+        if "dataMessage" not in message["envelope"] \
+            or "attachments" not in message["envelope"]["dataMessage"]:
+            return None
+        attachment = message["envelope"]["dataMessage"]["attachments"][0]
+        # signal tells the size upfront, too large files are not downloaded at all
+        if max_size is not None and attachment.get("size", 0) > max_size:
+            raise MediaTooLargeError(f"Attachment of {attachment['size']} bytes is larger than {max_size} bytes")
+        with self._http.get(self._endpoint_url("v1/attachments", attachment["id"]), stream=True) as response:
+            response.raise_for_status()
+            write_chunks(response.iter_content(chunk_size=self.DOWNLOAD_CHUNK_SIZE), file_path, max_size)
+        return attachment["contentType"]
+
     @override
     def send_typing(self, message: dict, typing: bool):
         if self.is_group_message(message):
@@ -373,53 +389,139 @@ class SignalMessenger(MessengerInterface):
         }
         endpoint = self._endpoint_url("v1/typing-indicator", self._number)
         if typing:
-            response = requests.put(endpoint,
-                        json=data,
-                        timeout=self.DEFAULT_TIMEOUT)
+            response = self._http.put(endpoint,
+                        json=data)
             if response.status_code != 200:
                 logging.warning(f"Failed to send typing indicator: {response.text} on {endpoint}")
         else:
-            response = requests.delete(endpoint,
-                        json=data,
-                        timeout=self.DEFAULT_TIMEOUT)
+            response = self._http.delete(endpoint,
+                        json=data)
             if response.status_code != 200:
                 logging.warning(f"Failed to send typing indicator: {response.text} on {endpoint}")
 
 
 class SignalMessageQueue():
-    """Implementation to read messages from signal cli web service """
+    """Implementation to read messages from signal cli web service
+
+    Received messages are handed over to a worker thread, so a slow callback does not delay
+    receiving the next message. The connection is reestablished with exponential backoff.
+    """
     WEBSOCKET_TIMEOUT = 600
     WEBSOCKET_MAXSIZE = 1024*1024*50
-
-    def __init__(self, messenger_instance: SignalMessenger, callback: Callable[[MessengerInterface, dict], None]) -> None:
+    # a connection that lasted this long counts as stable and resets the backoff
+    STABLE_CONNECTION_TIME = 60
+
+    def __init__(self, messenger_instance: SignalMessenger, callback: Callable[[MessengerInterface, dict], None],
+                 max_pending: int = MessageHandOff.DEFAULT_MAX_PENDING,
+                 reconnect_delay: float = ReconnectBackoff.DEFAULT_INITIAL_DELAY,
+                 max_reconnect_delay: float = ReconnectBackoff.DEFAULT_MAX_DELAY) -> None:
+        """Creates the queue.
+
+        Args:
+            messenger_instance (SignalMessenger): The messenger to receive messages for
+            callback (Callable[[MessengerInterface, dict], None]): Processes a received message
+            max_pending (int): Maximum number of messages waiting for the callback, further messages are dropped
+            reconnect_delay (float): Seconds before the first reconnect attempt
+            max_reconnect_delay (float): Maximum seconds between two reconnect attempts
+        """
         self._messenger = messenger_instance
         self._thread = None
-        self._callback = callback
-
-    def get_messages(self):
-        api_url = f"ws://{self._messenger.get_host()}:{self._messenger.get_port()}/v1/receive/{self._messenger.get_number()}"
-        web_sock = None
-
-        while True:
+        self._hand_off = MessageHandOff(messenger_instance, callback, max_pending)
+        self._backoff = ReconnectBackoff(reconnect_delay, max_reconnect_delay)
+        self._stop_event = threading.Event()
+        self._web_sock = None
+        self._lock = threading.Lock()
+        self._connected = False
+        self._reconnects = 0
+        self._last_lag = None
+        self._max_lag = 0.0
+
+    def _receive(self, web_sock) -> None:
+        """Reads messages until the connection is closed. """
+        while not self._stop_event.is_set():
             try:
-                if web_sock is None:
-                    web_sock = wsclient.connect(api_url, max_size=self.WEBSOCKET_MAXSIZE)
-                    logging.info("Connected to Signal Service")
                 message = json.loads(web_sock.recv())
-                # TODO: fix logs
+            except json.JSONDecodeError as ex:
+                logging.warning(f"Received invalid json from signal service: {ex}")
+                continue
+            envelope = message.get("envelope", {})
+            if "timestamp" in envelope:
+                # time between sending the message and receiving it here
+                lag = max(0.0, time.time() - envelope["timestamp"] / 1000)
+                with self._lock:
+                    self._last_lag = lag
+                    self._max_lag = max(self._max_lag, lag)
+            # the accessors are only evaluated if they are logged
+            if logging.getLogger().isEnabledFor(logging.DEBUG):
                 logging.debug(message)
                 logging.debug(f"is_group_message: {self._messenger.is_group_message(message)}")
                 logging.debug(f"has_audio_data: {self._messenger.has_audio_data(message)}")
                 logging.debug(f"get_message_text: {self._messenger.get_message_text(message)}")
 
-                if "dataMessage" in message["envelope"]:
-                    self._callback(self._messenger, message)
-            except (TimeoutError, websockets.exceptions.ConnectionClosed, \
-                    ConnectionRefusedError, ConnectionError):
-                logging.warning("Failed to connect to signal service, retrying")
-                web_sock = None
-                time.sleep(3)
+            if "dataMessage" in envelope:
+                self._hand_off.put(message)
+
+    def get_messages(self):
+        api_url = f"ws://{self._messenger.get_host()}:{self._messenger.get_port()}/v1/receive/{self._messenger.get_number()}"
+        self._hand_off.start()
+        while not self._stop_event.is_set():
+            connected_at = None
+            try:
+                with wsclient.connect(api_url, max_size=self.WEBSOCKET_MAXSIZE) as web_sock:
+                    connected_at = time.monotonic()
+                    with self._lock:
+                        self._web_sock = web_sock
+                        self._connected = True
+                    logging.info("Connected to Signal Service")
+                    self._receive(web_sock)
+            except (TimeoutError, OSError, websockets.exceptions.WebSocketException) as ex:
+                if not self._stop_event.is_set():
+                    logging.warning(f"Connection to signal service failed: {ex}")
+            except Exception as ex:
+                logging.critical(ex, exc_info=True)
+            finally:
+                with self._lock:
+                    self._web_sock = None
+                    self._connected = False
+
+            if self._stop_event.is_set():
+                break
+            if connected_at is not None and time.monotonic() - connected_at >= self.STABLE_CONNECTION_TIME:
+                self._backoff.reset()
+            delay = self._backoff.next_delay()
+            with self._lock:
+                self._reconnects += 1
+            logging.warning(f"Reconnecting to signal service in {delay:.1f}s (attempt {self._backoff.get_attempts()})")
+            self._stop_event.wait(delay)
 
     def run_async(self):
         self._thread = threading.Thread(target=self.get_messages)
         self._thread.start()
+
+    def stop(self) -> None:
+        """Closes the connection and stops processing messages. """
+        self._stop_event.set()
+        with self._lock:
+            web_sock = self._web_sock
+        if web_sock is not None:
+            web_sock.close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._hand_off.stop()
+
+    def get_stats(self) -> dict:
+        """Returns the connection state, reconnects, inbound lag and the counters of the message hand-off.
+
+        'last_lag' and 'max_lag' are the seconds between sending a message and receiving it,
+        'last_wait' and 'max_wait' are the seconds received messages waited for the callback.
+        """
+        with self._lock:
+            stats = {
+                "connected": self._connected,
+                "reconnects": self._reconnects,
+                "last_lag": self._last_lag,
+                "max_lag": self._max_lag,
+            }
+        stats.update(self._hand_off.get_stats())
+        return stats
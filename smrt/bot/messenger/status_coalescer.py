@@ -0,0 +1,228 @@
+"""Coalescing of the progress reactions and typing indicators that pipelines send for a message. """
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from .messenger import MessengerInterface
+
+
+class _StatusEntry():
+    """Status of one message: the last sent mark, a deferred mark and the order of marks. """
+    __slots__ = ("messenger", "message", "sent", "pending", "pending_version", "deadline",
+                 "version", "sent_version", "send_lock")
+
+    def __init__(self, messenger: MessengerInterface, message: dict) -> None:
+        self.messenger = messenger
+        self.message = message
+        self.sent: str|None = None
+        self.pending: str|None = None
+        self.pending_version = 0
+        self.deadline = 0.0
+        self.version = 0
+        self.sent_version = 0
+        self.send_lock = threading.Lock()
+
+
+class StatusCoalescer():
+    """Sends only the net change of the progress marks of a message.
+
+    Each mark is a reaction and a typing indicator, so two API calls. Progress marks are
+    deferred for a short window: if the message finishes within the window, only the final
+    mark is sent. A progress mark that is superseded by another progress mark within the
+    window is dropped, as are marks that repeat the current state. Final marks are sent
+    right away, deferred marks are sent by a background thread once their window passed.
+    """
+    DEFAULT_WINDOW = 0.5
+    DEFAULT_MAX_ENTRIES = 1000
+    STATUS_PROGRESS_0 = "mark_in_progress_0"
+    STATUS_PROGRESS_50 = "mark_in_progress_50"
+    STATUS_DONE = "mark_in_progress_done"
+    STATUS_FAIL = "mark_in_progress_fail"
+    STATUS_SKIPPED = "mark_skipped"
+    PROGRESS_STATUSES = [STATUS_PROGRESS_0, STATUS_PROGRESS_50]
+    FINAL_STATUSES = [STATUS_DONE, STATUS_FAIL, STATUS_SKIPPED]
+
+    def __init__(self, window: float = DEFAULT_WINDOW, max_entries: int = DEFAULT_MAX_ENTRIES) -> None:
+        """Creates the coalescer.
+
+        Args:
+            window (float): Seconds a progress mark is held back, 0 sends every mark immediately
+            max_entries (int): Number of messages whose last state is remembered
+        """
+        if window < 0:
+            raise ValueError("window must not be negative")
+        if max_entries < 1:
+            raise ValueError("max_entries must be at least 1")
+        self._window = window
+        self._max_entries = max_entries
+        self._condition = threading.Condition()
+        self._entries: OrderedDict[str, _StatusEntry] = OrderedDict()
+        self._deferred: list[tuple[float, int, _StatusEntry]] = []
+        self._sequence = itertools.count()
+        self._thread = None
+        self._running = True
+        self._requested = 0
+        self._sent = 0
+        self._dropped = 0
+
+    def wrap(self, messenger: MessengerInterface) -> "StatusCoalescingMessenger":
+        """Returns a messenger that sends its progress marks through this coalescer. """
+        return StatusCoalescingMessenger(messenger, self)
+
+    def set_status(self, messenger: MessengerInterface, message: dict, status: str) -> None:
+        """Requests a progress mark for a message.
+
+        Args:
+            messenger (MessengerInterface): The messenger the message came from
+            message (dict): The message to mark
+            status (str): One of PROGRESS_STATUSES or FINAL_STATUSES
+        """
+        if status not in self.PROGRESS_STATUSES and status not in self.FINAL_STATUSES:
+            raise ValueError(f"Unknown status {status}")
+        key = self._get_key(messenger, message)
+        with self._condition:
+            self._requested += 1
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = _StatusEntry(messenger, message)
+                self._entries[key] = entry
+                if len(self._entries) > self._max_entries:
+                    self._entries.popitem(last=False)
+            else:
+                self._entries.move_to_end(key)
+            current = entry.pending if entry.pending is not None else entry.sent
+            if status == current:
+                self._dropped += 1
+                return
+            entry.version += 1
+            if entry.pending is not None:
+                # the deferred mark was superseded before it was sent
+                self._dropped += 1
+            if status in self.PROGRESS_STATUSES and self._window > 0:
+                if entry.pending is None:
+                    entry.deadline = time.monotonic() + self._window
+                    heapq.heappush(self._deferred, (entry.deadline, next(self._sequence), entry))
+                    self._ensure_thread()
+                    self._condition.notify()
+                entry.pending = status
+                entry.pending_version = entry.version
+                return
+            entry.pending = None
+            entry.sent = status
+            version = entry.version
+        self._send(entry, status, version)
+
+    def flush(self) -> None:
+        """Sends all deferred marks now. """
+        with self._condition:
+            deferred = [self._pop_pending(entry) for _, _, entry in self._deferred]
+            self._deferred.clear()
+        for entry, status, version in deferred:
+            if status is not None:
+                self._send(entry, status, version, background=True)
+
+    def close(self) -> None:
+        """Sends all deferred marks and stops the background thread. """
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+        self.flush()
+
+    def get_stats(self) -> dict:
+        """Returns the number of requested, sent and dropped marks. """
+        with self._condition:
+            return {
+                "requested": self._requested,
+                "sent": self._sent,
+                "dropped": self._dropped,
+                "deferred": len(self._deferred),
+            }
+
+    def _get_key(self, messenger: MessengerInterface, message: dict) -> str:
+        message_id = messenger.get_message_id(message)
+        if message_id is None:
+            # the entry keeps the message alive, so its id is not reused while the entry exists
+            message_id = f"object-{id(message)}"
+        return f"{messenger.get_name()}:{message_id}"
+
+    def _pop_pending(self, entry: _StatusEntry) -> tuple[_StatusEntry, str|None, int]:
+        status = entry.pending
+        entry.pending = None
+        if status is not None:
+            entry.sent = status
+        return (entry, status, entry.pending_version)
+
+    def _ensure_thread(self) -> None:
+        if self._thread is None and self._running:
+            self._thread = threading.Thread(target=self._run, name="StatusCoalescer", daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while self._running and (len(self._deferred) == 0 or self._deferred[0][0] > time.monotonic()):
+                    timeout = self._deferred[0][0] - time.monotonic() if len(self._deferred) > 0 else None
+                    self._condition.wait(timeout)
+                if not self._running:
+                    return
+                deadline, _, entry = heapq.heappop(self._deferred)
+                if entry.deadline != deadline:
+                    # the mark of this window was superseded and a new window started since
+                    continue
+                entry, status, version = self._pop_pending(entry)
+            if status is not None:
+                self._send(entry, status, version, background=True)
+
+    def _send(self, entry: _StatusEntry, status: str, version: int, background: bool = False) -> None:
+        with entry.send_lock:
+            if version <= entry.sent_version:
+                # a later mark was sent in the meantime, e.g. the final mark overtook a deferred one
+                with self._condition:
+                    self._dropped += 1
+                return
+            entry.sent_version = version
+            with self._condition:
+                self._sent += 1
+            try:
+                getattr(entry.messenger, status)(entry.message)
+            except Exception as ex:
+                if not background:
+                    raise
+                # nobody waits for deferred marks, so their errors can only be logged
+                logging.warning(f"Could not send {status} to {entry.messenger.get_name()}: {ex}")
+
+
+class StatusCoalescingMessenger():
+    """Messenger that passes progress marks through a StatusCoalescer and everything else to the messenger. """
+
+    def __init__(self, messenger: MessengerInterface, coalescer: StatusCoalescer) -> None:
+        self._messenger = messenger
+        self._coalescer = coalescer
+
+    def __getattr__(self, name: str):
+        return getattr(self._messenger, name)
+
+    def get_wrapped(self) -> MessengerInterface:
+        """Returns the wrapped messenger, e.g. for type checks. """
+        return self._messenger
+
+    def mark_in_progress_0(self, message: dict) -> None:
+        self._coalescer.set_status(self._messenger, message, StatusCoalescer.STATUS_PROGRESS_0)
+
+    def mark_in_progress_50(self, message: dict) -> None:
+        self._coalescer.set_status(self._messenger, message, StatusCoalescer.STATUS_PROGRESS_50)
+
+    def mark_in_progress_done(self, message: dict) -> None:
+        self._coalescer.set_status(self._messenger, message, StatusCoalescer.STATUS_DONE)
+
+    def mark_in_progress_fail(self, message: dict) -> None:
+        self._coalescer.set_status(self._messenger, message, StatusCoalescer.STATUS_FAIL)
+
+    def mark_skipped(self, message: dict) -> None:
+        self._coalescer.set_status(self._messenger, message, StatusCoalescer.STATUS_SKIPPED)
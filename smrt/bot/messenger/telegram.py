@@ -2,8 +2,13 @@ import logging
 import threading
 import tempfile
 from typing import override, Callable
+import requests
 import telebot
 from .messenger import MessengerInterface
+from smrt.utils import Truncated
+from .http_session import PooledHttpSession
+from .media import MediaTooLargeError, write_chunks
+
 class TelegramMessenger(MessengerInterface):
     """Messenger implemention based on telebot api"""
     REACT_HOURGLASS_HALF = "\u231b"
@@ -12,8 +17,21 @@ class TelegramMessenger(MessengerInterface):
     REACT_SKIP = "\U0001F4A4"
     REACT_FAIL = "\u274c"
 
-    def __init__(self, api_key: str):
+    DOWNLOAD_CHUNK_SIZE = 64 * 1024
+    FILE_URL = "https://api.telegram.org/file/bot{0}/{1}"
+    AUDIO_TYPES = ["audio/ogg", "audio/mpeg", "audio/mp4", "audio/aac", "audio/x-m4a", "audio/wav"]
+    IMAGE_TYPES = ["image/png", "image/jpeg", "image/jpg"]
+
+    def __init__(self, api_key: str, http_session: PooledHttpSession|None = None):
+        """Creates the messenger.
+
+        Args:
+            api_key (str): The token of the bot
+            http_session (PooledHttpSession | None): Session for media downloads, a default session if None
+        """
+        self._api_key = api_key
         self._telebot = telebot.TeleBot(api_key)
+        self._http = http_session if http_session is not None else PooledHttpSession()
 
     def get_telebot(self) -> telebot.TeleBot:
         return self._telebot
@@ -43,6 +61,11 @@ class TelegramMessenger(MessengerInterface):
         # Telegram API does not support marking messages as seen
         return
 
+    @override
+    def mark_unseen(self, message: dict | telebot.types.Message) -> None:
+        # Telegram API does not support marking messages as unseen
+        return
+
     @override
     def is_group_message(self, message: dict | telebot.types.Message) -> bool:
         return message.chat.type in ['group', 'supergroup']
@@ -118,15 +141,31 @@ class TelegramMessenger(MessengerInterface):
     def send_audio_to_individual(self, message: dict | telebot.types.Message, audio_file_path):
         pass
 
+    def _get_media(self, message: telebot.types.Message) -> tuple[str, str, int|None]|None:
+        """Returns file id, mime type and size of the media of a message or None if there is none. """
+        if message.voice is not None:
+            # voice notes are always opus in ogg
+            return (message.voice.file_id, message.voice.mime_type or "audio/ogg", message.voice.file_size)
+        if message.audio is not None and message.audio.mime_type in self.AUDIO_TYPES:
+            return (message.audio.file_id, message.audio.mime_type, message.audio.file_size)
+        if message.photo:
+            # photos come in several sizes, the last one is the largest
+            photo = message.photo[-1]
+            return (photo.file_id, "image/jpeg", photo.file_size)
+        if message.document is not None and message.document.mime_type in self.IMAGE_TYPES:
+            # images sent as file are not compressed
+            return (message.document.file_id, message.document.mime_type, message.document.file_size)
+        return None
+
     @override
-    def has_audio_data(self, message: dict):
-        # TODO detect media type
-        return False
+    def has_audio_data(self, message: telebot.types.Message):
+        media = self._get_media(message)
+        return media is not None and media[1].startswith("audio/")
 
     @override
-    def has_image_data(self, message: dict):
-        # TODO detect media type
-        return False
+    def has_image_data(self, message: telebot.types.Message):
+        media = self._get_media(message)
+        return media is not None and media[1].startswith("image/")
 
     @override
     def is_bot_mentioned(self, message: dict):
@@ -135,7 +174,17 @@ class TelegramMessenger(MessengerInterface):
 
     @override
     def get_message_text(self, message: dict | telebot.types.Message) -> str:
-        return message.text
+        if message.text is not None:
+            return message.text
+        # media messages carry their text as caption
+        if message.caption is not None:
+            return message.caption
+        return ""
+
+    @override
+    def get_message_id(self, message: telebot.types.Message) -> str|None:
+        # message ids are only unique within a chat
+        return f"{message.chat.id}:{message.message_id}"
 
     @override
     def get_chat_id(self, message: telebot.types.Message) -> str:
@@ -146,10 +195,39 @@ class TelegramMessenger(MessengerInterface):
         return message.from_user.first_name if message.from_user else "Unknown"
 
     @override
-    def download_media(self, message):
-        # TODO: implement
-        #return (mime_type, decoded)
-        return None
+    def download_media(self, message: telebot.types.Message):
+        media = self._get_media(message)
+        if media is None:
+            return None
+        file_id, mime_type, _ = media
+        file_info = self._telebot.get_file(file_id)
+        return (mime_type, self._telebot.download_file(file_info.file_path))
+
+    @override
+    def download_media_to(self, message: telebot.types.Message, file_path: str,
+                          max_size: int|None = MessengerInterface.DEFAULT_MAX_MEDIA_SIZE) -> str|None:
+        media = self._get_media(message)
+        if media is None:
+            return None
+        file_id, mime_type, file_size = media
+        # telegram tells the size upfront, too large files are not downloaded at all
+        if max_size is not None and file_size is not None and file_size > max_size:
+            raise MediaTooLargeError(f"Media of {file_size} bytes is larger than {max_size} bytes")
+        file_info = self._telebot.get_file(file_id)
+        url = self.FILE_URL.format(self._api_key, file_info.file_path)
+        try:
+            with self._http.get(url, stream=True) as response:
+                if not response.ok:
+                    raise requests.exceptions.HTTPError(
+                        f"Download of {file_info.file_path} failed with status {response.status_code}")
+                write_chunks(response.iter_content(chunk_size=self.DOWNLOAD_CHUNK_SIZE), file_path, max_size)
+        except requests.exceptions.RequestException as ex:
+            # the url contains the bot token, it must not end up in the logs
+            raise type(ex)(str(ex).replace(self._api_key, "<token>")) from None
+        return mime_type
+
+    def get_http_stats(self) -> dict:
+        return self._http.get_stats()
 
     @override
     def send_typing(self, message: dict, typing: bool):
@@ -175,9 +253,10 @@ class TelegramMessageQueue():
                 "Just say anything nice and I'll say the exact same thing to you!"
             ))
 
-        @self._telebot.message_handler(func=lambda message: True)
+        @self._telebot.message_handler(func=lambda message: True,
+                                       content_types=['text', 'voice', 'audio', 'photo', 'document'])
         def handle_message(message):
-            logging.info(f"Received new message: {message}")
+            logging.info("Received new message: %s", Truncated(message))
             self._callback(self._messenger, message)
             
 
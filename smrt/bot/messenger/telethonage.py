@@ -1,13 +1,17 @@
 import asyncio
-from typing import override, Callable
+import concurrent.futures
+import io
+from typing import override, Callable, Awaitable
 import logging
 import threading
 
 from .messenger import MessengerInterface
+from .media import LimitedFileWriter, MediaTooLargeError
+from .intake import MessageHandOff
 from telethon import TelegramClient, events
 from telethon.tl.types import Message
 from telethon.tl.types import PeerUser, PeerChat, PeerChannel
-import yaml
+from smrt.utils import AudioTranscoder
 
 
 class TelethonMessenger(MessengerInterface):
@@ -17,19 +21,133 @@ class TelethonMessenger(MessengerInterface):
     REACT_CHECKMARK = "\u2714\ufe0f"
     REACT_SKIP = "\U0001F4A4"
     REACT_FAIL = "\u274c"
-
-    def __init__(self, api_id: str, api_key: str, bot_token: str):
+    SEND_TIMEOUT = 60
+    DOWNLOAD_TIMEOUT = 600
+    AUDIO_TYPES = ["audio/ogg", "audio/mpeg", "audio/mp4", "audio/aac", "audio/x-m4a", "audio/wav"]
+    IMAGE_TYPES = ["image/png", "image/jpeg", "image/jpg"]
+
+    def __init__(self, api_id: str, api_key: str, bot_token: str, transcoder: AudioTranscoder|None = None):
+        """Creates the messenger.
+
+        Args:
+            api_id (str): Telegram api id
+            api_key (str): Telegram api hash
+            bot_token (str): The token of the bot
+            transcoder (AudioTranscoder | None): Encodes voice replies, a default transcoder if None
+        """
         self._api_id = api_id
         self._api_key = api_key
         self._bot_token = bot_token
         self._client = None
-        
+        self._transcoder = transcoder if transcoder is not None else AudioTranscoder()
+        # calls from other threads wait here until the loop runs them together
+        self._pending: list[tuple[Callable[[], Awaitable], concurrent.futures.Future]] = []
+        self._pending_lock = threading.Lock()
+        self._flush_scheduled = False
+        self._tasks = set()
+        # tasks of the calls that are running, only used on the loop
+        self._running: dict[concurrent.futures.Future, asyncio.Task] = {}
+        self._stats = {"calls": 0, "batches": 0, "max_batch": 0}
+
 
     def get_telebot(self) -> TelegramClient:
         if self._client is None:
             self._client = TelegramClient('bot', self._api_id, self._api_key).start(bot_token=self._bot_token)
         return self._client
 
+    def _submit(self, call: Callable[[], Awaitable]) -> concurrent.futures.Future:
+        """Schedules a coroutine on the loop of the client from another thread.
+
+        Calls submitted while the loop is busy are started together in one batch, so a
+        burst of replies wakes the loop once instead of once per call.
+
+        Args:
+            call (Callable[[], Awaitable]): Creates the coroutine to run on the loop
+
+        Returns:
+            concurrent.futures.Future: Result of the coroutine
+        """
+        if self._client is None:
+            raise RuntimeError("Telethon client is not started")
+        loop = self._client.loop
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is loop:
+            raise RuntimeError("Blocking telethon calls must not be made from the event loop")
+        future = concurrent.futures.Future()
+        with self._pending_lock:
+            self._pending.append((call, future))
+            schedule = not self._flush_scheduled
+            self._flush_scheduled = True
+        if schedule:
+            loop.call_soon_threadsafe(self._start_flush)
+        return future
+
+    def _start_flush(self) -> None:
+        task = self._client.loop.create_task(self._flush())
+        # the loop only keeps weak references to tasks
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _flush(self) -> None:
+        with self._pending_lock:
+            batch = self._pending
+            self._pending = []
+            self._flush_scheduled = False
+            self._stats["calls"] += len(batch)
+            self._stats["batches"] += 1
+            self._stats["max_batch"] = max(self._stats["max_batch"], len(batch))
+        await asyncio.gather(*(self._run(call, future) for call, future in batch))
+
+    async def _run(self, call: Callable[[], Awaitable], future: concurrent.futures.Future) -> None:
+        if not future.set_running_or_notify_cancel():
+            return
+        task = asyncio.ensure_future(call())
+        self._running[future] = task
+        try:
+            future.set_result(await task)
+        except asyncio.CancelledError:
+            future.set_exception(concurrent.futures.CancelledError())
+        except Exception as ex:
+            future.set_exception(ex)
+        finally:
+            del self._running[future]
+
+    async def _cancel_running(self, future: concurrent.futures.Future) -> None:
+        task = self._running.get(future)
+        if task is not None:
+            task.cancel()
+            await asyncio.wait([task])
+
+    def _call(self, call: Callable[[], Awaitable], timeout: float|None = None):
+        """Runs a coroutine on the loop of the client and waits for the result.
+
+        If the result is not there in time, the coroutine is cancelled and this returns only
+        after it stopped, so it does not use objects of the caller anymore, e.g. an open file.
+
+        Args:
+            call (Callable[[], Awaitable]): Creates the coroutine to run on the loop
+            timeout (float | None): Seconds to wait for the result, SEND_TIMEOUT if None
+
+        Returns:
+            The result of the coroutine
+        """
+        future = self._submit(call)
+        try:
+            return future.result(timeout=timeout if timeout is not None else self.SEND_TIMEOUT)
+        except concurrent.futures.TimeoutError:
+            # a call that did not start yet is simply dropped, a running one is cancelled
+            if not future.cancel():
+                asyncio.run_coroutine_threadsafe(self._cancel_running(future), self._client.loop).result()
+            raise
+
+    def get_send_stats(self) -> dict:
+        """Returns the number of calls run on the loop and how many were batched together. """
+        with self._pending_lock:
+            return dict(self._stats)
+
     @override
     def get_name(self) -> str:
         return "telethon"
@@ -77,51 +195,65 @@ class TelethonMessenger(MessengerInterface):
 
     @override
     def send_message(self, chat_id: str, text: str):
-        # chat_id is in the format "telegram://<chat-id>"
+        # chat_id is in the format "telethon://<chat-id>"
         if chat_id.startswith("telethon://"):
             chat_id = chat_id.split("telethon://")[1]
-        #self._telebot.send_message(chat_id, text, parse_mode='Markdown')
+        self._call(lambda: self._client.send_message(int(chat_id), text))
 
     @override
     def send_message_to_group(self, group_message: dict | Message, text: str):
-        pass
+        self._call(lambda: self._client.send_message(group_message.chat_id, text))
 
     @override
     def send_message_to_individual(self, message: dict | Message, text: str):
         # user needs to send at least one message to the bot before we can send messages to them
-        pass
+        self._call(lambda: self._client.send_message(message.sender_id, text))
 
     @override
     def reply_message(self, message: dict | Message, text: str) -> None:
-        asyncio.run_coroutine_threadsafe(message.reply(text), self._client.loop)
+        self._call(lambda: message.reply(text))
 
     @override
-    def delete_message(self, message: dict):
-        pass
+    def delete_message(self, message: dict | Message):
+        self._call(lambda: self._client.delete_messages(message.chat_id, [message.id]))
 
     @override
     def _send_image(self, chat_id, file_name, binary_data, caption=""):
-        pass
+        # telethon takes the file name from the name attribute
+        image = io.BytesIO(binary_data)
+        image.name = file_name
+        self._call(lambda: self._client.send_file(chat_id, image, caption=caption))
 
     @override
     def send_image_to_group(self, group_message: dict | Message, file_name, binary_data, caption = ""):
-        # TODO: test
-        self._send_image(group_message.chat.id, file_name, binary_data, caption)
-
+        self._send_image(group_message.chat_id, file_name, binary_data, caption)
 
     @override
     def send_image_to_individual(self, message: dict | Message, file_name, binary_data, caption = ""):
-        # TODO: test
-        user_id = message.from_user.id
-        self._send_image(user_id, file_name, binary_data, caption)
+        self._send_image(message.sender_id, file_name, binary_data, caption)
+
+    @override
+    def send_image_file_to_group(self, group_message: dict | Message, file_path: str, caption: str = ""):
+        # telethon uploads files from disk in parts
+        self._call(lambda: self._client.send_file(group_message.chat_id, file_path, caption=caption))
+
+    @override
+    def send_image_file_to_individual(self, message: dict | Message, file_path: str, caption: str = ""):
+        self._call(lambda: self._client.send_file(message.sender_id, file_path, caption=caption))
+
+    def _send_audio(self, chat_id, audio_file_path: str):
+        # telegram only shows ogg opus as voice note
+        voice = io.BytesIO(self._transcoder.encode_file(audio_file_path, AudioTranscoder.FORMAT_OPUS))
+        voice.name = "voice.ogg"
+        self._call(lambda: self._client.send_file(chat_id, voice, voice_note=True))
 
     @override
     def send_audio_to_group(self, group_message: dict | Message, audio_file_path):
-        pass
+        self._send_audio(group_message.chat_id, audio_file_path)
 
     @override
     def send_audio_to_individual(self, message: dict | Message, audio_file_path):
-        pass
+        self._send_audio(message.sender_id, audio_file_path)
     
     @override
     def create_poll(self, message: dict | Message, question: str, options: list[str]):
@@ -135,15 +267,22 @@ class TelethonMessenger(MessengerInterface):
     def close_poll(self, message: dict | Message):
         pass
 
+    def _get_mime_type(self, message: Message) -> str|None:
+        if message.photo is not None:
+            return "image/jpeg"
+        if message.file is None:
+            return None
+        return message.file.mime_type
+
     @override
-    def has_audio_data(self, message: dict):
-        # TODO detect media type
-        return False
+    def has_audio_data(self, message: Message):
+        if message.voice is not None:
+            return True
+        return message.audio is not None and self._get_mime_type(message) in self.AUDIO_TYPES
 
     @override
-    def has_image_data(self, message: dict):
-        # TODO detect media type
-        return False
+    def has_image_data(self, message: Message):
+        return self._get_mime_type(message) in self.IMAGE_TYPES
 
     @override
     def is_bot_mentioned(self, message: dict):
@@ -152,7 +291,13 @@ class TelethonMessenger(MessengerInterface):
 
     @override
     def get_message_text(self, message: dict | Message) -> str:
-        return message.text
+        # media messages carry their text as caption, which telethon also returns as text
+        return message.text if message.text is not None else ""
+
+    @override
+    def get_message_id(self, message: Message) -> str|None:
+        # message ids are only unique within a chat, chat is None if the entity is not cached
+        return f"{message.chat_id}:{message.id}"
 
     @override
     def get_chat_id(self, message: Message) -> str:
@@ -164,10 +309,27 @@ class TelethonMessenger(MessengerInterface):
         return "Unknown"
 
     @override
-    def download_media(self, message):
-        # TODO: implement
-        #return (mime_type, decoded)
-        return None
+    def download_media(self, message: Message):
+        if message.media is None:
+            return None
+        data = self._call(lambda: self._client.download_media(message, file=bytes), timeout=self.DOWNLOAD_TIMEOUT)
+        return (self._get_mime_type(message), data)
+
+    @override
+    def download_media_to(self, message: Message, file_path: str,
+                          max_size: int|None = MessengerInterface.DEFAULT_MAX_MEDIA_SIZE) -> str|None:
+        if message.media is None:
+            return None
+        # telegram tells the size upfront, too large files are not downloaded at all
+        if max_size is not None and message.file is not None and message.file.size is not None \
+                and message.file.size > max_size:
+            raise MediaTooLargeError(f"Media of {message.file.size} bytes is larger than {max_size} bytes")
+        # telethon downloads in parts and writes them to the file, the writer enforces
+        # the limit if telegram did not tell the size
+        with open(file_path, "wb") as file:
+            writer = LimitedFileWriter(file, max_size)
+            self._call(lambda: self._client.download_media(message, file=writer), timeout=self.DOWNLOAD_TIMEOUT)
+        return self._get_mime_type(message)
 
     @override
     def send_typing(self, message: dict, typing: bool):
@@ -175,10 +337,15 @@ class TelethonMessenger(MessengerInterface):
 
 
 class TelethonMessageQueue:
-    def __init__(self, messenger_instance: TelethonMessenger, callback):
-        self._messenger = messenger_instance
-        self._callback = callback
+    """Receives messages through the event loop of the telethon client.
+
+    The event handler only hands messages over to a worker thread, so processing never
+    blocks the loop that also runs the sends of the messenger.
+    """
+    def __init__(self, messenger_instance: TelethonMessenger, callback: Callable[[MessengerInterface, dict], None],
+                 max_pending: int = MessageHandOff.DEFAULT_MAX_PENDING):
         self._messenger = messenger_instance
+        self._hand_off = MessageHandOff(messenger_instance, callback, max_pending)
         self._thread = None
 
     def _run_client_loop(self):
@@ -189,11 +356,15 @@ class TelethonMessageQueue:
         # Register handlers
         @client.on(events.NewMessage)
         async def handle_message(event):
-            self._callback(self._messenger, event.message)
+            self._hand_off.put(event.message)
         # Start the client in this thread
-        #loop.run_until_complete(client.start())
         loop.run_until_complete(client.run_until_disconnected())
 
     def run_async(self):
+        self._hand_off.start()
         self._thread = threading.Thread(target=self._run_client_loop, daemon=True)
-        self._thread.start()
\ No newline at end of file
+        self._thread.start()
+
+    def get_stats(self) -> dict:
+        """Returns the counters of the message hand-off. """
+        return self._hand_off.get_stats()
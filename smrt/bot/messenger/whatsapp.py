@@ -1,15 +1,16 @@
 import logging
-import tempfile
-import subprocess
 import os
 import base64
-import requests
 import threading
 import time
 from typing import Callable, override
 
 import socketio
 from .messenger import MessengerInterface
+from .http_session import PooledHttpSession
+from .media import Base64JsonBody, JsonBase64FieldDecoder, LimitedFileWriter
+from .intake import MessageHandOff, ReconnectBackoff
+from smrt.utils import AudioTranscoder, Lazy, Truncated
 
 class WhatsappMessenger(MessengerInterface):
     """Messenger implemenation based on wpp-server whatsapp"""
@@ -20,9 +21,12 @@ class WhatsappMessenger(MessengerInterface):
     REACT_FAIL = "\u274c"
 
     DEFAULT_TIMEOUT = 60
+    DOWNLOAD_CHUNK_SIZE = 64 * 1024
     DEFAULT_SECRET_TOKEN = "THISISMYSECURETOKEN" # token from standard config, probably no one changes this anyway
 
-    def __init__(self, server: str, session: str, api_key: str, lid: str, secret_token: str = DEFAULT_SECRET_TOKEN) -> None:
+    def __init__(self, server: str, session: str, api_key: str, lid: str, secret_token: str = DEFAULT_SECRET_TOKEN,
+                 http_session: PooledHttpSession|None = None,
+                 transcoder: AudioTranscoder|None = None) -> None:
         self._server = server
         self._session = session
         self._api_key = api_key
@@ -30,6 +34,12 @@ class WhatsappMessenger(MessengerInterface):
         self._lid = lid
         self._secret_token = secret_token
         self._headers = {"Authorization": f"Bearer {self._api_key}"}
+        # all calls to wppconnect share the pooled connections of one session
+        if http_session is None:
+            http_session = PooledHttpSession(read_timeout=self.DEFAULT_TIMEOUT)
+        self._http = http_session
+        self._http.set_headers(self._headers)
+        self._transcoder = transcoder if transcoder is not None else AudioTranscoder()
 
     def get_server(self) -> str:
         return self._server
@@ -37,6 +47,10 @@ class WhatsappMessenger(MessengerInterface):
     def get_session(self) -> str:
         return self._session
 
+    def get_http_stats(self) -> dict:
+        """Returns request and connection reuse statistics of the http session to wppconnect. """
+        return self._http.get_stats()
+
     def _endpoint_url(self, endpoint, endpoint_param = None) -> str:
         if endpoint_param is not None:
             return f"{self._server}/api/{self._session}/{endpoint}/{endpoint_param}"
@@ -47,34 +61,24 @@ class WhatsappMessenger(MessengerInterface):
         data = {
             #'web-hook': 'http://10.10.0.1:9000/incoming'
         }
-        response = requests.post(self._endpoint_url("start-session"),
-                                 json=data,
-                                 headers=self._headers,
-                                 timeout=self.DEFAULT_TIMEOUT)
-        logging.debug(response.json())
-        response = requests.get(self._endpoint_url("get-phone-number"),
-                                headers=self._headers,
-                                timeout=self.DEFAULT_TIMEOUT)
+        response = self._http.post(self._endpoint_url("start-session"),
+                                 json=data)
+        logging.debug(Lazy(response.json))
+        response = self._http.get(self._endpoint_url("get-phone-number"))
         self._jid = response.json().get("response", "")
         logging.debug(f"WhatsApp JID: {self._jid}")
 
     def logout_clear_session(self):
         # first we log out
-        response = requests.post(self._endpoint_url("logout-session"),
-                      headers=self._headers,
-                      timeout=self.DEFAULT_TIMEOUT)
-        logging.debug(response.json())
+        response = self._http.post(self._endpoint_url("logout-session"))
+        logging.debug(Lazy(response.json))
         
         # then we clear the session
-        response = requests.post(self._endpoint_url(f"{self._secret_token}/clear-session-data"),
-                      headers=self._headers,
-                      timeout=self.DEFAULT_TIMEOUT)
-        logging.debug(response.json())
+        response = self._http.post(self._endpoint_url(f"{self._secret_token}/clear-session-data"))
+        logging.debug(Lazy(response.json))
     
     def get_session_qr_code(self):
-        response = requests.get(self._endpoint_url("qrcode-session"),
-                                headers=self._headers,
-                                timeout=self.DEFAULT_TIMEOUT)
+        response = self._http.get(self._endpoint_url("qrcode-session"))
         response = response.json()
         logging.debug(response)
 
@@ -87,7 +91,9 @@ class WhatsappMessenger(MessengerInterface):
         else:
             recipient = chat_id
         is_group = chat_id.endswith("@g.us")
-        self._send_message(recipient, is_group, text)
+        response = self._send_message(recipient, is_group, text)
+        # let callers retry on rate limits and server errors
+        response.raise_for_status()
 
     def _send_message(self, recipient: str, is_group, text: str):
         logging.debug(f"Sending message to recipient: {recipient}")
@@ -99,22 +105,19 @@ class WhatsappMessenger(MessengerInterface):
             "isGroup": is_group,
             "isLid": is_lid
         }
-        response = requests.post(self._endpoint_url("send-message"),
-                      json=data,
-                      headers=self._headers,
-                      timeout=self.DEFAULT_TIMEOUT)
-        logging.debug(response.json())
+        response = self._http.post(self._endpoint_url("send-message"),
+                      json=data)
+        logging.debug(Lazy(lambda: response.text))
+        return response
 
     def _react(self, message_id, reaction_text):
         data = {
             "msgId": message_id,
             "reaction": reaction_text
         }
-        response = requests.post(self._endpoint_url("react-message"),
-                      json=data,
-                      headers=self._headers,
-                      timeout=self.DEFAULT_TIMEOUT)
-        logging.debug(response.json())
+        response = self._http.post(self._endpoint_url("react-message"),
+                      json=data)
+        logging.debug(Lazy(response.json))
     
     def _is_lid(self, recipient: str):
         return "@lid" in recipient
@@ -152,11 +155,9 @@ class WhatsappMessenger(MessengerInterface):
             "phone": recipient,
             "isGroup": is_group_message
         }
-        response = requests.post(self._endpoint_url("send-seen"),
-                      json=data,
-                      headers=self._headers,
-                      timeout=self.DEFAULT_TIMEOUT)
-        logging.debug(response.json())
+        response = self._http.post(self._endpoint_url("send-seen"),
+                      json=data)
+        logging.debug(Lazy(response.json))
 
     @override
     def mark_unseen(self, message: dict) -> None:
@@ -166,11 +167,9 @@ class WhatsappMessenger(MessengerInterface):
             "phone": recipient,
             "isGroup": is_group_message
         }
-        response = requests.post(self._endpoint_url("mark-unseen"),
-                      json=data,
-                      headers=self._headers,
-                      timeout=self.DEFAULT_TIMEOUT)
-        logging.debug(response.json())
+        response = self._http.post(self._endpoint_url("mark-unseen"),
+                      json=data)
+        logging.debug(Lazy(response.json))
 
     @override
     def is_group_message(self, message: dict):
@@ -206,11 +205,9 @@ class WhatsappMessenger(MessengerInterface):
             "messageId": message_id,
             "isLid": self._is_lid(recipient)
         }
-        response = requests.post(self._endpoint_url("send-reply"),
-                      json=data,
-                      headers=self._headers,
-                      timeout=self.DEFAULT_TIMEOUT)
-        logging.debug(response.json())
+        response = self._http.post(self._endpoint_url("send-reply"),
+                      json=data)
+        logging.debug(Lazy(response.json))
 
     @override
     def delete_message(self, message: dict):
@@ -221,15 +218,12 @@ class WhatsappMessenger(MessengerInterface):
             "messageId": message['id'],
             "isGroup": is_group
         }
-        response = requests.post(self._endpoint_url("delete-message"),
-                                 json=data,
-                                 headers=self._headers,
-                                 timeout=self.DEFAULT_TIMEOUT)
-        logging.debug(response.json())
+        response = self._http.post(self._endpoint_url("delete-message"),
+                                 json=data)
+        logging.debug(Lazy(response.json))
 
     def _send_image(self, recipient: str, is_group: bool,
-                    file_name: str, binary_data, caption: str):
-        base64data = base64.b64encode(binary_data).decode('utf-8')
+                    file_name: str, source: str|bytes, caption: str):
         if file_name.endswith('.webp'):
             data_type="image/webp"
         else:
@@ -238,17 +232,17 @@ class WhatsappMessenger(MessengerInterface):
         is_lid = "@lid" in recipient
         data = {
             "phone": recipient,
-            "base64": f"data:{data_type};base64,{base64data}",
+            "base64": Base64JsonBody.MEDIA,
             "filename": file_name,
             "message": caption,
             "isGroup": is_group, 
             "isLid": is_lid
         }
-        response = requests.post(self._endpoint_url("send-image"),
-                      json=data,
-                      headers=self._headers,
-                      timeout=self.DEFAULT_TIMEOUT)
-        logging.debug(response.json())
+        # the image is base64 encoded while it is sent instead of building the whole json in memory
+        response = self._http.post(self._endpoint_url("send-image"),
+                      data=Base64JsonBody(data, source, f"data:{data_type};base64,"),
+                      headers={"Content-Type": "application/json"})
+        logging.debug(Lazy(lambda: response.text))
 
     @override
     def send_image_to_group(self, group_message, file_name, binary_data, caption = ""):
@@ -258,6 +252,14 @@ class WhatsappMessenger(MessengerInterface):
     def send_image_to_individual(self, message, file_name, binary_data, caption = ""):
         self._send_image(message['sender']['id'], False, file_name, binary_data, caption)
 
+    @override
+    def send_image_file_to_group(self, group_message: dict, file_path: str, caption: str = ""):
+        self._send_image(group_message['chatId'], True, os.path.basename(file_path), file_path, caption)
+
+    @override
+    def send_image_file_to_individual(self, message: dict, file_path: str, caption: str = ""):
+        self._send_image(message['sender']['id'], False, os.path.basename(file_path), file_path, caption)
+
     @override
     def send_audio_to_group(self, group_message, audio_file_path):
         self._send_audio(group_message['chatId'], True, audio_file_path)
@@ -282,24 +284,17 @@ class WhatsappMessenger(MessengerInterface):
         pass
 
     def _send_audio(self, recipient: str, is_group: bool, audio_file_path: str):
-        with tempfile.TemporaryDirectory() as tmp:
-            output_file = os.path.join(tmp, 'output.opus')
-            subprocess.run(["opusenc", audio_file_path, output_file], check=True)
-            file = open(output_file,mode='rb')
-            binary_data = file.read()
-            file.close()
-        base64data = base64.b64encode(binary_data).decode('utf-8')
+        encoded = self._transcoder.encode_file(audio_file_path, AudioTranscoder.FORMAT_OPUS)
 
         data = {
             "phone": recipient,
-            "base64Ptt": f"data:audio/ogg;base64,{base64data}",
+            "base64Ptt": Base64JsonBody.MEDIA,
             "isGroup": is_group, 
         }
-        response = requests.post(self._endpoint_url("send-voice-base64"),
-                      json=data,
-                      headers=self._headers,
-                      timeout=self.DEFAULT_TIMEOUT)
-        logging.debug(response.json())
+        response = self._http.post(self._endpoint_url("send-voice-base64"),
+                      data=Base64JsonBody(data, encoded, "data:audio/ogg;base64,"),
+                      headers={"Content-Type": "application/json"})
+        logging.debug(Lazy(lambda: response.text))
 
     @override
     def has_audio_data(self, message: dict):
@@ -341,6 +336,10 @@ class WhatsappMessenger(MessengerInterface):
         # otherwise we can get the text from the content field
         return message.get("content", "")
 
+    @override
+    def get_message_id(self, message: dict) -> str|None:
+        return message.get('id')
+
     @override
     def get_chat_id(self, message: dict) -> str:
         return f"whatsapp://{message['chatId']}"
@@ -352,9 +351,7 @@ class WhatsappMessenger(MessengerInterface):
     @override
     def download_media(self, message):
         msg_id = message['id']
-        response = requests.get(self._endpoint_url("get-media-by-message", msg_id),
-                                headers=self._headers,
-                                timeout=self.DEFAULT_TIMEOUT)
+        response = self._http.get(self._endpoint_url("get-media-by-message", msg_id))
 
         json_response = response.json()
         if 'base64' not in json_response or 'mimetype' not in json_response:
@@ -365,6 +362,23 @@ class WhatsappMessenger(MessengerInterface):
         mime_type = json_response['mimetype']
         return (mime_type, decoded)
 
+    @override
+    def download_media_to(self, message: dict, file_path: str,
+                          max_size: int|None = MessengerInterface.DEFAULT_MAX_MEDIA_SIZE) -> str|None:
+        msg_id = message['id']
+        # wppconnect only returns the media as base64 in json, decode it while it arrives
+        with self._http.get(self._endpoint_url("get-media-by-message", msg_id), stream=True) as response, \
+                open(file_path, "wb") as file:
+            response.raise_for_status()
+            decoder = JsonBase64FieldDecoder("base64", LimitedFileWriter(file, max_size))
+            for chunk in response.iter_content(chunk_size=self.DOWNLOAD_CHUNK_SIZE):
+                decoder.feed(chunk)
+        mime_type = decoder.get_text_field("mimetype")
+        if not decoder.is_complete() or mime_type is None:
+            logging.error(f"Invalid media response for message {msg_id}, missing 'base64' or 'mimetype' fields")
+            raise ValueError("Invalid media response from server, missing 'base64' or 'mimetype' fields")
+        return mime_type
+
     @override
     def send_typing(self, message: dict, typing: bool):
         is_group_message = self.is_group_message(message)
@@ -374,19 +388,45 @@ class WhatsappMessenger(MessengerInterface):
             "isGroup": is_group_message,
             "value": typing
         }
-        response = requests.post(self._endpoint_url("typing"),
-                      json=data,
-                      headers=self._headers,
-                      timeout=self.DEFAULT_TIMEOUT)
-        logging.debug(response.json())
+        response = self._http.post(self._endpoint_url("typing"),
+                      json=data)
+        logging.debug(Lazy(response.json))
 
 class WhatsappMessageQueue():
-
-    def __init__(self, messenger_instance: WhatsappMessenger, callback: Callable[[MessengerInterface, dict], None]) -> None:
+    """Receives messages from the socket.io events of the wppconnect server.
+
+    The connection is reestablished with exponential backoff if the server restarts or
+    the connection drops. Received messages are handed over to a worker thread, so a slow
+    callback does not block the socket.io event handling.
+    """
+    # a connection that lasted this long counts as stable and resets the backoff
+    STABLE_CONNECTION_TIME = 60
+    CONNECT_TIMEOUT = 10
+
+    def __init__(self, messenger_instance: WhatsappMessenger, callback: Callable[[MessengerInterface, dict], None],
+                 max_pending: int = MessageHandOff.DEFAULT_MAX_PENDING,
+                 reconnect_delay: float = ReconnectBackoff.DEFAULT_INITIAL_DELAY,
+                 max_reconnect_delay: float = ReconnectBackoff.DEFAULT_MAX_DELAY) -> None:
+        """Creates the queue.
+
+        Args:
+            messenger_instance (WhatsappMessenger): The messenger to receive messages for
+            callback (Callable[[MessengerInterface, dict], None]): Processes a received message
+            max_pending (int): Maximum number of messages waiting for the callback, further messages are dropped
+            reconnect_delay (float): Seconds before the first reconnect attempt
+            max_reconnect_delay (float): Maximum seconds between two reconnect attempts
+        """
         self._messenger = messenger_instance
-        self._callback = callback
         self._thread = None
-        self._sio = socketio.Client()
+        self._hand_off = MessageHandOff(messenger_instance, callback, max_pending)
+        self._backoff = ReconnectBackoff(reconnect_delay, max_reconnect_delay)
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+        self._connected = False
+        self._reconnects = 0
+        self._last_event = None
+        # reconnects are handled in run, so the backoff is under our control and visible in the stats
+        self._sio = socketio.Client(reconnection=False)
 
         # Register event handlers
         self._sio.on('connect', self.on_connect)
@@ -399,24 +439,42 @@ class WhatsappMessageQueue():
         self._thread = threading.Thread(target=self.run)
         self._thread.start()
 
+    def stop(self) -> None:
+        """Disconnects from the server and stops processing messages. """
+        self._stop_event.set()
+        self._sio.disconnect()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._hand_off.stop()
+
+    def _mark_event(self) -> None:
+        with self._lock:
+            self._last_event = time.monotonic()
+
     def on_connect(self):
         logging.info("Connected to WPPConnect server")
+        self._mark_event()
+        with self._lock:
+            self._connected = True
 
-    def on_disconnect(self):
-        logging.info("Disconnected from WPPConnect server")
+    def on_disconnect(self, reason = None):
+        logging.info(f"Disconnected from WPPConnect server: {reason}")
+        with self._lock:
+            self._connected = False
 
     def on_message(self, data):
-        logging.info(f"Received message: {data}")
+        self._mark_event()
+        logging.info("Received message: %s", Truncated(data))
 
     def on_new_message(self, data):
-        # shorten the log message in the middle with '...' if it's too long
-        max_length = 750
+        self._mark_event()
         if "response" not in data:
-            logging.warning(f"Received message without 'response' field: {data}")
+            logging.warning("Received message without 'response' field: %s", Truncated(data))
             return
         
         if "session" not in data["response"]:
-            logging.warning(f"Received message without 'session' field in response: {data}")
+            logging.warning("Received message without 'session' field in response: %s", Truncated(data))
             return
         
         session = data["response"]["session"]
@@ -424,25 +482,50 @@ class WhatsappMessageQueue():
             logging.warning(f"Received message for session {session}, but current session is {self._messenger.get_session()}. Ignoring message.")
             return
         
-        if len(str(data)) > max_length:
-            logging.info(f"Message: {str(data)[:int(max_length/2)]}...{str(data)[-int(max_length/2):]}")
-        else:
-            logging.info(f"Message: {data}")
-        self._callback(self._messenger, data['response'])
+        # rendered only if logged, long media payloads are cut
+        logging.info("Message: %s", Truncated(data))
+        self._hand_off.put(data['response'])
 
     def on_catch_all(self, identifier, data):
-        #print("Received catch all identifier:", identifier)
-        #print("Received catch all event:", data)
-        pass
+        self._mark_event()
 
     def run(self):
-        try:
-            self._sio.connect(self._messenger.get_server())
-
-            while True:
-                time.sleep(3)
-            # TODO: reconnect handling
-            self._sio.disconnect()
-        except Exception as e:
-            logging.error(f"Error in WhatsappMessageQueue: {e}")
-            self._sio.disconnect()
+        self._hand_off.start()
+        while not self._stop_event.is_set():
+            connected_at = None
+            try:
+                self._sio.connect(self._messenger.get_server(), wait_timeout=self.CONNECT_TIMEOUT)
+                connected_at = time.monotonic()
+                # returns once the connection is lost
+                self._sio.wait()
+            except socketio.exceptions.ConnectionError as ex:
+                logging.warning(f"Failed to connect to WPPConnect server: {ex}")
+            except Exception as ex:
+                logging.critical(ex, exc_info=True)
+            finally:
+                self._sio.disconnect()
+
+            if self._stop_event.is_set():
+                break
+            if connected_at is not None and time.monotonic() - connected_at >= self.STABLE_CONNECTION_TIME:
+                self._backoff.reset()
+            delay = self._backoff.next_delay()
+            with self._lock:
+                self._reconnects += 1
+            logging.warning(f"Reconnecting to WPPConnect server in {delay:.1f}s (attempt {self._backoff.get_attempts()})")
+            self._stop_event.wait(delay)
+
+    def get_stats(self) -> dict:
+        """Returns the connection state, reconnects and the counters of the message hand-off.
+
+        'seconds_since_last_event' is the time since the server sent anything, 'last_wait' and
+        'max_wait' are the seconds received messages waited for the callback.
+        """
+        with self._lock:
+            stats = {
+                "connected": self._connected,
+                "reconnects": self._reconnects,
+                "seconds_since_last_event": None if self._last_event is None else time.monotonic() - self._last_event,
+            }
+        stats.update(self._hand_off.get_stats())
+        return stats
@@ -1,6 +1,9 @@
 from .main_pipeline import MainPipeline
+from .dispatcher import PipelineDispatcher
+from .router import PipelineRouter
+from .dedup import MessageDeduplicator
 from .pipeline_gallery import GalleryPipeline, GalleryDeletePipeline
-from .pipeline import ChatIdPipeline, WhatsappLidPipeline, MarkSeenPipeline, HelpPipeline, PipelineInterface, PipelineHelper, AbstractPipeline
+from .pipeline import ChatIdPipeline, WhatsappLidPipeline, MarkSeenPipeline, HelpPipeline, PipelineInterface, PipelineHelper, ParsedCommand, AbstractPipeline, MessageEnvelope
 from .pipeline_ha import HomeassistantSayCommandPipeline, HomeassistantTextCommandPipeline, HomeassistantVoiceCommandPipeline
 from .pipeline_all import GrammarPipeline, URLSummaryPipeline, ImagePromptPipeline, ImageGenerationPipeline, TinderPipeline
 from .pipeline_voice import VoiceMessagePipeline
@@ -12,11 +15,16 @@ from .scheduled import ScheduledTaskInterface, AbstractScheduledTask
 
 __all__ = [
     "MainPipeline",
+    "PipelineDispatcher",
+    "PipelineRouter",
+    "MessageDeduplicator",
     "GalleryPipeline",
     "GalleryDeletePipeline",
     "PipelineInterface",
     "AbstractPipeline",
     "PipelineHelper",
+    "ParsedCommand",
+    "MessageEnvelope",
     "ChatIdPipeline",
     "MarkSeenPipeline",
     "HelpPipeline",
@@ -0,0 +1,68 @@
+"""Suppression of messages that are delivered more than once, e.g. after a reconnect. """
+import logging
+import threading
+from collections import OrderedDict
+
+from smrt.bot.messenger import MessengerInterface
+from smrt.db import SeenMessageDatabase
+from .pipeline import MessageEnvelope
+
+
+class MessageDeduplicator():
+    """Remembers the ids of recent messages to drop repeated deliveries.
+
+    Ids are kept in a bounded in-memory LRU. With a database, ids are also persisted,
+    so messages delivered again after a restart of the bot are dropped as well.
+    Messages without an id are never treated as duplicates.
+    """
+    DEFAULT_MAX_ENTRIES = 10000
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, seen_db: SeenMessageDatabase|None = None) -> None:
+        if max_entries < 1:
+            raise ValueError("max_entries must be at least 1")
+        self._max_entries = max_entries
+        self._seen_db = seen_db
+        self._seen: OrderedDict[str, None] = OrderedDict()
+        self._lock = threading.Lock()
+        self._checked = 0
+        self._duplicates = 0
+
+    def is_duplicate(self, messenger: MessengerInterface, message: dict,
+                     envelope: MessageEnvelope|None = None) -> bool:
+        """Checks if the message was seen before and remembers it otherwise.
+
+        Args:
+            messenger (MessengerInterface): The messenger the message came from
+            message (dict): The incoming message
+            envelope (MessageEnvelope | None): The parsed message if already built, its message id is reused
+
+        Returns:
+            bool: True if the message has already been seen
+        """
+        message_id = envelope.get_message_id() if envelope is not None else messenger.get_message_id(message)
+        if message_id is None:
+            return False
+        key = f"{messenger.get_name()}:{message_id}"
+        with self._lock:
+            self._checked += 1
+            if key in self._seen:
+                self._seen.move_to_end(key)
+                self._duplicates += 1
+                return True
+            self._seen[key] = None
+            if len(self._seen) > self._max_entries:
+                self._seen.popitem(last=False)
+        if self._seen_db is not None and not self._seen_db.add_seen_message(key):
+            with self._lock:
+                self._duplicates += 1
+            return True
+        return False
+
+    def get_stats(self) -> dict:
+        """Returns the number of checked and suppressed messages. """
+        with self._lock:
+            return {
+                "checked": self._checked,
+                "duplicates": self._duplicates,
+                "entries": len(self._seen),
+            }
@@ -0,0 +1,552 @@
+"""Dispatcher to run matching pipelines on a bounded pool of worker threads. """
+import logging
+import threading
+import time
+import uuid
+from collections import deque
+
+from smrt.bot.messenger import MessengerInterface, MessengerManager, StatusCoalescer
+from smrt.db import JobQueueDatabase
+from .pipeline import PipelineInterface
+
+
+class DispatchJob():
+    """A single pipeline run waiting for a worker. """
+    __slots__ = ("pipe", "pipe_name", "priority", "messenger", "message", "lane", "enqueue_time", "job_id",
+                 "coalesce_key")
+
+    def __init__(self, pipe: PipelineInterface, messenger: MessengerInterface, message: dict,
+                 lane: str|None = None, job_id: str|None = None, priority: str|None = None):
+        self.pipe = pipe
+        self.pipe_name = type(pipe).__name__
+        self.priority = priority if priority is not None else pipe.get_priority()
+        self.messenger = messenger
+        self.message = message
+        self.lane = lane
+        self.enqueue_time = time.monotonic()
+        # id of the persisted job, None if the job only lives in memory
+        self.job_id = job_id
+        # jobs of the same pipeline with the same key are duplicates, None to never coalesce
+        self.coalesce_key = None
+
+
+class DispatchStats():
+    """Counters, wait and run times of one pipeline or priority class inside the dispatcher. """
+    __slots__ = ("submitted", "rejected", "dropped", "coalesced", "completed", "failed",
+                 "active", "queued", "replayed", "total_wait", "max_wait", "total_run", "max_run")
+
+    def __init__(self):
+        self.submitted = 0
+        self.rejected = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.completed = 0
+        self.failed = 0
+        self.active = 0
+        self.queued = 0
+        self.replayed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.total_run = 0.0
+        self.max_run = 0.0
+
+    def as_dict(self) -> dict:
+        started = self.completed + self.failed + self.active
+        finished = self.completed + self.failed
+        return {
+            "submitted": self.submitted,
+            "rejected": self.rejected,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "completed": self.completed,
+            "failed": self.failed,
+            "active": self.active,
+            "queued": self.queued,
+            "replayed": self.replayed,
+            "avg_wait_s": self.total_wait / started if started > 0 else 0.0,
+            "max_wait_s": self.max_wait,
+            "avg_run_s": self.total_run / finished if finished > 0 else 0.0,
+            "max_run_s": self.max_run,
+        }
+
+
+class PipelineDispatcher():
+    """Runs pipeline jobs on a fixed number of worker threads.
+
+    Jobs wait in a bounded queue. Each pipeline can be limited to a maximum
+    number of jobs running at the same time, jobs of a pipeline that is at its
+    limit stay queued while jobs of other pipelines are picked up.
+
+    With ordered chats enabled, jobs are sharded into one serial lane per chat id:
+    jobs of the same chat run one after another in the order they were submitted,
+    while jobs of different chats still run in parallel.
+
+    With a job store, jobs of the persistent pipelines are written to the database
+    before they are queued and removed once they finished (at-least-once). Jobs left
+    over by a previous run or whose lease timed out are queued again by replay_jobs().
+
+    Every job belongs to a priority class of its pipeline (interactive, llm, media).
+    Free workers pick the job of the most urgent class first, a job that waited
+    longer than the starvation timeout is picked before all others. Workers can be
+    reserved per class, e.g. one worker only for interactive commands: other classes
+    never take the last workers that are needed to cover these reservations.
+
+    The number of queued jobs can be capped per pipeline. If a pipeline is at its cap,
+    its overflow policy decides: reject the new job, drop the oldest queued job of the
+    pipeline or, for coalesce, reject it unless it duplicates a queued job. With coalesce,
+    a job with the same chat and text as a queued job of the pipeline is merged into it.
+    Messages of jobs that are not processed are marked as skipped.
+    """
+    DEFAULT_MAX_WORKERS = 8
+    DEFAULT_MAX_QUEUE_SIZE = 100
+    DEFAULT_LEASE_TIMEOUT = 1800
+    DEFAULT_MAX_ATTEMPTS = 3
+    DEFAULT_STARVATION_TIMEOUT = 30.0
+    OVERFLOW_REJECT = "reject"
+    OVERFLOW_DROP_OLDEST = "drop_oldest"
+    OVERFLOW_COALESCE = "coalesce"
+    OVERFLOW_POLICIES = [OVERFLOW_REJECT, OVERFLOW_DROP_OLDEST, OVERFLOW_COALESCE]
+
+    def __init__(self, max_workers: int = DEFAULT_MAX_WORKERS,
+                 max_queue_size: int = DEFAULT_MAX_QUEUE_SIZE,
+                 pipeline_concurrency: dict[str, int]|None = None,
+                 ordered_chats: bool = False,
+                 job_store: JobQueueDatabase|None = None,
+                 persistent_pipelines: list[str]|None = None,
+                 lease_timeout: float = DEFAULT_LEASE_TIMEOUT,
+                 max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+                 reserved_workers: dict[str, int]|None = None,
+                 pipeline_priority: dict[str, str]|None = None,
+                 starvation_timeout: float = DEFAULT_STARVATION_TIMEOUT,
+                 pipeline_queues: dict[str, dict]|None = None,
+                 status_coalescer: StatusCoalescer|None = None) -> None:
+        if max_workers < 1:
+            raise ValueError("max_workers must be at least 1")
+        if max_queue_size < 1:
+            raise ValueError("max_queue_size must be at least 1")
+        if lease_timeout <= 0:
+            raise ValueError("lease_timeout must be positive")
+        if max_attempts < 1:
+            raise ValueError("max_attempts must be at least 1")
+        reserved_workers = reserved_workers or {}
+        for priority, reserved in reserved_workers.items():
+            if priority not in PipelineInterface.PRIORITIES:
+                raise ValueError(f"Unknown priority class {priority}, must be one of {PipelineInterface.PRIORITIES}")
+            if reserved < 0:
+                raise ValueError(f"Reserved workers of {priority} must not be negative")
+        total_reserved = sum(reserved_workers.values())
+        unreserved_classes = [priority for priority in PipelineInterface.PRIORITIES if reserved_workers.get(priority, 0) == 0]
+        # classes without a reservation need at least one worker that is not reserved
+        if total_reserved > max_workers or (total_reserved == max_workers and len(unreserved_classes) > 0):
+            raise ValueError(f"{total_reserved} reserved workers leave no worker for {unreserved_classes}")
+        for pipe_name, priority in (pipeline_priority or {}).items():
+            if priority not in PipelineInterface.PRIORITIES:
+                raise ValueError(f"Unknown priority class {priority} for {pipe_name}")
+        self._condition = threading.Condition()
+        self._max_workers = max_workers
+        self._max_queue_size = max_queue_size
+        self._ordered_chats = ordered_chats
+        self._busy_lanes: set[str] = set()
+        self._pipeline_concurrency: dict[str, int] = {}
+        for pipe_name, limit in (pipeline_concurrency or {}).items():
+            self.set_pipeline_concurrency(pipe_name, limit)
+        self._pending: deque[DispatchJob] = deque()
+        self._stats: dict[str, DispatchStats] = {}
+        self._max_queue_depth = 0
+        self._workers: list[threading.Thread] = []
+        self._running = False
+        self._job_store = job_store
+        self._persistent_pipelines = set(persistent_pipelines or [])
+        self._lease_timeout = lease_timeout
+        self._max_attempts = max_attempts
+        # identifies the leases of this dispatcher, leases of other owners are from a previous run
+        self._owner = str(uuid.uuid4())
+        # persisted jobs still waiting in memory, they must not be replayed again
+        self._pending_job_ids: set[str] = set()
+        # persisted jobs running right now, their lease may expire while they run
+        self._running_job_ids: set[str] = set()
+        self._reserved_workers = {priority: reserved_workers.get(priority, 0) for priority in PipelineInterface.PRIORITIES}
+        self._pipeline_priority = dict(pipeline_priority or {})
+        self._starvation_timeout = starvation_timeout
+        self._priority_stats = {priority: DispatchStats() for priority in PipelineInterface.PRIORITIES}
+        self._active_jobs = 0
+        self._pipeline_queue_size: dict[str, int] = {}
+        self._pipeline_overflow: dict[str, str] = {}
+        for pipe_name, queue_config in (pipeline_queues or {}).items():
+            self.set_pipeline_queue(pipe_name, queue_config.get("max_queued"),
+                                    queue_config.get("overflow", self.OVERFLOW_REJECT))
+        self._status_coalescer = status_coalescer
+
+    def set_pipeline_concurrency(self, pipe_name: str, limit: int|None) -> None:
+        """Limits how many jobs of a pipeline may run at the same time.
+
+        Args:
+            pipe_name (str): Class name of the pipeline, e.g. 'VoiceMessagePipeline'
+            limit (int | None): Maximum number of parallel jobs, None for no limit
+        """
+        if limit is not None and limit < 1:
+            raise ValueError(f"Concurrency limit of {pipe_name} must be at least 1")
+        with self._condition:
+            if limit is None:
+                self._pipeline_concurrency.pop(pipe_name, None)
+            else:
+                self._pipeline_concurrency[pipe_name] = limit
+            self._condition.notify_all()
+
+    def set_pipeline_queue(self, pipe_name: str, max_queued: int|None, overflow: str = OVERFLOW_REJECT) -> None:
+        """Caps the number of queued jobs of a pipeline.
+
+        Args:
+            pipe_name (str): Class name of the pipeline, e.g. 'VoiceMessagePipeline'
+            max_queued (int | None): Maximum number of waiting jobs, None for no cap
+            overflow (str): One of OVERFLOW_POLICIES, what to do with jobs above the cap
+        """
+        if max_queued is not None and max_queued < 1:
+            raise ValueError(f"Queue size of {pipe_name} must be at least 1")
+        if overflow not in self.OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy {overflow}, must be one of {self.OVERFLOW_POLICIES}")
+        with self._condition:
+            if max_queued is None:
+                self._pipeline_queue_size.pop(pipe_name, None)
+            else:
+                self._pipeline_queue_size[pipe_name] = max_queued
+            self._pipeline_overflow[pipe_name] = overflow
+
+    def start(self) -> None:
+        """Starts the worker threads, does nothing if they are already running. """
+        with self._condition:
+            if self._running:
+                return
+            self._running = True
+            self._workers = []
+            for i in range(self._max_workers):
+                worker = threading.Thread(target=self._work, name=f"pipeline-worker-{i}", daemon=True)
+                self._workers.append(worker)
+                worker.start()
+        logging.info(f"Started pipeline dispatcher with {self._max_workers} workers")
+
+    def stop(self, wait: bool = True) -> None:
+        """Stops the workers after all queued jobs have been processed.
+
+        Args:
+            wait (bool): True to block until all workers have finished
+        """
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+            workers = self._workers
+        if wait:
+            for worker in workers:
+                worker.join()
+
+    def submit(self, pipe: PipelineInterface, messenger: MessengerInterface, message: dict,
+               chat_id: str|None = None, text: str|None = None) -> bool:
+        """Queues a pipeline run for the given message.
+
+        Args:
+            pipe (PipelineInterface): The pipeline that matched the message
+            messenger (MessengerInterface): The messenger the message came from
+            message (dict): The incoming message
+            chat_id (str | None): Chat id of the message if already known
+            text (str | None): Text of the message if already known
+
+        Returns:
+            bool: True if the job was queued, False if it was rejected or merged into a queued duplicate
+        """
+        lane = None
+        if self._ordered_chats:
+            lane = chat_id if chat_id is not None else messenger.get_chat_id(message)
+        job = DispatchJob(pipe, messenger, message, lane, priority=self._pipeline_priority.get(type(pipe).__name__))
+        if self._pipeline_overflow.get(job.pipe_name) == self.OVERFLOW_COALESCE:
+            if text is None:
+                text = messenger.get_message_text(message)
+            # without text, e.g. voice messages, duplicates can't be told apart
+            if text:
+                job.coalesce_key = (chat_id if chat_id is not None else messenger.get_chat_id(message), text)
+        if self._job_store is not None and job.pipe_name in self._persistent_pipelines:
+            try:
+                job.job_id = self._job_store.add_job(job.pipe_name, messenger.get_name(), message,
+                                                     self._owner, time.time() + self._lease_timeout)
+            except (TypeError, ValueError) as ex:
+                # e.g. messengers that hand over objects instead of json messages
+                logging.warning(f"Could not persist job for {job.pipe_name}, keeping it in memory only: {ex}")
+        return self._enqueue(job)
+
+    def replay_jobs(self, pipelines: list[PipelineInterface], messenger_manager: MessengerManager) -> int:
+        """Queues persisted jobs again that were left over by a previous run or whose lease expired.
+
+        Jobs that already used up all attempts are dropped and marked as failed.
+
+        Args:
+            pipelines (list[PipelineInterface]): Registered pipelines to look up jobs by class name
+            messenger_manager (MessengerManager): Manager to look up messengers by name
+
+        Returns:
+            int: number of replayed jobs
+        """
+        if self._job_store is None:
+            return 0
+        with self._condition:
+            own_job_ids = self._pending_job_ids | self._running_job_ids
+        replayed = 0
+        for entry in self._job_store.get_replayable_jobs(self._owner, time.time()):
+            if entry.job_id in own_job_ids:
+                continue
+            messenger = messenger_manager.get_messenger_by_name(entry.messenger)
+            if messenger is None:
+                logging.warning(f"Dropping persisted job {entry.job_id}, messenger {entry.messenger} is not configured")
+                self._job_store.complete_job(entry.job_id)
+                continue
+            if entry.attempts >= self._max_attempts:
+                logging.warning(f"Dropping persisted job {entry.job_id} for {entry.pipeline} after {entry.attempts} attempts")
+                self._job_store.complete_job(entry.job_id)
+                messenger.mark_in_progress_fail(entry.message)
+                continue
+            pipe = None
+            for candidate in pipelines:
+                if type(candidate).__name__ == entry.pipeline and candidate.allowed_in_chat_id(messenger, entry.message):
+                    pipe = candidate
+                    break
+            if pipe is None:
+                logging.warning(f"Dropping persisted job {entry.job_id}, pipeline {entry.pipeline} is not configured")
+                self._job_store.complete_job(entry.job_id)
+                continue
+
+            self._job_store.lease_job(entry.job_id, self._owner, time.time() + self._lease_timeout)
+            lane = messenger.get_chat_id(entry.message) if self._ordered_chats else None
+            job = DispatchJob(pipe, messenger, entry.message, lane, entry.job_id,
+                              self._pipeline_priority.get(entry.pipeline))
+            if self._enqueue(job):
+                replayed += 1
+                with self._condition:
+                    for stats in self._get_job_stats(job):
+                        stats.replayed += 1
+        if replayed > 0:
+            logging.info(f"Replayed {replayed} persisted pipeline jobs")
+        return replayed
+
+    def _enqueue(self, job: DispatchJob) -> bool:
+        if not self._running:
+            self.start()
+        # jobs that will not be processed, their messages are marked as skipped
+        skipped: list[DispatchJob] = []
+        with self._condition:
+            all_stats = self._get_job_stats(job)
+            for stats in all_stats:
+                stats.submitted += 1
+            duplicate = self._find_duplicate(job)
+            max_queued = self._pipeline_queue_size.get(job.pipe_name)
+            if duplicate is not None:
+                for stats in all_stats:
+                    stats.coalesced += 1
+                logging.info(f"Coalesced duplicate job for {job.pipe_name}")
+                skipped.append(job)
+            elif len(self._pending) >= self._max_queue_size:
+                for stats in all_stats:
+                    stats.rejected += 1
+                logging.warning(f"Dispatch queue full ({len(self._pending)} jobs), dropping job for {job.pipe_name}")
+                skipped.append(job)
+            elif max_queued is not None and all_stats[0].queued >= max_queued \
+                    and self._pipeline_overflow.get(job.pipe_name) != self.OVERFLOW_DROP_OLDEST:
+                for stats in all_stats:
+                    stats.rejected += 1
+                logging.warning(f"Queue of {job.pipe_name} full ({max_queued} jobs), rejecting job")
+                skipped.append(job)
+            else:
+                if max_queued is not None and all_stats[0].queued >= max_queued:
+                    oldest = self._drop_oldest(job.pipe_name)
+                    logging.warning(f"Queue of {job.pipe_name} full ({max_queued} jobs), dropped oldest job")
+                    skipped.append(oldest)
+                self._pending.append(job)
+                if job.job_id is not None:
+                    self._pending_job_ids.add(job.job_id)
+                for stats in all_stats:
+                    stats.queued += 1
+                self._max_queue_depth = max(self._max_queue_depth, len(self._pending))
+                self._condition.notify()
+        for skipped_job in skipped:
+            self._skip(skipped_job)
+        return job not in skipped
+
+    def _find_duplicate(self, job: DispatchJob) -> DispatchJob|None:
+        # must be called with the condition held
+        if job.coalesce_key is None:
+            return None
+        for queued in self._pending:
+            if queued.pipe_name == job.pipe_name and queued.coalesce_key == job.coalesce_key:
+                return queued
+        return None
+
+    def _drop_oldest(self, pipe_name: str) -> DispatchJob:
+        # must be called with the condition held and at least one job of the pipeline queued
+        for index, queued in enumerate(self._pending):
+            if queued.pipe_name == pipe_name:
+                del self._pending[index]
+                if queued.job_id is not None:
+                    self._pending_job_ids.discard(queued.job_id)
+                for stats in self._get_job_stats(queued):
+                    stats.queued -= 1
+                    stats.dropped += 1
+                return queued
+        raise RuntimeError(f"No queued job of {pipe_name} to drop")
+
+    def _skip(self, job: DispatchJob) -> None:
+        if job.job_id is not None:
+            self._job_store.complete_job(job.job_id)
+        try:
+            self._get_messenger(job).mark_skipped(job.message)
+        except Exception as ex:
+            # a failing reaction must not break the submitting messenger thread
+            logging.warning(f"Could not mark skipped job of {job.pipe_name}: {ex}")
+
+    def get_queue_depth(self) -> int:
+        """Returns the number of jobs waiting for a worker. """
+        with self._condition:
+            return len(self._pending)
+
+    def get_stats(self) -> dict:
+        """Returns queue and per pipeline statistics of the dispatcher.
+
+        Returns:
+            dict: queue depth, maximum seen queue depth and stats per pipeline name
+        """
+        with self._condition:
+            stats = {
+                "workers": self._max_workers,
+                "queue_depth": len(self._pending),
+                "max_queue_depth": self._max_queue_depth,
+                "max_queue_size": self._max_queue_size,
+                "busy_lanes": len(self._busy_lanes),
+                "reserved_workers": dict(self._reserved_workers),
+                "priorities": {priority: stats.as_dict() for priority, stats in self._priority_stats.items()},
+                "pipelines": {name: stats.as_dict() for name, stats in self._stats.items()},
+            }
+        if self._job_store is not None:
+            stats["persisted_jobs"] = self._job_store.get_job_count()
+        if self._status_coalescer is not None:
+            stats["status_marks"] = self._status_coalescer.get_stats()
+        return stats
+
+    def _get_messenger(self, job: DispatchJob) -> MessengerInterface:
+        # progress marks of pipelines go through the coalescer, so only their net change is sent
+        if self._status_coalescer is None:
+            return job.messenger
+        return self._status_coalescer.wrap(job.messenger)
+
+    def _get_stats(self, pipe_name: str) -> DispatchStats:
+        stats = self._stats.get(pipe_name)
+        if stats is None:
+            stats = DispatchStats()
+            self._stats[pipe_name] = stats
+        return stats
+
+    def _get_job_stats(self, job: DispatchJob) -> tuple[DispatchStats, DispatchStats]:
+        return (self._get_stats(job.pipe_name), self._priority_stats[job.priority])
+
+    def _has_priority_capacity(self, priority: str) -> bool:
+        # a class can always use its own reserved workers
+        if self._priority_stats[priority].active < self._reserved_workers[priority]:
+            return True
+        # other workers may be used as long as the unused reservations of the other classes stay free
+        free_workers = self._max_workers - self._active_jobs
+        missing_reserved = 0
+        for other, reserved in self._reserved_workers.items():
+            if other != priority:
+                missing_reserved += max(0, reserved - self._priority_stats[other].active)
+        return free_workers - 1 >= missing_reserved
+
+    def _has_capacity(self, pipe_name: str) -> bool:
+        limit = self._pipeline_concurrency.get(pipe_name)
+        if limit is None:
+            return True
+        return self._get_stats(pipe_name).active < limit
+
+    def _next_job(self) -> DispatchJob|None:
+        # must be called with the condition held
+        # lanes that already had their oldest queued job checked, later jobs of them must wait
+        blocked_lanes = set()
+        starved_before = time.monotonic() - self._starvation_timeout
+        best_index = None
+        best_rank = len(PipelineInterface.PRIORITIES)
+        for index, job in enumerate(self._pending):
+            if job.lane is not None:
+                if job.lane in self._busy_lanes or job.lane in blocked_lanes:
+                    continue
+                blocked_lanes.add(job.lane)
+            if not self._has_capacity(job.pipe_name) or not self._has_priority_capacity(job.priority):
+                continue
+            # jobs are queued oldest first, the first starved job is the one waiting longest
+            if job.enqueue_time < starved_before:
+                best_index = index
+                break
+            rank = PipelineInterface.PRIORITIES.index(job.priority)
+            if rank < best_rank:
+                best_index = index
+                best_rank = rank
+                if rank == 0:
+                    # no job after this one is more urgent or starved
+                    break
+        if best_index is None:
+            return None
+        job = self._pending[best_index]
+        del self._pending[best_index]
+        if job.lane is not None:
+            self._busy_lanes.add(job.lane)
+        if job.job_id is not None:
+            self._pending_job_ids.discard(job.job_id)
+            self._running_job_ids.add(job.job_id)
+        self._active_jobs += 1
+        return job
+
+    def _work(self) -> None:
+        while True:
+            with self._condition:
+                job = self._next_job()
+                while job is None:
+                    if not self._running and len(self._pending) == 0:
+                        return
+                    self._condition.wait()
+                    job = self._next_job()
+                start_time = time.monotonic()
+                wait_time = start_time - job.enqueue_time
+                all_stats = self._get_job_stats(job)
+                for stats in all_stats:
+                    stats.queued -= 1
+                    stats.active += 1
+                    stats.total_wait += wait_time
+                    stats.max_wait = max(stats.max_wait, wait_time)
+
+            logging.debug(f"Running {job.pipe_name} ({job.priority}) after waiting {wait_time:.3f}s")
+            success = True
+            try:
+                if job.job_id is not None:
+                    self._job_store.lease_job(job.job_id, self._owner, time.time() + self._lease_timeout,
+                                              count_attempt=True)
+                job.pipe.process(self._get_messenger(job), job.message)
+            except Exception as ex:
+                success = False
+                logging.critical(ex, exc_info=True)
+            if job.job_id is not None:
+                # failed jobs are not retried, only jobs interrupted by a restart are replayed
+                try:
+                    self._job_store.complete_job(job.job_id)
+                except Exception as ex:
+                    logging.critical(ex, exc_info=True)
+
+            run_time = time.monotonic() - start_time
+            with self._condition:
+                self._active_jobs -= 1
+                for stats in all_stats:
+                    stats.active -= 1
+                    stats.total_run += run_time
+                    stats.max_run = max(stats.max_run, run_time)
+                    if success:
+                        stats.completed += 1
+                    else:
+                        stats.failed += 1
+                if job.lane is not None:
+                    self._busy_lanes.discard(job.lane)
+                if job.job_id is not None:
+                    self._running_job_ids.discard(job.job_id)
+                # a slot of this pipeline or lane got free, blocked jobs might be runnable now
+                self._condition.notify_all()
@@ -1,39 +1,56 @@
 import logging
-import threading
-from smrt.bot.messenger import MessengerInterface
-from .pipeline import PipelineInterface, HelpPipeline
+from smrt.bot.messenger import MessengerInterface, MessengerManager
+from .pipeline import PipelineInterface, HelpPipeline, MessageEnvelope
+from .dispatcher import PipelineDispatcher
+from .router import PipelineRouter
+from .dedup import MessageDeduplicator
 
 class MainPipeline():
-    def __init__(self):
+    def __init__(self, dispatcher: PipelineDispatcher|None = None, deduplicator: MessageDeduplicator|None = None):
         self._help_pipeline = HelpPipeline()
-        self._self_pipelines: list[PipelineInterface] = []
         self._pipelines = [#self._talk_pipeline,
                     self._help_pipeline]
         self._help_pipeline.set_pipelines(self._pipelines)
+        self._router = PipelineRouter()
+        self._router.add_pipeline(self._help_pipeline)
+        self._self_router = PipelineRouter()
+        self._dispatcher = dispatcher if dispatcher is not None else PipelineDispatcher()
+        self._deduplicator = deduplicator
+
+    def get_dispatcher(self) -> PipelineDispatcher:
+        return self._dispatcher
 
     def add_pipeline(self, pipe: PipelineInterface):
         self._pipelines.append(pipe)
         self._help_pipeline.set_pipelines(self._pipelines)
+        self._router.add_pipeline(pipe)
 
     def add_self_pipeline(self, pipe: PipelineInterface):
-        self._self_pipelines.append(pipe)
+        self._self_router.add_pipeline(pipe)
 
-    def process_pipe(self, pipe: PipelineInterface, messenger_instance: MessengerInterface, message: dict):
-        pipe.process(messenger_instance, message)
+    def replay_jobs(self, messenger_manager: MessengerManager) -> int:
+        # queue persisted jobs again that did not finish before the last shutdown
+        pipelines = self._router.get_pipelines() + self._self_router.get_pipelines()
+        return self._dispatcher.replay_jobs(pipelines, messenger_manager)
 
     def process(self, messenger_instance: MessengerInterface, message: dict):
+        # parse text and command once, all pipelines and the deduplicator use the envelope
+        envelope = MessageEnvelope(messenger_instance, message)
+        # repeated deliveries, e.g. after a reconnect of the messenger, are dropped before routing
+        if self._deduplicator is not None and self._deduplicator.is_duplicate(messenger_instance, message, envelope):
+            logging.debug(f"Dropping duplicate message from {messenger_instance.get_name()}")
+            return
         if messenger_instance.is_self_message(message):
-            for pipe in self._self_pipelines:
-                if pipe.allowed_in_chat_id(messenger_instance, message) and pipe.matches(messenger_instance, message):
+            for pipe in self._self_router.get_candidates(envelope):
+                if pipe.allowed_in_chat_id(messenger_instance, message, envelope) and pipe.matches(messenger_instance, message, envelope):
                     logging.debug(f"Self Pipe {type(pipe).__name__} matches, processing")
-                    thread = threading.Thread(target=self.process_pipe, args=(pipe, messenger_instance, message))
-                    thread.start()
+                    self._dispatcher.submit(pipe, messenger_instance, message, envelope.chat_id, envelope.text)
             return
 
-        for pipe in self._pipelines:
-            if pipe.allowed_in_chat_id(messenger_instance, message) and pipe.matches(messenger_instance, message):
+        # only pipelines routed by command, media type or catch-all need to be asked
+        for pipe in self._router.get_candidates(envelope):
+            if pipe.allowed_in_chat_id(messenger_instance, message, envelope) and pipe.matches(messenger_instance, message, envelope):
                 logging.debug(f"Pipe {type(pipe).__name__} matches, processing")
-                thread = threading.Thread(target=self.process_pipe, args=(pipe, messenger_instance, message))
-                thread.start()
+                self._dispatcher.submit(pipe, messenger_instance, message, envelope.chat_id, envelope.text)
             # delete message from phone after processing
             #whatsapp.deleteMessage(message)
@@ -2,7 +2,7 @@
 import time
 import logging
 import re
-from typing import List
+from typing import List, NamedTuple
 
 import tempfile
 import os
@@ -13,13 +13,22 @@ from smrt.bot.messenger import MessengerInterface, WhatsappMessenger
 
 class PipelineInterface(ABC):
     """Generic pipeline interface to process messages. """
-
-    def allowed_in_chat_id(self, messenger: MessengerInterface, message: dict) -> bool:
+    MEDIA_AUDIO = "audio"
+    MEDIA_IMAGE = "image"
+    # priority classes of the dispatcher, from most to least urgent
+    PRIORITY_INTERACTIVE = "interactive"
+    PRIORITY_LLM = "llm"
+    PRIORITY_MEDIA = "media"
+    PRIORITIES = [PRIORITY_INTERACTIVE, PRIORITY_LLM, PRIORITY_MEDIA]
+
+    def allowed_in_chat_id(self, messenger: MessengerInterface, message: dict,
+                           envelope: "MessageEnvelope|None" = None) -> bool:
         """Should allow true if the pipeline is in general allowed in this specific chat
 
         Args:
             messenger (MessengerInterface): Messenger instance to check in
             message (dict): The incoming message
+            envelope (MessageEnvelope | None): The parsed message if already built, saves resolving the chat id again
 
         Returns:
             bool: true if the message is allowed in this chat
@@ -27,10 +36,46 @@ class PipelineInterface(ABC):
         raise NotImplementedError()
 
     @abstractmethod
-    def matches(self, messenger: MessengerInterface, message: dict) -> bool:
-        """Should return true if the message should be processed by the pipeline. """
+    def matches(self, messenger: MessengerInterface, message: dict, envelope: "MessageEnvelope") -> bool:
+        """Should return true if the message should be processed by the pipeline. 
+
+        Args:
+            messenger (MessengerInterface): Messenger instance the message came from
+            message (dict): The incoming message
+            envelope (MessageEnvelope): Pre-parsed text, command and flags of the message
+
+        Returns:
+            bool: true if the pipeline should process the message
+        """
         raise NotImplementedError()
 
+    def get_commands(self) -> List[str]|None:
+        """Returns the commands (without #) that route a message to this pipeline. 
+
+        Only pipelines routed by a command or media type are asked in matches(). 
+
+        Returns:
+            List[str] | None: list of commands or None if every message has to be checked in matches()
+        """
+        return None
+
+    def get_media_types(self) -> List[str]:
+        """Returns the media types that route a message to this pipeline in addition to its commands. 
+
+        Returns:
+            List[str]: list of MEDIA_AUDIO and/or MEDIA_IMAGE
+        """
+        return []
+
+    def get_priority(self) -> str:
+        """Returns the priority class the dispatcher runs jobs of this pipeline in. 
+
+        Returns:
+            str: PRIORITY_INTERACTIVE for cheap commands, PRIORITY_LLM for requests to 
+                a language model or PRIORITY_MEDIA for heavy audio and image processing
+        """
+        return self.PRIORITY_INTERACTIVE
+
     @abstractmethod
     def process(self, messenger: MessengerInterface, message: dict) -> None:
         """Processes a message by the pipeline. """
@@ -55,18 +100,18 @@ class AbstractPipeline(PipelineInterface):
         if self._chat_id_whitelist is not None and self._chat_id_blacklist is not None:
             raise ValueError("Both chat_id_whitelist and chat_id_blacklist are set, this is not supported.")
 
-    def allowed_in_chat_id(self, messenger: MessengerInterface, message: dict) -> bool:
+    def allowed_in_chat_id(self, messenger: MessengerInterface, message: dict,
+                           envelope: "MessageEnvelope|None" = None) -> bool:
         # neither blacklist not whitelist is set, allow all
         if self._chat_id_whitelist is None and self._chat_id_blacklist is None:
             return True
+        chat_id = envelope.chat_id if envelope is not None else messenger.get_chat_id(message)
         # if only whitelist is set, only allow those
         if self._chat_id_whitelist is not None:
-            chat_id = messenger.get_chat_id(message)
             if chat_id not in self._chat_id_whitelist:
                 return False
         # if only blacklist is set, disallow those
         if self._chat_id_blacklist is not None:
-            chat_id = messenger.get_chat_id(message)
             if chat_id in self._chat_id_blacklist:
                 return False
         
@@ -81,54 +126,108 @@ class AbstractPipeline(PipelineInterface):
     def get_help_text(self) -> str:
         raise NotImplementedError()
 
+class ParsedCommand(NamedTuple):
+    """Result of parsing a command like '#command(params) remainder'. 
+
+    params and remainder are None if the parentheses of the parameters are not closed. 
+    """
+    command: str
+    params: str|None
+    remainder: str|None
+
+
 class PipelineHelper():
     """Helper functions for pipelines"""
 
+    # '#', the command of word characters (alnum or '_'), optional '(params)' and the rest
+    _COMMAND_REGEX = re.compile(r"\s*#(\w+)(?:\(([^)]*)(\))?)?(.*)", re.DOTALL)
+
     @staticmethod
-    def extract_command(data: str):
+    def parse_command(data: str) -> ParsedCommand | None:
+        """Parses a command with optional parameters from a text in a single pass
+
+        Args:
+            data (str): the message text
+
+        Returns:
+            ParsedCommand | None: the parsed command or None if the text does not start with a command
+        """
+        match = PipelineHelper._COMMAND_REGEX.match(data)
+        if match is None:
+            return None
+        command, params, end_parenthesis, left_over = match.groups()
+        if params is None:
+            return ParsedCommand(command, "", left_over.strip())
+        if end_parenthesis is None:
+            return ParsedCommand(command, None, None)
+        return ParsedCommand(command, params, left_over.strip())
+
+    @staticmethod
+    def extract_command(data: str) -> str:
         """Extracts commands from a text, returns empty string if there 
         is no command inside"""
-        left_over = data.strip()
-        if not left_over.startswith("#"):
-            return ""
-        length = 0
-        for i in range(1, len(left_over)):
-            if left_over[i].isalnum() or left_over[i] == "_":
-                length += 1
-            else:
-                break
-        if length == 0:
+        parsed = PipelineHelper.parse_command(data)
+        if parsed is None:
             return ""
-        command = left_over[1:1 + length]
-        return command
+        return parsed.command
 
     @staticmethod
-    def extract_command_full(data: str) -> tuple[str, str, str] | None:
-        """Extracts commands from a text"""
-        left_over = data.strip()
-        if not left_over.startswith("#"):
+    def extract_command_full(data: str) -> ParsedCommand | None:
+        """Extracts commands from a text, returns None if there is no command 
+        or the parameters are not closed"""
+        parsed = PipelineHelper.parse_command(data)
+        if parsed is None or parsed.remainder is None:
             return None
-        length = 0
-        for i in range(1, len(left_over)):
-            if left_over[i].isalnum() or left_over[i] == "_":
-                length += 1
-            else:
-                break
-        if length == 0:
-            return None
-        command = left_over[1:1 + length]
-        left_over = left_over[1 + length:]
-
-        params = ""
-        if len(left_over) > 0 and left_over[0] == "(":
-            end_parentesis = left_over.find(")")
-            if end_parentesis == -1:
-                return None
-            params = left_over[1:end_parentesis]
-            left_over = left_over[end_parentesis+1:]
-
-        left_over = left_over.strip()
-        return (command, params, left_over)
+        return parsed
+
+
+class MessageEnvelope():
+    """Normalized view of an incoming message. 
+
+    Built once per message by the main pipeline and shared by all pipelines, 
+    so text extraction and command parsing is not repeated in every matches() call. 
+    The message id is only needed by the deduplicator, it is resolved when first asked for.
+    """
+    __slots__ = ("message", "messenger", "text", "command", "params", "remainder",
+                 "chat_id", "is_group", "has_audio", "has_image", "_message_id")
+    _UNRESOLVED = object()
+    message: dict
+    messenger: MessengerInterface
+    text: str
+    command: str
+    params: str|None
+    remainder: str|None
+    chat_id: str
+    is_group: bool
+    has_audio: bool
+    has_image: bool
+
+    def __init__(self, messenger: MessengerInterface, message: dict) -> None:
+        self.message = message
+        self.messenger = messenger
+        self._message_id = self._UNRESOLVED
+        text = messenger.get_message_text(message)
+        self.text = text if text is not None else ""
+
+        parsed = PipelineHelper.parse_command(self.text)
+        if parsed is not None:
+            # still a command if the parameters are malformed, e.g. '#cmd(abc'
+            self.command, self.params, self.remainder = parsed
+        else:
+            self.command = ""
+            self.params = None
+            self.remainder = None
+
+        self.chat_id = messenger.get_chat_id(message)
+        self.is_group = messenger.is_group_message(message)
+        self.has_audio = messenger.has_audio_data(message)
+        self.has_image = messenger.has_image_data(message)
+
+    def get_message_id(self) -> str|None:
+        """Returns the id of the message, resolved on first use. """
+        if self._message_id is self._UNRESOLVED:
+            self._message_id = self.messenger.get_message_id(self.message)
+        return self._message_id
 
 
 
@@ -138,7 +237,7 @@ class MarkSeenPipeline(AbstractPipeline):
         # allow in all chats
         super().__init__(None, None)
 
-    def matches(self, messenger: MessengerInterface, message: dict):
+    def matches(self, messenger: MessengerInterface, message: dict, envelope: MessageEnvelope):
         # match all messages to acknowledge
         return True
 
@@ -156,9 +255,11 @@ class ChatIdPipeline(AbstractPipeline):
         # allow in all chats
         super().__init__(None, None)
 
-    def matches(self, messenger: MessengerInterface, message: dict):
-        command = PipelineHelper.extract_command(messenger.get_message_text(message))
-        return self.CHATID_COMMAND in command
+    def get_commands(self) -> List[str]:
+        return [self.CHATID_COMMAND]
+
+    def matches(self, messenger: MessengerInterface, message: dict, envelope: MessageEnvelope):
+        return envelope.command == self.CHATID_COMMAND
 
     def process(self, messenger: MessengerInterface, message: dict):
         response_text = messenger.get_chat_id(message)
@@ -179,13 +280,15 @@ class WhatsappLidPipeline(AbstractPipeline):
         # allow in all chats
         super().__init__(None, None)
 
-    def matches(self, messenger: MessengerInterface, message: dict):
-        command = PipelineHelper.extract_command(messenger.get_message_text(message))
-        return self.WALID_COMMAND in command
+    def get_commands(self) -> List[str]:
+        return [self.WALID_COMMAND]
+
+    def matches(self, messenger: MessengerInterface, message: dict, envelope: MessageEnvelope):
+        return envelope.command == self.WALID_COMMAND
 
     def process(self, messenger: MessengerInterface, message: dict):
         chat_id = messenger.get_chat_id(message)
-        if not chat_id.startswith("whatsapp:") or not isinstance(messenger, WhatsappMessenger):
+        if not chat_id.startswith("whatsapp:") or not isinstance(messenger.get_wrapped(), WhatsappMessenger):
             messenger.reply_message(message, f"The #{self.WALID_COMMAND} command is only available in WhatsApp chats.")
             messenger.mark_in_progress_fail(message)
             return
@@ -214,9 +317,11 @@ class HelpPipeline(AbstractPipeline):
     def set_pipelines(self, pipelines: List[PipelineInterface]):
         self._pipelines = pipelines
 
-    def matches(self, messenger: MessengerInterface, message: dict):
-        command = PipelineHelper.extract_command(messenger.get_message_text(message))
-        return self.HELP_COMMAND in command
+    def get_commands(self) -> List[str]:
+        return [self.HELP_COMMAND]
+
+    def matches(self, messenger: MessengerInterface, message: dict, envelope: MessageEnvelope):
+        return envelope.command == self.HELP_COMMAND
 
     def process(self, messenger: MessengerInterface, message: dict):
         messenger.mark_in_progress_0(message)
@@ -15,8 +15,8 @@ import smrt.bot.tools.texttoimage as texttoimage
 
 
 # article summary pipeline
-import trafilatura
-from smrt.bot.pipeline import PipelineInterface, PipelineHelper, AbstractPipeline
+from smrt.bot.tools.article_extract import ArticleExtractor, ProcessArticleExtractor
+from smrt.bot.pipeline import PipelineInterface, PipelineHelper, AbstractPipeline, MessageEnvelope
 from smrt.bot.tools import YoutubeExtract
 
 
@@ -31,10 +31,14 @@ class GrammarPipeline(AbstractPipeline):
         super().__init__(None, None)
         self._question_bot = question_bot
 
-    def matches(self, messenger: MessengerInterface, message: dict):
-        command = PipelineHelper.extract_command(messenger.get_message_text(message))
-        return self.GRAMMAR_COMMAND in command\
-            or self.GRAMMATIK_COMMAND in command
+    def get_commands(self) -> List[str]:
+        return [self.GRAMMAR_COMMAND, self.GRAMMATIK_COMMAND]
+
+    def get_priority(self) -> str:
+        return self.PRIORITY_LLM
+
+    def matches(self, messenger: MessengerInterface, message: dict, envelope: MessageEnvelope):
+        return envelope.command in self.get_commands()
 
     def process(self, messenger: MessengerInterface, message: dict):
         (command, _, text) = PipelineHelper.extract_command_full(
@@ -83,10 +87,9 @@ class UndeletePipeline(AbstractPipeline):
     def __init__(self) -> None:
         super().__init__(None, None)
 
-    def matches(self, messenger: MessengerInterface, message: dict):
+    def matches(self, messenger: MessengerInterface, message: dict, envelope: MessageEnvelope):
         if messenger.is_self_message(message):
-            command = PipelineHelper.extract_command(messenger.get_message_text(message))
-            return self.UNDELETE_COMMAND in command
+            return self.UNDELETE_COMMAND in envelope.command
         else: 
             # we need to store it into our database/buffer
             return True
@@ -110,9 +113,19 @@ class URLSummaryPipeline(AbstractPipeline):
 
     MAX_TRANSCRIPT_LENGTH = 20000
 
-    def __init__(self, summarizer: SummaryInterface, chat_id_whitelist: List[str] = None, chat_id_blacklist: List[str] = None):
+    def __init__(self, summarizer: SummaryInterface, chat_id_whitelist: List[str] = None, chat_id_blacklist: List[str] = None,
+                 worker_processes: int = 0):
+        """Creates the pipeline.
+
+        Args:
+            summarizer (SummaryInterface): Summarizes the extracted text
+            chat_id_whitelist (List[str], optional): Only process messages of these chats
+            chat_id_blacklist (List[str], optional): Never process messages of these chats
+            worker_processes (int): Number of worker processes extracting articles, 0 to extract in the bot process
+        """
         super().__init__(chat_id_whitelist, chat_id_blacklist)
         self._summarizer = summarizer
+        self._extractor = ProcessArticleExtractor(worker_processes) if worker_processes > 0 else ArticleExtractor()
         self._link_regex = re.compile(r'((https?):((//)|(\\\\))+([\w\d:#@%/;$()~_?\+-=\\\.&](#!)?)*)',
                                       re.DOTALL)
         self._language = "en"
@@ -123,9 +136,11 @@ class URLSummaryPipeline(AbstractPipeline):
             links.append(extract[0])
         return links
 
-    def matches(self, messenger: MessengerInterface, message: dict):
-        message_text = messenger.get_message_text(message)
-        links = self._extract_urls(message_text)
+    def get_priority(self) -> str:
+        return self.PRIORITY_LLM
+
+    def matches(self, messenger: MessengerInterface, message: dict, envelope: MessageEnvelope):
+        links = self._extract_urls(envelope.text)
         return len(links) > 0
     
     def use_google_bot(self, url):
@@ -136,9 +151,7 @@ class URLSummaryPipeline(AbstractPipeline):
         return True
 
     def _process_article(self, link: str):
-        config = trafilatura.settings.use_config()
         # pretend we are google bot, so we don't get annoying cookie shit
-        config.set("DEFAULT", "EXTRACTION_TIMEOUT", "0")
         headers = {}
         if self.use_google_bot(link):
             headers={'User-Agent': 'Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)'}
@@ -146,7 +159,7 @@ class URLSummaryPipeline(AbstractPipeline):
         response = session.get(link, headers=headers)
 
         # extract information from HTML
-        extracted_text = trafilatura.extract(response.content, config=config)
+        extracted_text = self._extractor.extract(response.content)
         lang, conf = langid.classify(extracted_text)
         summarized_text = self._summarizer.summarize(extracted_text, "de" if lang == "de" else self._language)['text']
         print("==EXTRACTED==")
@@ -202,9 +215,14 @@ class ImageGenerationPipeline(AbstractPipeline):
         super().__init__(None, None)
         self._image_api = image_api
 
-    def matches(self, messenger: MessengerInterface, message: dict):
-        command = PipelineHelper.extract_command(messenger.get_message_text(message))
-        return self.IMAGE_COMMAND in command
+    def get_commands(self) -> List[str]:
+        return [self.IMAGE_COMMAND]
+
+    def get_priority(self) -> str:
+        return self.PRIORITY_MEDIA
+
+    def matches(self, messenger: MessengerInterface, message: dict, envelope: MessageEnvelope):
+        return envelope.command == self.IMAGE_COMMAND
 
     def process(self, messenger: MessengerInterface, message: dict):
         (_, _, prompt) = PipelineHelper.extract_command_full(messenger.get_message_text(message))
@@ -242,9 +260,14 @@ class ImagePromptPipeline(AbstractPipeline):
         super().__init__(None, None)
         self._image_api = image_api
 
-    def matches(self, messenger: MessengerInterface, message: dict):
-        command = PipelineHelper.extract_command(messenger.get_message_text(message))
-        return self.COMMAND in command and messenger.has_image_data(message) 
+    def get_commands(self) -> List[str]:
+        return [self.COMMAND]
+
+    def get_priority(self) -> str:
+        return self.PRIORITY_LLM
+
+    def matches(self, messenger: MessengerInterface, message: dict, envelope: MessageEnvelope):
+        return envelope.command == self.COMMAND and envelope.has_image
 
     def process(self, messenger: MessengerInterface, message: dict):
         (_, _, prompt) = PipelineHelper.extract_command_full(messenger.get_message_text(message))
@@ -282,9 +305,14 @@ class TinderPipeline(AbstractPipeline):
         super().__init__(chat_id_whitelist, chat_id_blacklist)
         self._question_bot = question_bot
 
-    def matches(self, messenger: MessengerInterface, message: dict):
-        command = PipelineHelper.extract_command(messenger.get_message_text(message))
-        return self.TINDER_COMMAND in command
+    def get_commands(self) -> List[str]:
+        return [self.TINDER_COMMAND]
+
+    def get_priority(self) -> str:
+        return self.PRIORITY_LLM
+
+    def matches(self, messenger: MessengerInterface, message: dict, envelope: MessageEnvelope):
+        return envelope.command == self.TINDER_COMMAND
 
     def process(self, messenger: MessengerInterface, message: dict):
         (_, context, tinder_message) = PipelineHelper.extract_command_full(
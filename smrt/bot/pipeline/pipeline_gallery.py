@@ -2,37 +2,49 @@ import logging
 import typing
 import hashlib
 import uuid
-import io
 import os
 import time
 from PIL import Image
 from smrt.db import GalleryDatabase
 
 from smrt.bot.messenger import MessengerInterface
+from smrt.bot.tools.thumbnail import Thumbnailer, ProcessThumbnailer
 
-from .pipeline import PipelineHelper, AbstractPipeline
+from .pipeline import PipelineHelper, AbstractPipeline, MessageEnvelope
 class GalleryPipeline(AbstractPipeline):
     """Pipe to store images in a gallery from group chats. """
     GALLERY_COMMAND = "gallery"
+    HASH_CHUNK_SIZE = 64 * 1024
 
-    def __init__(self, gallery_db: GalleryDatabase, base_url: str, chat_id_whitelist: typing.List[str]|None = None, chat_id_blacklist: typing.List[str]|None = None):
+    def __init__(self, gallery_db: GalleryDatabase, base_url: str, chat_id_whitelist: typing.List[str]|None = None, chat_id_blacklist: typing.List[str]|None = None,
+                 worker_processes: int = 0):
         super().__init__(chat_id_whitelist, chat_id_blacklist)
         self._commands = [self.GALLERY_COMMAND]
         self._gallery_db = gallery_db
         self._base_url = base_url
+        # decoding and scaling large images is cpu heavy, it can run in worker processes
+        self._thumbnailer = ProcessThumbnailer(worker_processes) if worker_processes > 0 else Thumbnailer()
 
-    def matches(self, messenger: MessengerInterface, message: dict):
+    def get_commands(self) -> typing.List[str]:
+        return self._commands
+
+    def get_media_types(self) -> typing.List[str]:
+        return [self.MEDIA_IMAGE]
+
+    def get_priority(self) -> str:
+        return self.PRIORITY_MEDIA
+
+    def matches(self, messenger: MessengerInterface, message: dict, envelope: MessageEnvelope):
         # not a group message, no need to process
-        if not messenger.is_group_message(message):
+        if not envelope.is_group:
             return False
 
         # we have an image that we might need to process
-        if messenger.has_image_data(message):
+        if envelope.has_image:
             return True
 
         # gallery command
-        command = PipelineHelper.extract_command(messenger.get_message_text(message))
-        return command in self._commands
+        return envelope.command in self._commands
 
     def process_image_store(self, image_data) -> str:
         """Processes the image for thumb and storage
@@ -46,20 +58,38 @@ class GalleryPipeline(AbstractPipeline):
         file_uuid = str(uuid.uuid4())
 
         image_filename = self._gallery_db.get_storage_path() / f"{file_uuid}.blob"
-        thumb_filename = self._gallery_db.get_storage_path() / f"{file_uuid}_thumb.png"
         # write binary to file: 
         with open(image_filename, "wb") as f:
             f.write(image_data)
-        # create thumbnail
-        img = Image.open(image_filename)
-        # Create a thumbnail (max size 128x128, keeps aspect ratio)
-        img.thumbnail((300, 300))
-
-        # Save thumbnail
-        img.save(thumb_filename, format = "png")
-        logging.debug(f"Thumbnail saved as {thumb_filename}")
+        self._create_thumbnail(file_uuid)
+        return file_uuid
+
+    def process_image_file_store(self, image_file_path: str) -> str:
+        """Moves an image file into the storage and creates the thumb
+
+        Args:
+            image_file_path (str): Path of the image, must be on the same file system as the storage
+
+        Returns:
+            str: file uuid
+        """
+        file_uuid = str(uuid.uuid4())
+        os.replace(image_file_path, self._gallery_db.get_storage_path() / f"{file_uuid}.blob")
+        self._create_thumbnail(file_uuid)
         return file_uuid
 
+    def _create_thumbnail(self, file_uuid: str) -> None:
+        image_filename = self._gallery_db.get_storage_path() / f"{file_uuid}.blob"
+        thumb_filename = self._gallery_db.get_storage_path() / f"{file_uuid}_thumb.png"
+        self._thumbnailer.create_thumbnail(image_filename, thumb_filename)
+
+    def _hash_file(self, file_path: str) -> str:
+        sha256 = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(self.HASH_CHUNK_SIZE), b""):
+                sha256.update(chunk)
+        return sha256.hexdigest()
+
     def process(self, messenger: MessengerInterface, message: dict):
         # we have an image that we might need to process
         if messenger.has_image_data(message):
@@ -71,33 +101,38 @@ class GalleryPipeline(AbstractPipeline):
 
                 messenger.mark_in_progress_0(message)
 
-                mime_type, image_data = messenger.download_media(message)
-
-                if mime_type not in ["image/png", "image/jpeg", "image/jpg"]:
-                    logging.debug(f"Skipping image with unsupported mime type: {mime_type}")
-                    messenger.mark_skipped(message)
-                    return
+                # download next to the storage, so the image can be moved in without copying
+                download_path = str(self._gallery_db.get_storage_path() / f"{uuid.uuid4()}.part")
+                try:
+                    mime_type = messenger.download_media_to(message, download_path)
 
-                # Load image from binary data
-                img = Image.open(io.BytesIO(image_data))
+                    if mime_type not in ["image/png", "image/jpeg", "image/jpg"]:
+                        logging.debug(f"Skipping image with unsupported mime type: {mime_type}")
+                        messenger.mark_skipped(message)
+                        return
 
-                # Get width and height
-                width, height = img.size
+                    # only reads the header of the image
+                    with Image.open(download_path) as img:
+                        # Get width and height
+                        width, height = img.size
 
-                if width < 1024 or height < 1024:
-                    logging.debug(f"Skipping image with too small dimensions: {width}x{height}")
-                    messenger.mark_skipped(message)
-                    return
+                    if width < 1024 or height < 1024:
+                        logging.debug(f"Skipping image with too small dimensions: {width}x{height}")
+                        messenger.mark_skipped(message)
+                        return
 
-                # Compute MD5 hash and skip duplicates in the same group
-                sha256_hash = hashlib.sha256(image_data).hexdigest()
+                    # Compute hash and skip duplicates in the same group
+                    sha256_hash = self._hash_file(download_path)
 
-                if self._gallery_db.has_image(chat_id, sha256_hash):
-                    logging.debug(f"Skipping duplicate image with hash: {sha256_hash}")
-                    messenger.mark_skipped(message)
-                    return
+                    if self._gallery_db.has_image(chat_id, sha256_hash):
+                        logging.debug(f"Skipping duplicate image with hash: {sha256_hash}")
+                        messenger.mark_skipped(message)
+                        return
 
-                file_uuid = self.process_image_store(image_data)
+                    file_uuid = self.process_image_file_store(download_path)
+                finally:
+                    if os.path.exists(download_path):
+                        os.remove(download_path)
                 self._gallery_db.add_image(chat_id, messenger.get_sender_name(message), mime_type ,file_uuid, sha256_hash)
 
                 messenger.mark_in_progress_done(message)
@@ -163,10 +198,12 @@ class GalleryDeletePipeline(AbstractPipeline):
 
         self._confirm_awaits = {}  #chat_id -> timestamp
 
-    def matches(self, messenger: MessengerInterface, message: dict):
+    def get_commands(self) -> typing.List[str]:
+        return self._commands
+
+    def matches(self, messenger: MessengerInterface, message: dict, envelope: MessageEnvelope):
         # gallery delete command
-        command = PipelineHelper.extract_command(messenger.get_message_text(message))
-        return command in self._commands
+        return envelope.command in self._commands
 
     def _delete_image(self, chat_id: str, image_uuid: str):
         os.remove(self._gallery_db.get_storage_path() / f"{image_uuid}.blob")
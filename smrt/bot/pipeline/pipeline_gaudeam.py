@@ -3,7 +3,7 @@ import logging
 import typing
 import datetime
 from igitur import GaudeamCalendar, GaudeamMembers, GaudeamEvent
-from smrt.bot.pipeline import PipelineHelper, AbstractPipeline
+from smrt.bot.pipeline import PipelineHelper, AbstractPipeline, MessageEnvelope
 from smrt.bot.messenger import MessengerInterface, MessengerManager
 from smrt.bot.pipeline import scheduled
 
@@ -19,14 +19,11 @@ class GaudeamBdayPipeline(AbstractPipeline):
         self._commands = [self.BDAY_COMMAND]
         self._gaudeam = gaudeam
 
-    def matches(self, messenger: MessengerInterface, message: dict):
-        message_text = messenger.get_message_text(message)
-        if message_text is None:
-            return False
+    def get_commands(self) -> typing.List[str]:
+        return self._commands
 
-        # we check if the message is a ha command
-        command = PipelineHelper.extract_command(messenger.get_message_text(message))
-        return command in self._commands
+    def matches(self, messenger: MessengerInterface, message: dict, envelope: MessageEnvelope):
+        return envelope.command in self._commands
 
     def process(self, messenger: MessengerInterface, message: dict):
         (command, _, text) = PipelineHelper.extract_command_full(messenger.get_message_text(message))
@@ -60,14 +57,11 @@ class GaudeamCalendarPipeline(AbstractPipeline):
         self._commands = [self.DATE_COMMAND]
         self._gaudeam = gaudeam
 
-    def matches(self, messenger: MessengerInterface, message: dict):
-        message_text = messenger.get_message_text(message)
-        if message_text is None:
-            return False
+    def get_commands(self) -> typing.List[str]:
+        return self._commands
 
-        # we check if the message is a ha command
-        command = PipelineHelper.extract_command(messenger.get_message_text(message))
-        return command in self._commands
+    def matches(self, messenger: MessengerInterface, message: dict, envelope: MessageEnvelope):
+        return envelope.command in self._commands
 
     def process(self, messenger: MessengerInterface, message: dict):
         (command, _, text) = PipelineHelper.extract_command_full(messenger.get_message_text(message))
@@ -167,8 +161,8 @@ class GaudeamBdayScheduledTask(scheduled.AbstractScheduledTask):
 
             for chat_id in self.get_chat_ids():
                 try:
-                    messenger = self.get_messenger_manager().get_messenger_by_chatid(chat_id)
-                    messenger.send_message(chat_id, text)
+                    # waits for the rate limited queue, so failures end up in the log below
+                    self.get_messenger_manager().send_message(chat_id, text).result()
                 except Exception as ex:
                     logging.error(f"Failed to send birthday message to {chat_id} via: {ex}", exc_info=True)
         except Exception as ex:
@@ -201,8 +195,8 @@ class GaudeamEventsScheduledTask(scheduled.AbstractScheduledTask):
 
             for chat_id in self.get_chat_ids():
                 try:
-                    messenger = self.get_messenger_manager().get_messenger_by_chatid(chat_id)
-                    messenger.send_message(chat_id, text)
+                    # waits for the rate limited queue, so failures end up in the log below
+                    self.get_messenger_manager().send_message(chat_id, text).result()
                 except Exception as ex:
                     logging.error(f"Failed to send events message to {chat_id}: {ex}", exc_info=True)
         except Exception as ex:
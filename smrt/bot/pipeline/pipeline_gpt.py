@@ -1,6 +1,6 @@
 import logging
 import json
-from smrt.bot.pipeline import PipelineHelper, AbstractPipeline
+from smrt.bot.pipeline import PipelineHelper, AbstractPipeline, MessageEnvelope
 from smrt.db.database import MessageDatabase
 from smrt.bot.tools.question_bot import QuestionBotInterface
 from smrt.bot.messenger import MessengerInterface
@@ -20,12 +20,11 @@ class MessageQuestionPipeline(AbstractPipeline):
         self._question_bot = question_bot
         self._max_history_messages = max_history_messages
 
-    def matches(self, messenger: MessengerInterface, message: dict):
-        message_text = messenger.get_message_text(message)
+    def get_priority(self) -> str:
+        return self.PRIORITY_LLM
 
-        if message_text is not None and message_text != "":
-            return True
-        return False
+    def matches(self, messenger: MessengerInterface, message: dict, envelope: MessageEnvelope):
+        return envelope.text != ""
 
     def _get_chat(self, chat_id, count) -> list[dict]:
         result = []
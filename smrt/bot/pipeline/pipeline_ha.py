@@ -13,7 +13,7 @@ import time
 import uuid
 import websockets.sync.client
 
-from smrt.bot.pipeline import PipelineHelper, AbstractPipeline
+from smrt.bot.pipeline import PipelineHelper, AbstractPipeline, MessageEnvelope
 from smrt.bot.messenger import MessengerInterface
 
 
@@ -40,7 +40,7 @@ class AbstractHomeassistantPipeline(AbstractPipeline):
         """
         return uuid.uuid5(namespace=self._root_uuid, name=chat_id)
 
-    def matches(self, messenger: MessengerInterface, message: dict):
+    def matches(self, messenger: MessengerInterface, message: dict, envelope: MessageEnvelope):
         raise NotImplementedError("Subclasses should implement this method.")
 
     def process(self, messenger: MessengerInterface, message: dict):
@@ -58,19 +58,22 @@ class HomeassistantTextCommandPipeline(AbstractHomeassistantPipeline):
         self._commands = [self.HA_COMMAND]
         self._process_without_command = process_without_command  # if true, will process any text command without the #ha prefix
 
-    def matches(self, messenger: MessengerInterface, message: dict):
-        message_text = messenger.get_message_text(message)
-        if message_text is None:
-            return False
+    def get_commands(self) -> typing.List[str]|None:
+        if self._process_without_command:
+            # any text can be a command, needs to check every message
+            return None
+        return self._commands
+
+    def get_priority(self) -> str:
+        return self.PRIORITY_LLM
 
-        if self._process_without_command and not message_text.startswith("#"):
+    def matches(self, messenger: MessengerInterface, message: dict, envelope: MessageEnvelope):
+        if self._process_without_command and not envelope.text.startswith("#"):
             # If we process without command, we just check if the message has text and does not start with a command
-            message_text = messenger.get_message_text(message)
-            return message_text is not None and len(messenger.get_message_text(message)) > 0
+            return len(envelope.text) > 0
 
         # we check if the message is a ha command
-        command = PipelineHelper.extract_command(messenger.get_message_text(message))
-        return command in self._commands
+        return envelope.command in self._commands
 
     def process_text_command(self, ha_command: str, conversation_id: str):
         ws =  websockets.sync.client.connect(self._ha_ws_api_url)
@@ -161,10 +164,12 @@ class HomeassistantSayCommandPipeline(AbstractHomeassistantPipeline):
         self._commands = [self.HA_SAY_COMMAND]
 
 
-    def matches(self, messenger: MessengerInterface, message: dict):
-        command = PipelineHelper.extract_command(messenger.get_message_text(message))
-        return command in self._commands \
-            and messenger.get_chat_id(message) in self._get_chat_id_whitelist()
+    def get_commands(self) -> typing.List[str]:
+        return self._commands
+
+    def matches(self, messenger: MessengerInterface, message: dict, envelope: MessageEnvelope):
+        return envelope.command in self._commands \
+            and envelope.chat_id in self._get_chat_id_whitelist()
 
     def process_say_command(self, text: str):
         ws =  websockets.sync.client.connect(self._ha_ws_api_url)
@@ -246,9 +251,18 @@ class HomeassistantVoiceCommandPipeline(AbstractHomeassistantPipeline):
     def __init__(self, ha_token: str, ha_ws_api_url: str, chat_id_whitelist: typing.List[str]):
         super().__init__(ha_token, ha_ws_api_url, chat_id_whitelist)
 
-    def matches(self, messenger: MessengerInterface, message: dict):
-        return messenger.has_audio_data(message) \
-            and messenger.get_chat_id(message) in self._get_chat_id_whitelist()
+    def get_commands(self) -> typing.List[str]:
+        return []
+
+    def get_media_types(self) -> typing.List[str]:
+        return [self.MEDIA_AUDIO]
+
+    def get_priority(self) -> str:
+        return self.PRIORITY_MEDIA
+
+    def matches(self, messenger: MessengerInterface, message: dict, envelope: MessageEnvelope):
+        return envelope.has_audio \
+            and envelope.chat_id in self._get_chat_id_whitelist()
 
     def process_voice_command(self, wav_path: str, conversation_id: str) -> typing.Tuple[str, str]:
         msg_timeout = 60
@@ -331,12 +345,9 @@ class HomeassistantVoiceCommandPipeline(AbstractHomeassistantPipeline):
     def process(self, messenger: MessengerInterface, message: dict):
         messenger.mark_in_progress_0(message)
         try:
-            (_, decoded) = messenger.download_media(message)
             with tempfile.TemporaryDirectory() as tmp:
                 voice_data_file_path = os.path.join(tmp, 'audio.opus')
-                f = open(voice_data_file_path, "wb")
-                f.write(decoded)
-                f.close()
+                messenger.download_media_to(message, voice_data_file_path)
                 voice_data_wav_file_path = os.path.join(tmp, 'audio.wav')
                 # TODO: generalize the pcm reformatting, e.g. with transcript utils? 
                 subprocess.run(["ffmpeg", "-i", voice_data_file_path, "-ar", "16000", "-ac", "1", "-sample_fmt", "s16", voice_data_wav_file_path, ], check=True)
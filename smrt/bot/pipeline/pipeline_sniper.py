@@ -74,16 +74,14 @@ class NetcupScheduledTask(AbstractSniperTask):
                     if product not in new_products:
                         logging.debug(f"Netcup Product removed: {product} - {link}")
                         for chat_id in self.get_chat_ids():
-                            messenger = self.get_messenger_manager().get_messenger_by_chatid(chat_id)
-                            messenger.send_message(chat_id, f"Netcup Black Friday product removed: {product}")
+                            self.send_message(chat_id, f"Netcup Black Friday product removed: {product}")
 
                 # Figure out what's new
                 for product, link in new_products.items():
                     if product not in old_products:
                         logging.debug(f"Netcup New product found: {product} - {link}")
                         for chat_id in self.get_chat_ids():
-                            messenger = self.get_messenger_manager().get_messenger_by_chatid(chat_id)
-                            messenger.send_message(chat_id, f"Netcup Black Friday new product: {product} - {link}")
+                            self.send_message(chat_id, f"Netcup Black Friday new product: {product} - {link}")
                 old_products = new_products.copy()
                 # wait for a bit before checking again
                 time.sleep(30)
@@ -137,8 +135,7 @@ class CCCScheduledTask(AbstractSniperTask):
                 logging.info("CCC: Found tickets on page!")
                 logging.debug(r.text)
                 for chat_id in self.get_chat_ids():
-                    messenger = self.get_messenger_manager().get_messenger_by_chatid(chat_id)
-                    messenger.send_message(chat_id, "Tickets available! Check https://tickets.events.ccc.de/39c3/secondhand/")
+                    self.send_message(chat_id, "Tickets available! Check https://tickets.events.ccc.de/39c3/secondhand/")
                     time.sleep(3*60)
 
             except Exception as e:
@@ -235,9 +232,8 @@ class KleinanzeigenScheduledTask(AbstractSniperTask):
                     if article_id not in old_articles:
                         logging.info(f"Kleinanzeigen New article found: {article['title']} - {article['url']}")
                         for chat_id in self.get_chat_ids():
-                            messenger = self.get_messenger_manager().get_messenger_by_chatid(chat_id)
                             message = f"Kleinanzeigen new article:\n{article['title']}\nPrice: {article['price']}\nLocation: {article['location']}\n{article['url']}"
-                            messenger.send_message(chat_id, message)
+                            self.send_message(chat_id, message)
                 old_articles = new_articles.copy()
                 time.sleep(random.randint(45, 90))
 
@@ -3,10 +3,11 @@ import logging
 import tempfile
 from pathlib import Path
 from smrt.bot.messenger import MessengerInterface
-from smrt.bot.pipeline import PipelineHelper, AbstractPipeline
+from smrt.bot.pipeline import PipelineHelper, AbstractPipeline, MessageEnvelope
 
 from smrt.bot.tools.texttospeech import XttsModel, ThorstenTtsVoice
 from smrt.bot.tools.texttospeech_piper import PiperTTSModel
+from smrt.bot.tools.texttospeech_process import ProcessTextToSpeech
 
 
 class TextToSpeechPipeline(AbstractPipeline):
@@ -14,10 +15,17 @@ class TextToSpeechPipeline(AbstractPipeline):
     TTS_COMMAND = "tts"
     TTS_MODELS_COMMAND = "ttsmodels"
 
-    def __init__(self, model_path: Path|str):
+    def __init__(self, model_path: Path|str, worker_processes: int = 0):
+        """Creates the pipeline with all models found in the model path. 
+
+        Args:
+            model_path (Path | str): Folder with xtts_* and piper_* model folders
+            worker_processes (int): Number of worker processes per model, 0 to synthesize in the bot process
+        """
         super().__init__(None, None)
         self._tts_thorsten = None
         self._model_path = Path(model_path)
+        self._worker_processes = worker_processes
         self._models = {}
         logging.debug(f"Looking for models in {self._model_path}")
         
@@ -25,7 +33,7 @@ class TextToSpeechPipeline(AbstractPipeline):
             if folder.name.startswith("xtts_"):
                 model_name = folder.name.removeprefix("xtts_")
                 logging.info(f"Found xtts model: {model_name}")
-                self._models[model_name] = XttsModel(folder)
+                self._models[model_name] = self._create_model(XttsModel, folder)
             if folder.name.startswith("piper_"):
                 model_name = folder.name.removeprefix("piper_")
                 logging.info(f"Found piper model: {model_name}")
@@ -33,8 +41,8 @@ class TextToSpeechPipeline(AbstractPipeline):
                 if len(onnx_files) != 1:
                     logging.error(f"Folder {folder} does contain none or multiple onnx files")
                     continue
-                self._models[model_name] = PiperTTSModel(onnx_files[0])
-        thorsten = ThorstenTtsVoice()
+                self._models[model_name] = self._create_model(PiperTTSModel, onnx_files[0])
+        thorsten = self._create_model(ThorstenTtsVoice)
         self._models["thorsten"] = thorsten
         self._models[""] = thorsten # default model
 
@@ -44,6 +52,12 @@ class TextToSpeechPipeline(AbstractPipeline):
             self._commands.append(f"tts_{model_name}_de")
             self._commands.append(f"tts_{model_name}_en")
 
+    def _create_model(self, model_factory, *args):
+        if self._worker_processes > 0:
+            # the model is created and loaded in the worker processes
+            return ProcessTextToSpeech(model_factory, *args, workers=self._worker_processes)
+        return model_factory(*args)
+
     def get_model_name(self, command : str):
         if command.startswith("tts_"):
             model = command[4:]
@@ -59,9 +73,14 @@ class TextToSpeechPipeline(AbstractPipeline):
             model_name = ""
         return self._models[model_name]
 
-    def matches(self, messenger: MessengerInterface, message: dict):
-        command = PipelineHelper.extract_command(messenger.get_message_text(message))
-        return command in self._commands
+    def get_commands(self) -> list[str]:
+        return self._commands
+
+    def get_priority(self) -> str:
+        return self.PRIORITY_MEDIA
+
+    def matches(self, messenger: MessengerInterface, message: dict, envelope: MessageEnvelope):
+        return envelope.command in self._commands
 
     def process(self, messenger: MessengerInterface, message: dict):
         (command, _, text) = PipelineHelper.extract_command_full(messenger.get_message_text(message))
@@ -5,7 +5,7 @@ from pathlib import Path
 
 from smrt.bot.tools.summary import SummaryInterface
 from smrt.bot.messenger import MessengerInterface
-from smrt.bot.pipeline import AbstractPipeline
+from smrt.bot.pipeline import AbstractPipeline, MessageEnvelope
 from smrt.libtranscript import TranscriptInterface, TranscriptUtils
 
 
@@ -35,13 +35,21 @@ class VoiceMessagePipeline(AbstractPipeline):
         logging.info(f"  Transcribe group chats: {self._transcribe_group_chats}")
         logging.info(f"  Transcribe private chats: {self._transcribe_private_chats}")
 
-    def matches(self, messenger: MessengerInterface, message: dict):
-        if not messenger.has_audio_data(message):
+    def get_commands(self) -> List[str]:
+        return []
+
+    def get_media_types(self) -> List[str]:
+        return [self.MEDIA_AUDIO]
+
+    def get_priority(self) -> str:
+        return self.PRIORITY_MEDIA
+
+    def matches(self, messenger: MessengerInterface, message: dict, envelope: MessageEnvelope):
+        if not envelope.has_audio:
             return False
-        is_group = messenger.is_group_message(message)
-        if is_group and not self._transcribe_group_chats:
+        if envelope.is_group and not self._transcribe_group_chats:
             return False
-        if not is_group and not self._transcribe_private_chats:
+        if not envelope.is_group and not self._transcribe_private_chats:
             return False
         return True
 
@@ -50,13 +58,10 @@ class VoiceMessagePipeline(AbstractPipeline):
             logging.info("Processing in Voice Pipeline")
             messenger.mark_in_progress_0(message)
 
-            (_, decoded) = messenger.download_media(message)
-            # TODO: implement download to file instead of to memory
             with tempfile.TemporaryDirectory() as tmpdir:
                 # download file as binary and let ffmpeg figure out what it is
                 input_file_path = Path(tmpdir) / "input.bin"
-                with open(input_file_path, "wb") as input_file:
-                    input_file.write(decoded)
+                messenger.download_media_to(message, str(input_file_path))
 
                 # Generate pcm wav from it
                 wav_file_path = Path(tmpdir) / "output.wav"
@@ -0,0 +1,56 @@
+"""Routing of incoming messages to the pipelines that might process them. """
+from .pipeline import PipelineInterface, MessageEnvelope
+
+
+class PipelineRouter():
+    """Index of pipelines by the commands and media types they declare.
+
+    Pipelines that declare their commands are only looked up by the parsed command
+    of a message, pipelines without declared commands are checked for every message.
+    """
+
+    def __init__(self) -> None:
+        self._pipelines: list[PipelineInterface] = []
+        self._command_index: dict[str, list[int]] = {}
+        self._media_index: dict[str, list[int]] = {}
+        self._catch_all: list[int] = []
+
+    def add_pipeline(self, pipe: PipelineInterface) -> None:
+        """Adds a pipeline to the index.
+
+        Args:
+            pipe (PipelineInterface): The pipeline to route messages to
+        """
+        position = len(self._pipelines)
+        self._pipelines.append(pipe)
+        commands = pipe.get_commands()
+        if commands is None:
+            self._catch_all.append(position)
+            return
+        for command in commands:
+            self._command_index.setdefault(command, []).append(position)
+        for media_type in pipe.get_media_types():
+            self._media_index.setdefault(media_type, []).append(position)
+
+    def get_pipelines(self) -> list[PipelineInterface]:
+        """Returns all pipelines in the order they were added. """
+        return self._pipelines
+
+    def get_candidates(self, envelope: MessageEnvelope) -> list[PipelineInterface]:
+        """Returns the pipelines that could match the message in the order they were added.
+
+        Args:
+            envelope (MessageEnvelope): The parsed message
+
+        Returns:
+            list[PipelineInterface]: pipelines that still need to be checked with matches()
+        """
+        positions = list(self._catch_all)
+        if envelope.command != "":
+            positions.extend(self._command_index.get(envelope.command, ()))
+        if envelope.has_audio:
+            positions.extend(self._media_index.get(PipelineInterface.MEDIA_AUDIO, ()))
+        if envelope.has_image:
+            positions.extend(self._media_index.get(PipelineInterface.MEDIA_IMAGE, ()))
+        # keep the order of registration, a pipeline can be found by command and media
+        return [self._pipelines[position] for position in sorted(set(positions))]
@@ -1,4 +1,6 @@
 
+import logging
+from concurrent.futures import Future
 from smrt.bot import messenger
 
 class ScheduledTaskInterface:
@@ -17,6 +19,24 @@ class AbstractScheduledTask(ScheduledTaskInterface):
     
     def get_chat_ids(self) -> list[str]:
         return self._chat_ids
+
+    def send_message(self, chat_id: str, text: str) -> Future:
+        """Sends a message through the messenger manager without waiting for it, failures are logged.
+
+        Args:
+            chat_id (str): The unique identifier of the chat, e.g. 'signal://+4912345'
+            text (str): The message text to send
+
+        Returns:
+            Future: Resolves once the message was sent
+        """
+        future = self._messenger_manager.send_message(chat_id, text)
+        future.add_done_callback(lambda done: self._log_send_error(chat_id, done))
+        return future
+
+    def _log_send_error(self, chat_id: str, future: Future) -> None:
+        if not future.cancelled() and future.exception() is not None:
+            logging.error(f"{type(self).__name__}: failed to send message to {chat_id}: {future.exception()}")
     
     def run(self):
         raise NotImplementedError()
\ No newline at end of file
@@ -0,0 +1,31 @@
+"""Extraction of the main text of web pages, in the bot process or in worker processes. """
+import trafilatura
+
+from smrt.utils import ProcessWorkerPool
+
+
+class ArticleExtractor():
+    """Extracts the text of an article from its html with trafilatura. """
+
+    def __init__(self) -> None:
+        self._config = trafilatura.settings.use_config()
+        # signals for the extraction timeout only work in the main thread
+        self._config.set("DEFAULT", "EXTRACTION_TIMEOUT", "0")
+
+    def extract(self, html: bytes|str) -> str|None:
+        """Returns the main text of the page or None if no text was found. """
+        return trafilatura.extract(html, config=self._config)
+
+
+class ProcessArticleExtractor(ArticleExtractor):
+    """Extracts articles in dedicated worker processes, parsing large pages does not block the bot process. """
+
+    def __init__(self, workers: int = 1) -> None:
+        self._pool = ProcessWorkerPool(ArticleExtractor, workers=workers)
+
+    def extract(self, html: bytes|str) -> str|None:
+        return self._pool.call("extract", html)
+
+    def shutdown(self) -> None:
+        """Stops the worker processes. """
+        self._pool.shutdown()
@@ -133,9 +133,11 @@ class SenateStockNotification(pipeline.PipelineInterface):
     def run_async(self):
         self._thread.start() 
 
-    def matches(self, messenger: messenger.MessengerInterface, message: dict):
-        command = pipeline.PipelineHelper.extract_command(messenger.get_message_text(message))
-        return self.SENATE_STOCKS_COMMAND in command
+    def get_commands(self) -> list[str]:
+        return [self.SENATE_STOCKS_COMMAND]
+
+    def matches(self, messenger: messenger.MessengerInterface, message: dict, envelope: pipeline.MessageEnvelope):
+        return envelope.command == self.SENATE_STOCKS_COMMAND
 
     def process(self, messenger: messenger.MessengerInterface, message: dict):
         (_, _, on_off) = pipeline.PipelineHelper.extract_command_full(
@@ -0,0 +1,21 @@
+from pathlib import Path
+from typing import Callable
+
+from smrt.utils import ProcessWorkerPool
+from .texttospeech import TextToSpeechInterface
+
+
+class ProcessTextToSpeech(TextToSpeechInterface):
+    """Runs another text to speech model in dedicated worker processes. 
+
+    The worker writes the wav file itself, only the text and the file path are sent to the process. 
+    """
+    def __init__(self, tts_factory: Callable[..., TextToSpeechInterface], *args, workers: int = 1, **kwargs) -> None:
+        self._pool = ProcessWorkerPool(tts_factory, *args, workers=workers, **kwargs)
+
+    def tts(self, text: str, output_wav_file : Path|str, language : str = None) -> bool:
+        return self._pool.call("tts", text, str(output_wav_file), language)
+
+    def shutdown(self) -> None:
+        """Stops the worker processes. """
+        self._pool.shutdown()
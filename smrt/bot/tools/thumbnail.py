@@ -0,0 +1,40 @@
+"""Creation of image thumbnails, in the bot process or in worker processes. """
+import logging
+from pathlib import Path
+
+from PIL import Image
+
+from smrt.utils import ProcessWorkerPool
+
+
+class Thumbnailer():
+    """Creates thumbnails of images with PIL. """
+    DEFAULT_MAX_SIZE = 300
+
+    def create_thumbnail(self, image_path: Path|str, thumb_path: Path|str, max_size: int = DEFAULT_MAX_SIZE) -> None:
+        """Writes a png thumbnail of the image that keeps the aspect ratio.
+
+        Args:
+            image_path (Path | str): Path of the image
+            thumb_path (Path | str): Path of the thumbnail to write
+            max_size (int): Maximum width and height of the thumbnail
+        """
+        with Image.open(image_path) as img:
+            img.thumbnail((max_size, max_size))
+            img.save(thumb_path, format = "png")
+        logging.debug(f"Thumbnail saved as {thumb_path}")
+
+
+class ProcessThumbnailer(Thumbnailer):
+    """Creates thumbnails in dedicated worker processes, only the file paths are sent to the process. """
+
+    def __init__(self, workers: int = 1) -> None:
+        self._pool = ProcessWorkerPool(Thumbnailer, workers=workers)
+
+    def create_thumbnail(self, image_path: Path|str, thumb_path: Path|str,
+                         max_size: int = Thumbnailer.DEFAULT_MAX_SIZE) -> None:
+        self._pool.call("create_thumbnail", str(image_path), str(thumb_path), max_size)
+
+    def shutdown(self) -> None:
+        """Stops the worker processes. """
+        self._pool.shutdown()
@@ -1,5 +1,8 @@
-from .database import GalleryDatabase, MessageDatabase, InstaMessageSeenDB
+from .database import GalleryDatabase, MessageDatabase, InstaMessageSeenDB, JobQueueDatabase, JobEntry, SeenMessageDatabase
 
 __all__ = ["GalleryDatabase",
            "MessageDatabase",
-           "InstaMessageSeenDB"]
\ No newline at end of file
+           "InstaMessageSeenDB",
+           "JobQueueDatabase",
+           "JobEntry",
+           "SeenMessageDatabase"]
\ No newline at end of file
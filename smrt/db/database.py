@@ -1,5 +1,6 @@
 """A database implementation to store and retrieve messages. """
 import time
+import json
 import typing
 import sqlite3
 import threading
@@ -369,4 +370,223 @@ class InstaMessageSeenDB:
             cur.execute("SELECT 1 FROM seen_messages WHERE message_id = ? LIMIT 1",
                         (message_id,))
             row = cur.fetchone()
-            return row is not None
\ No newline at end of file
+            return row is not None
+
+    def add_seen_messages(self, message_ids: typing.List[str]) -> None:
+        """Adds seen message ids to the database in one transaction
+
+        Args:
+            message_ids (List[str]): The message ids to add
+        """
+        if len(message_ids) == 0:
+            return
+        with self._lock:
+            cur = self._db.cursor()
+            cur.executemany("INSERT OR IGNORE INTO seen_messages (message_id) VALUES (?)",
+                            [(message_id,) for message_id in message_ids])
+            self._db.commit()
+
+    def get_seen_messages(self, message_ids: typing.List[str]) -> typing.Set[str]:
+        """Returns which of the given message ids have been seen
+
+        Args:
+            message_ids (List[str]): The message ids to check
+        Returns:
+            Set[str]: The message ids that have been seen
+        """
+        if len(message_ids) == 0:
+            return set()
+        with self._lock:
+            cur = self._db.cursor()
+            placeholders = ",".join("?" * len(message_ids))
+            cur.execute(f"SELECT message_id FROM seen_messages WHERE message_id IN ({placeholders})",
+                        list(message_ids))
+            return {row["message_id"] for row in cur.fetchall()}
+
+class JobEntry():
+    job_id: str
+    pipeline: str
+    messenger: str
+    message: dict
+    owner: str
+    lease_until: float
+    attempts: int
+    time: float
+
+    def __init__(self, job_id: str, pipeline: str, messenger: str, message: dict,
+                 owner: str, lease_until: float, attempts: int, time: float):
+        self.job_id = job_id
+        self.pipeline = pipeline
+        self.messenger = messenger
+        self.message = message
+        self.owner = owner
+        self.lease_until = lease_until
+        self.attempts = attempts
+        self.time = time
+
+class JobQueueDatabase:
+    """Database to persist queued pipeline jobs so they survive a restart. 
+
+    Every job is leased by an owner (one per running dispatcher) until a point in time. 
+    Jobs of other owners or with an expired lease can be taken over and replayed. 
+    """
+
+    def __init__(self, storage_path: Path):
+        self._db = Database(storage_path, "jobs.db")
+        self._lock = threading.Lock()  # Mutex for all DB operations
+        self._create_tables()
+
+    def _create_tables(self):
+        with self._lock:
+            cur = self._db.cursor()
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    job_id VARCHAR(36) PRIMARY KEY,
+                    pipeline TEXT,
+                    messenger TEXT,
+                    message TEXT,
+                    owner VARCHAR(36),
+                    lease_until REAL,
+                    attempts INTEGER,
+                    time REAL
+                )
+                """)
+            self._db.commit()
+
+    def add_job(self, pipeline: str, messenger: str, message: dict, owner: str, lease_until: float) -> str:
+        """Adds a job to the queue
+
+        Args:
+            pipeline (str): Class name of the pipeline to run
+            messenger (str): Name of the messenger the message came from
+            message (dict): The message to process, must be serializable to json
+            owner (str): Owner that holds the lease of the job
+            lease_until (float): Unix time until the job is leased by the owner
+
+        Returns:
+            str: The id of the new job
+        """
+        payload = json.dumps(message)
+        job_id = str(uuid.uuid4())
+        with self._lock:
+            cur = self._db.cursor()
+            cur.execute("INSERT INTO jobs (job_id, pipeline, messenger, message, owner, lease_until, attempts, time) \
+                        VALUES (?, ?, ?, ?, ?, ?, 0, ?)",
+                        (job_id, pipeline, messenger, payload, owner, lease_until, time.time()))
+            self._db.commit()
+        return job_id
+
+    def lease_job(self, job_id: str, owner: str, lease_until: float, count_attempt: bool = False) -> None:
+        """Takes over or renews the lease of a job
+
+        Args:
+            job_id (str): The id of the job
+            owner (str): The new owner of the lease
+            lease_until (float): Unix time until the job is leased by the owner
+            count_attempt (bool): True if the job is about to be processed
+        """
+        with self._lock:
+            cur = self._db.cursor()
+            cur.execute("UPDATE jobs SET owner = ?, lease_until = ?, attempts = attempts + ? WHERE job_id = ?",
+                        (owner, lease_until, 1 if count_attempt else 0, job_id))
+            self._db.commit()
+
+    def complete_job(self, job_id: str) -> None:
+        """Removes a finished job from the queue
+
+        Args:
+            job_id (str): The id of the job
+        """
+        with self._lock:
+            cur = self._db.cursor()
+            cur.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+            self._db.commit()
+
+    def get_replayable_jobs(self, owner: str, now: float) -> typing.List[JobEntry]:
+        """Returns the jobs of other owners and the jobs with an expired lease, oldest first
+
+        Args:
+            owner (str): The owner that wants to replay jobs
+            now (float): The current unix time
+
+        Returns:
+            typing.List[JobEntry]: List of jobs that can be taken over
+        """
+        with self._lock:
+            return_list = []
+            for row in self._db.cursor().execute("SELECT job_id, pipeline, messenger, message, owner, lease_until, attempts, time \
+                                                  FROM jobs WHERE owner != ? OR lease_until < ? ORDER BY `time` ASC",
+                                                  (owner, now)):
+                entry = JobEntry(job_id=row["job_id"],
+                                 pipeline=row["pipeline"],
+                                 messenger=row["messenger"],
+                                 message=json.loads(row["message"]),
+                                 owner=row["owner"],
+                                 lease_until=row["lease_until"],
+                                 attempts=row["attempts"],
+                                 time=row["time"])
+                return_list.append(entry)
+            return return_list
+
+    def get_job_count(self) -> int:
+        """Returns the number of persisted jobs
+
+        Returns:
+            int: number of jobs that are queued or running
+        """
+        with self._lock:
+            cur = self._db.cursor()
+            cur.execute("SELECT COUNT(*) AS count FROM jobs")
+            return cur.fetchone()["count"]
+
+class SeenMessageDatabase:
+    """Database to remember ids of processed messages of all messengers across restarts. """
+
+    def __init__(self, storage_path: Path):
+        self._db = Database(storage_path, "seen.db")
+        self._lock = threading.Lock()  # Mutex for all DB operations
+        self._create_tables()
+
+    def _create_tables(self):
+        with self._lock:
+            cur = self._db.cursor()
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS seen_messages (
+                    message_key TEXT PRIMARY KEY,
+                    time REAL
+                )
+                """)
+
+            cur.execute("""
+            CREATE INDEX IF NOT EXISTS seen_time_index ON seen_messages(time)
+            """)
+            self._db.commit()
+
+    def add_seen_message(self, message_key: str) -> bool:
+        """Adds a message key to the database if it is not known yet
+
+        Args:
+            message_key (str): Messenger name and message id
+        Returns:
+            bool: True if the key was added, False if it had been seen before
+        """
+        with self._lock:
+            cur = self._db.cursor()
+            cur.execute("INSERT OR IGNORE INTO seen_messages (message_key, time) VALUES (?, ?)",
+                        (message_key, time.time()))
+            self._db.commit()
+            return cur.rowcount == 1
+
+    def delete_older_than(self, timestamp: float) -> int:
+        """Removes message keys that were added before the given time
+
+        Args:
+            timestamp (float): Unix time, older keys are removed
+        Returns:
+            int: number of removed keys
+        """
+        with self._lock:
+            cur = self._db.cursor()
+            cur.execute("DELETE FROM seen_messages WHERE time < ?", (timestamp,))
+            self._db.commit()
+            return cur.rowcount
@@ -3,10 +3,12 @@ from .utils import TranscriptUtils
 from .transcript_faster_whisper import FasterWhisperTranscript
 from .transcript_wyoming import WyomingTranscript
 from .transcript_qwen import Qwen35Transcript
+from .transcript_process import ProcessTranscript
 
 __all__ = ["TranscriptInterface",
            "TranscriptResult",
            "FasterWhisperTranscript",
            "TranscriptUtils",
            "WyomingTranscript",
-           "Qwen35Transcript"]
+           "Qwen35Transcript",
+           "ProcessTranscript"]
@@ -0,0 +1,20 @@
+from typing import Callable
+
+from smrt.utils import ProcessWorkerPool
+from .transcript import TranscriptInterface, TranscriptResult
+
+class ProcessTranscript(TranscriptInterface):
+    """Runs another transcript implementation in dedicated worker processes. 
+
+    The model is loaded once in every worker process, transcriptions then do not
+    block the main process, e.g. ProcessTranscript(FasterWhisperTranscript, workers=1). 
+    """
+    def __init__(self, transcript_factory: Callable[..., TranscriptInterface], *args, workers: int = 1, **kwargs):
+        self._pool = ProcessWorkerPool(transcript_factory, *args, workers=workers, **kwargs)
+
+    def transcribe(self, audio_data) -> TranscriptResult:
+        return self._pool.call("transcribe", audio_data)
+
+    def shutdown(self) -> None:
+        """Stops the worker processes. """
+        self._pool.shutdown()
@@ -1,3 +1,13 @@
 from . import utils
+from .process_pool import ProcessWorkerPool
+from .audio_transcoder import AudioTranscoder
+from .log import JsonFormatter, Lazy, ModuleLevelFilter, Truncated, configure_logging
 
-__all__ = ["utils"]
\ No newline at end of file
+__all__ = ["utils",
+           "AudioTranscoder",
+           "JsonFormatter",
+           "Lazy",
+           "ModuleLevelFilter",
+           "ProcessWorkerPool",
+           "Truncated",
+           "configure_logging"]
@@ -0,0 +1,111 @@
+"""Encoding of outbound voice messages through pipes with a cache of encoded results. """
+import hashlib
+import logging
+import subprocess
+import threading
+from collections import OrderedDict
+
+
+class AudioTranscoder():
+    """Encodes audio files into the formats the messengers expect.
+
+    The audio is piped through the encoder without temporary files. The number of
+    encoder processes running at the same time is bounded, so a burst of voice replies
+    does not start dozens of encoders. Encoded results are cached by a hash of the
+    input and the format, so repeated phrases and retries are not encoded again.
+    """
+    FORMAT_OPUS = "opus"
+    FORMAT_AAC = "aac"
+    # encoders read the input from stdin and write the result to stdout
+    COMMANDS = {
+        FORMAT_OPUS: ["opusenc", "--quiet", "-", "-"],
+        FORMAT_AAC: ["ffmpeg", "-loglevel", "error", "-i", "pipe:0", "-c:a", "aac", "-f", "adts", "pipe:1"],
+    }
+    DEFAULT_MAX_PROCESSES = 2
+    DEFAULT_CACHE_SIZE = 32 * 1024 * 1024
+
+    def __init__(self, max_processes: int = DEFAULT_MAX_PROCESSES, cache_size: int = DEFAULT_CACHE_SIZE) -> None:
+        """Creates the transcoder.
+
+        Args:
+            max_processes (int): Maximum number of encoder processes running at the same time
+            cache_size (int): Maximum size of all cached encoded results in bytes, 0 disables the cache
+        """
+        if max_processes < 1:
+            raise ValueError("max_processes must be at least 1")
+        if cache_size < 0:
+            raise ValueError("cache_size must not be negative")
+        self._slots = threading.BoundedSemaphore(max_processes)
+        self._cache_size = cache_size
+        self._cache: OrderedDict[str, bytes] = OrderedDict()
+        self._cached_bytes = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def encode_file(self, input_file_path: str, audio_format: str) -> bytes:
+        """Encodes an audio file.
+
+        Args:
+            input_file_path (str): Path of the audio file, any format the encoder can read
+            audio_format (str): FORMAT_OPUS or FORMAT_AAC
+
+        Returns:
+            bytes: The encoded audio
+        """
+        with open(input_file_path, "rb") as file:
+            return self.encode(file.read(), audio_format)
+
+    def encode(self, audio_data: bytes, audio_format: str) -> bytes:
+        """Encodes audio data.
+
+        Args:
+            audio_data (bytes): The audio, any format the encoder can read
+            audio_format (str): FORMAT_OPUS or FORMAT_AAC
+
+        Returns:
+            bytes: The encoded audio
+        """
+        if audio_format not in self.COMMANDS:
+            raise ValueError(f"Unknown audio format {audio_format}, must be one of {list(self.COMMANDS.keys())}")
+        key = f"{audio_format}:{hashlib.sha256(audio_data).hexdigest()}"
+        with self._lock:
+            encoded = self._cache.get(key)
+            if encoded is not None:
+                self._cache.move_to_end(key)
+                self._hits += 1
+                return encoded
+            self._misses += 1
+
+        with self._slots:
+            result = subprocess.run(self.COMMANDS[audio_format], input=audio_data,
+                                    stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=False)
+        if result.returncode != 0:
+            raise subprocess.CalledProcessError(result.returncode, self.COMMANDS[audio_format],
+                                                output=None, stderr=result.stderr)
+        encoded = result.stdout
+        logging.debug(f"Encoded {len(audio_data)} bytes to {len(encoded)} bytes of {audio_format}")
+        self._add_to_cache(key, encoded)
+        return encoded
+
+    def _add_to_cache(self, key: str, encoded: bytes) -> None:
+        if len(encoded) > self._cache_size:
+            return
+        with self._lock:
+            if key in self._cache:
+                return
+            self._cache[key] = encoded
+            self._cached_bytes += len(encoded)
+            while self._cached_bytes > self._cache_size:
+                _, evicted = self._cache.popitem(last=False)
+                self._cached_bytes -= len(evicted)
+
+    def get_stats(self) -> dict:
+        """Returns cache hits, misses and the size of the cache. """
+        with self._lock:
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "entries": len(self._cache),
+                "cached_bytes": self._cached_bytes,
+            }
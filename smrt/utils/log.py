@@ -0,0 +1,165 @@
+"""Cheap logging of large payloads, per-module log levels and json log output. """
+import json
+import logging
+import os
+from itertools import islice
+from typing import Callable
+
+
+class Truncated():
+    """Renders a payload for a log message only when the message is emitted.
+
+    Long strings inside the payload, e.g. base64 media, are cut before they are rendered,
+    so the cost does not grow with the size of the payload. The rendered text is cut in the
+    middle if it is still longer than max_length.
+
+    Use it as argument of the log call, not inside an f-string:
+    logging.info("Message: %s", Truncated(data))
+    """
+    __slots__ = ("_payload", "_max_length")
+    DEFAULT_MAX_LENGTH = 750
+    MAX_ITEMS = 64
+
+    def __init__(self, payload, max_length: int = DEFAULT_MAX_LENGTH) -> None:
+        self._payload = payload
+        self._max_length = max_length
+
+    @classmethod
+    def _render(cls, value, max_string: int) -> str:
+        # like str() of dicts and lists, but long strings and collections are cut before rendering
+        if isinstance(value, str):
+            if len(value) > max_string:
+                return f"{value[:max_string]!r}...({len(value)} chars)"
+            return repr(value)
+        if isinstance(value, dict):
+            items = [f"{cls._render(key, max_string)}: {cls._render(item, max_string)}"
+                     for key, item in islice(value.items(), cls.MAX_ITEMS)]
+            if len(value) > cls.MAX_ITEMS:
+                items.append("...")
+            return "{" + ", ".join(items) + "}"
+        if isinstance(value, (list, tuple)):
+            items = [cls._render(item, max_string) for item in value[:cls.MAX_ITEMS]]
+            if len(value) > cls.MAX_ITEMS:
+                items.append("...")
+            text = ", ".join(items)
+            return f"[{text}]" if isinstance(value, list) else f"({text})"
+        if isinstance(value, (bytes, bytearray)) and len(value) > max_string:
+            return f"{bytes(value[:max_string])!r}...({len(value)} bytes)"
+        return str(value)
+
+    def __str__(self) -> str:
+        half = max(1, self._max_length // 2)
+        text = self._render(self._payload, half)
+        if len(text) > self._max_length:
+            return f"{text[:half]}...{text[-half:]}"
+        return text
+
+
+class Lazy():
+    """Calls a function only when the log message is emitted, e.g. Lazy(response.json). """
+    __slots__ = ("_function",)
+
+    def __init__(self, function: Callable[[], object]) -> None:
+        self._function = function
+
+    def __str__(self) -> str:
+        return str(self._function())
+
+
+def _module_name(record: logging.LogRecord, cache: dict[str, str]) -> str:
+    """Returns the dotted module name of the code that logged the record. """
+    if record.name != "root":
+        return record.name
+    module = cache.get(record.pathname)
+    if module is None:
+        # the repo logs through the root logger, so the module is taken from the file
+        parts = os.path.splitext(os.path.normpath(record.pathname))[0].split(os.sep)
+        module = ".".join(parts[parts.index("smrt"):]) if "smrt" in parts else record.module
+        cache[record.pathname] = module
+    return module
+
+
+class ModuleLevelFilter(logging.Filter):
+    """Applies log levels per module, the most specific configured module wins. """
+
+    def __init__(self, default_level: int, levels: dict[str, int]|None = None) -> None:
+        """Creates the filter.
+
+        Args:
+            default_level (int): Level of modules without an own level
+            levels (dict[str, int] | None): Levels by module or logger name, e.g. {'smrt.bot.messenger': logging.DEBUG}
+        """
+        super().__init__()
+        self._default_level = default_level
+        self._levels = levels or {}
+        self._modules: dict[str, str] = {}
+        self._module_levels: dict[str, int] = {}
+
+    def _get_level(self, module: str) -> int:
+        level = self._module_levels.get(module)
+        if level is None:
+            level = self._default_level
+            parts = module.split(".")
+            for i in range(len(parts), 0, -1):
+                prefix = ".".join(parts[:i])
+                if prefix in self._levels:
+                    level = self._levels[prefix]
+                    break
+            self._module_levels[module] = level
+        return level
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno >= self._get_level(_module_name(record, self._modules))
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as one json object per line. """
+
+    def __init__(self, datefmt: str|None = None) -> None:
+        super().__init__(datefmt=datefmt)
+        self._modules: dict[str, str] = {}
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record, self.datefmt),
+            "level": record.levelname,
+            "module": _module_name(record, self._modules),
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def configure_logging(level: str = "INFO", levels: dict[str, str]|None = None, json_output: bool = False,
+                      fmt: str = '%(asctime)s %(levelname)-8s %(message)s',
+                      datefmt: str = '%Y-%m-%d %H:%M:%S') -> None:
+    """Replaces the handlers of the root logger.
+
+    Records below the lowest configured level are not created at all. Modules with a higher
+    level than the lowest one are filtered when the record is emitted.
+
+    Args:
+        level (str): Level of all modules without an own level, e.g. 'INFO'
+        levels (dict[str, str] | None): Levels by module or logger name, e.g. {'smrt.bot.messenger.whatsapp': 'DEBUG'}
+        json_output (bool): Write one json object per line instead of text
+        fmt (str): Format of text output
+        datefmt (str): Format of the time
+    """
+    default_level = logging.getLevelName(level.upper())
+    module_levels = {module: logging.getLevelName(module_level.upper())
+                     for module, module_level in (levels or {}).items()}
+    for name, module_level in [("level", default_level)] + list(module_levels.items()):
+        if not isinstance(module_level, int):
+            raise ValueError(f"Unknown log level for {name}: {module_level}")
+
+    handler = logging.StreamHandler()
+    handler.setFormatter(JsonFormatter(datefmt) if json_output else logging.Formatter(fmt, datefmt))
+    handler.addFilter(ModuleLevelFilter(default_level, module_levels))
+    root = logging.getLogger()
+    for old_handler in list(root.handlers):
+        root.removeHandler(old_handler)
+        old_handler.close()
+    root.addHandler(handler)
+    root.setLevel(min([default_level] + list(module_levels.values())))
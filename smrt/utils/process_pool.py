@@ -0,0 +1,87 @@
+"""Pool of worker processes that keep a heavy object, e.g. a loaded model, alive between calls. """
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable
+
+# object created once per worker process by the pool initializer
+_worker_instance = None
+
+
+def _init_worker(factory: Callable[..., Any], args: tuple, kwargs: dict) -> None:
+    global _worker_instance
+    logging.info(f"Creating {getattr(factory, '__name__', factory)} in worker process {multiprocessing.current_process().name}")
+    _worker_instance = factory(*args, **kwargs)
+
+
+def _call_worker(method_name: str, args: tuple, kwargs: dict) -> Any:
+    return getattr(_worker_instance, method_name)(*args, **kwargs)
+
+
+class ProcessWorkerPool():
+    """Runs methods of an object that lives in dedicated worker processes.
+
+    Every worker process creates its own instance with the factory once and keeps it,
+    so models are loaded per process and not per call. CPU heavy work then runs outside
+    of the main process and does not compete with the message handling for the GIL.
+    Arguments and return values are pickled, so they should be small and plain.
+    """
+
+    def __init__(self, factory: Callable[..., Any], *args, workers: int = 1, **kwargs) -> None:
+        """Creates the pool, the processes are started on the first call.
+
+        Args:
+            factory (Callable[..., Any]): Importable class or function that creates the instance
+            workers (int): Number of worker processes
+            args, kwargs: Arguments for the factory
+        """
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        self._factory = factory
+        self._args = args
+        self._kwargs = kwargs
+        self._workers = workers
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # spawn instead of fork, forking a process with running threads and loaded models is unsafe
+                self._executor = ProcessPoolExecutor(max_workers=self._workers,
+                                                     mp_context=multiprocessing.get_context("spawn"),
+                                                     initializer=_init_worker,
+                                                     initargs=(self._factory, self._args, self._kwargs))
+            return self._executor
+
+    def call(self, method_name: str, *args, **kwargs) -> Any:
+        """Calls a method of the instance in one of the worker processes and waits for the result.
+
+        Args:
+            method_name (str): Name of the method to call
+            args, kwargs: Arguments for the method
+
+        Returns:
+            Any: The return value of the method
+        """
+        executor = self._get_executor()
+        try:
+            return executor.submit(_call_worker, method_name, args, kwargs).result()
+        except BrokenProcessPool:
+            # a worker died, e.g. killed for using too much memory, start fresh processes next time
+            logging.error(f"Worker process of {getattr(self._factory, '__name__', self._factory)} died, restarting pool")
+            with self._lock:
+                if self._executor is executor:
+                    self._executor = None
+            executor.shutdown(wait=False)
+            raise
+
+    def shutdown(self) -> None:
+        """Stops all worker processes. """
+        with self._lock:
+            executor = self._executor
+            self._executor = None
+        if executor is not None:
+            executor.shutdown(wait=True)
@@ -0,0 +1,120 @@
+"""Tests for the group id cache. """
+import threading
+import time
+import unittest
+from smrt.bot.messenger import GroupIdCache
+
+
+class SlowGroupFetcher():
+    """Returns a fixed group list and counts how often it was fetched. """
+    def __init__(self, groups: dict, delay: float = 0.0, fail: bool = False):
+        self.groups = groups
+        self.delay = delay
+        self.fail = fail
+        self.calls = 0
+
+    def __call__(self) -> dict:
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.fail:
+            raise ConnectionError("server not reachable")
+        return self.groups
+
+
+class GroupIdCacheTests(unittest.TestCase):
+    """Test cases for the group id cache"""
+    def test_get_group_id_when_cached_then_fetch_once(self):
+        # arrange
+        fetcher = SlowGroupFetcher({"internal": "group.abc"})
+        cache = GroupIdCache(fetcher)
+
+        # act
+        results = [cache.get_group_id("internal") for _ in range(3)]
+
+        # assert
+        self.assertEqual(results, ["group.abc"] * 3)
+        self.assertEqual(fetcher.calls, 1)
+        self.assertEqual(cache.get_stats()["hits"], 2)
+
+    def test_get_group_id_when_unknown_then_cache_negative(self):
+        # arrange
+        fetcher = SlowGroupFetcher({"internal": "group.abc"})
+        cache = GroupIdCache(fetcher)
+
+        # act
+        results = [cache.get_group_id("unknown") for _ in range(3)]
+
+        # assert
+        self.assertEqual(results, [None] * 3)
+        self.assertEqual(fetcher.calls, 1)
+
+    def test_get_group_id_when_ttl_expired_then_refresh(self):
+        # arrange
+        fetcher = SlowGroupFetcher({"internal": "group.abc"})
+        cache = GroupIdCache(fetcher, ttl=0)
+
+        # act
+        cache.get_group_id("internal")
+        cache.get_group_id("internal")
+
+        # assert
+        self.assertEqual(fetcher.calls, 2)
+
+    def test_get_group_id_when_concurrent_misses_then_single_refresh(self):
+        # arrange
+        fetcher = SlowGroupFetcher({"internal": "group.abc"}, delay=0.2)
+        cache = GroupIdCache(fetcher)
+        results = []
+
+        def lookup():
+            results.append(cache.get_group_id("internal"))
+
+        threads = [threading.Thread(target=lookup) for _ in range(5)]
+
+        # act
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # assert
+        self.assertEqual(results, ["group.abc"] * 5)
+        self.assertEqual(fetcher.calls, 1)
+
+    def test_get_group_id_when_refresh_fails_then_keep_stale_entries(self):
+        # arrange
+        fetcher = SlowGroupFetcher({"internal": "group.abc"})
+        cache = GroupIdCache(fetcher, ttl=0)
+        self.assertTrue(cache.warm_up())
+        fetcher.fail = True
+
+        # act
+        group_id = cache.get_group_id("internal")
+        unknown_id = cache.get_group_id("unknown")
+
+        # assert
+        self.assertEqual(group_id, "group.abc")
+        self.assertIsNone(unknown_id)
+        self.assertEqual(cache.get_stats()["errors"], 2)
+        self.assertEqual(cache.get_stats()["missing"], 0)
+
+    def test_get_group_id_when_refresh_failed_then_do_not_fetch_again_within_backoff(self):
+        # arrange
+        fetcher = SlowGroupFetcher({"internal": "group.abc"}, fail=True)
+        cache = GroupIdCache(fetcher)
+
+        # act
+        first = cache.get_group_id("internal")
+        second = cache.get_group_id("internal")
+        other = cache.get_group_id("other")
+
+        # assert
+        self.assertIsNone(first)
+        self.assertIsNone(second)
+        self.assertIsNone(other)
+        self.assertEqual(fetcher.calls, 1)
+        self.assertEqual(cache.get_stats()["errors"], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+"""Tests for the pooled http session. """
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from smrt.bot.messenger import PooledHttpSession
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    """Answers every request with a small json body on a keep-alive connection. """
+    protocol_version = "HTTP/1.1"
+    calls = 0
+
+    def do_GET(self):
+        self.do_POST()
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        type(self).calls += 1
+        if self.path.endswith("/gateway"):
+            self.send_response(502)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = b'{"status": "ok"}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class PooledHttpSessionTests(unittest.TestCase):
+    """Test cases for the pooled http session"""
+    def setUp(self):
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), KeepAliveHandler)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        KeepAliveHandler.calls = 0
+        self._url = f"http://127.0.0.1:{self._server.server_address[1]}/api"
+
+    def tearDown(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def test_post_when_called_repeatedly_then_reuse_connection(self):
+        # arrange
+        session = PooledHttpSession(headers={"Authorization": "Bearer test"})
+
+        # act
+        responses = [session.post(self._url, json={"i": i}).json() for i in range(3)]
+        stats = session.get_stats()
+        session.close()
+
+        # assert
+        self.assertEqual(responses, [{"status": "ok"}] * 3)
+        self.assertEqual(stats["requests"], 3)
+        self.assertEqual(stats["connections"], 1)
+        self.assertEqual(stats["reused"], 2)
+
+    def test_request_when_gateway_error_then_retry_only_idempotent_methods(self):
+        # arrange
+        session = PooledHttpSession(retries=2, backoff_factor=0)
+
+        # act
+        post_status = session.post(f"{self._url}/gateway", json={}).status_code
+        post_calls = KeepAliveHandler.calls
+        get_status = session.get(f"{self._url}/gateway").status_code
+        get_calls = KeepAliveHandler.calls - post_calls
+        session.close()
+
+        # assert
+        self.assertEqual(post_status, 502)
+        self.assertEqual(post_calls, 1)
+        self.assertEqual(get_status, 502)
+        self.assertEqual(get_calls, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+"""Tests for polling instagram direct threads. """
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from pathlib import Path
+from types import SimpleNamespace
+from smrt.db import InstaMessageSeenDB
+from smrt.bot.messenger.instagram import InstagramMessageQueue
+
+
+class FakeInstagrapi():
+    """Direct threads with messages, newest first like the instagram api. """
+    def __init__(self):
+        self.threads = {}
+        self.message_calls = 0
+        self.failing_threads = set()
+
+    def add_message(self, thread_id: str, message_id: str):
+        now = datetime.now()
+        thread = self.threads.setdefault(thread_id, {"messages": [], "last_activity_at": now})
+        thread["messages"].insert(0, SimpleNamespace(id=message_id, thread_id=thread_id, timestamp=now))
+        thread["last_activity_at"] = now + timedelta(microseconds=len(thread["messages"]))
+
+    def direct_threads(self, amount):
+        return [SimpleNamespace(id=thread_id, thread_title="", thread_type="private",
+                                last_activity_at=thread["last_activity_at"])
+                for thread_id, thread in list(self.threads.items())[:amount]]
+
+    def direct_messages(self, thread_id, amount):
+        self.message_calls += 1
+        if str(thread_id) in self.failing_threads:
+            raise ConnectionError("rate limited")
+        return self.threads[str(thread_id)]["messages"][:amount]
+
+
+class InstagramMessageQueueTests(unittest.TestCase):
+    """Test cases for incremental polling"""
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self._seen_db = InstaMessageSeenDB(Path(self._tmp.name))
+        self._client = FakeInstagrapi()
+        self._received = []
+        messenger = SimpleNamespace(get_instagrapi=lambda: self._client)
+        self._queue = InstagramMessageQueue(messenger, self._seen_db,
+                                            lambda _, message: self._received.append(message.id))
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_poll_when_threads_unchanged_then_fetch_nothing(self):
+        # arrange
+        self._client.add_message("1", "a")
+        self._client.add_message("2", "b")
+        self._queue.poll()
+
+        # act
+        new_messages = self._queue.poll()
+
+        # assert
+        self.assertEqual(new_messages, 0)
+        self.assertEqual(self._client.message_calls, 2)
+        self.assertEqual(self._queue.get_stats()["db_lookups"], 1)
+        self.assertEqual(self._received, ["a", "b"])
+
+    def test_poll_when_new_message_then_fetch_only_active_thread(self):
+        # arrange
+        self._client.add_message("1", "a")
+        self._client.add_message("2", "b")
+        self._queue.poll()
+        self._client.add_message("2", "c")
+        self._client.add_message("2", "d")
+
+        # act
+        new_messages = self._queue.poll()
+
+        # assert
+        self.assertEqual(new_messages, 2)
+        self.assertEqual(self._client.message_calls, 3)
+        self.assertEqual(self._received, ["a", "b", "c", "d"])
+        self.assertEqual(self._seen_db.get_seen_messages(["a", "b", "c", "d", "e"]), {"a", "b", "c", "d"})
+
+    def test_poll_when_seen_before_restart_then_skip(self):
+        # arrange
+        self._seen_db.add_seen_messages(["a"])
+        self._client.add_message("1", "a")
+        self._client.add_message("1", "b")
+
+        # act
+        new_messages = self._queue.poll()
+
+        # assert
+        self.assertEqual(new_messages, 1)
+        self.assertEqual(self._received, ["b"])
+
+    def test_poll_when_fetching_later_thread_fails_then_fetch_it_again_next_poll(self):
+        # arrange
+        self._client.add_message("1", "a")
+        self._client.add_message("2", "b")
+        self._client.failing_threads.add("2")
+        first_poll = self._queue.poll()
+        self._client.failing_threads.clear()
+
+        # act
+        second_poll = self._queue.poll()
+
+        # assert
+        self.assertEqual(first_poll, 1)
+        self.assertEqual(second_poll, 1)
+        self.assertEqual(self._received, ["a", "b"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+"""Tests for receiving messages without blocking the backend connection. """
+import threading
+import time
+import unittest
+from smrt.bot.messenger import MessageHandOff, ReconnectBackoff, WhatsappMessenger, WhatsappMessageQueue
+
+
+class NamedMessenger():
+    """Messenger that only has a name. """
+    def get_name(self):
+        return "test"
+
+
+class MessageHandOffTests(unittest.TestCase):
+    """Test cases for handing messages over to a worker thread"""
+    def test_put_when_callback_slow_then_return_immediately(self):
+        # arrange
+        release = threading.Event()
+        processed = []
+        def callback(_, message):
+            release.wait()
+            processed.append(message)
+        hand_off = MessageHandOff(NamedMessenger(), callback)
+        hand_off.start()
+
+        # act
+        start = time.monotonic()
+        for i in range(3):
+            hand_off.put({"id": i})
+        duration = time.monotonic() - start
+        release.set()
+        hand_off.stop()
+
+        # assert
+        self.assertLess(duration, 0.1)
+        self.assertEqual(processed, [{"id": 0}, {"id": 1}, {"id": 2}])
+        self.assertEqual(hand_off.get_stats()["processed"], 3)
+
+    def test_put_when_queue_full_then_drop_message(self):
+        # arrange
+        hand_off = MessageHandOff(NamedMessenger(), lambda messenger, message: None, max_pending=2)
+
+        # act
+        results = [hand_off.put({"id": i}) for i in range(3)]
+
+        # assert
+        self.assertEqual(results, [True, True, False])
+        self.assertEqual(hand_off.get_stats()["dropped"], 1)
+        self.assertEqual(hand_off.get_stats()["pending"], 2)
+
+    def test_work_when_callback_fails_then_continue(self):
+        # arrange
+        processed = []
+        def callback(_, message):
+            if message["id"] == 0:
+                raise RuntimeError("broken message")
+            processed.append(message)
+        hand_off = MessageHandOff(NamedMessenger(), callback)
+        hand_off.start()
+
+        # act
+        hand_off.put({"id": 0})
+        hand_off.put({"id": 1})
+        hand_off.stop()
+
+        # assert
+        self.assertEqual(processed, [{"id": 1}])
+        self.assertEqual(hand_off.get_stats()["failed"], 1)
+
+
+class ReconnectBackoffTests(unittest.TestCase):
+    """Test cases for the reconnect backoff"""
+    def test_next_delay_when_attempts_grow_then_double_until_max(self):
+        # arrange
+        backoff = ReconnectBackoff(initial_delay=1, max_delay=4)
+
+        # act
+        delays = [backoff.next_delay() for _ in range(5)]
+        backoff.reset()
+        after_reset = backoff.next_delay()
+
+        # assert
+        for delay, expected in zip(delays, [1, 2, 4, 4, 4]):
+            self.assertGreaterEqual(delay, expected * 0.5)
+            self.assertLessEqual(delay, expected)
+        self.assertLessEqual(after_reset, 1)
+
+
+class WhatsappMessageQueueTests(unittest.TestCase):
+    """Test cases for the whatsapp message queue"""
+    def test_run_when_server_unreachable_then_retry_until_stopped(self):
+        # arrange
+        whatsapp = WhatsappMessenger("http://127.0.0.1:1", "session", "key", "lid")
+        message_queue = WhatsappMessageQueue(whatsapp, lambda messenger, message: None,
+                                             reconnect_delay=0.01, max_reconnect_delay=0.02)
+
+        # act
+        message_queue.run_async()
+        time.sleep(0.5)
+        message_queue.stop()
+
+        # assert
+        stats = message_queue.get_stats()
+        self.assertFalse(stats["connected"])
+        self.assertGreaterEqual(stats["reconnects"], 2)
+
+    def test_on_new_message_when_other_session_then_ignore(self):
+        # arrange
+        processed = []
+        whatsapp = WhatsappMessenger("http://127.0.0.1:1", "session", "key", "lid")
+        message_queue = WhatsappMessageQueue(whatsapp, lambda messenger, message: processed.append(message))
+
+        # act
+        message_queue.on_new_message({"response": {"session": "other"}})
+        message_queue.on_new_message({"response": {"session": "session", "body": "hi"}})
+
+        # assert
+        self.assertEqual(message_queue.get_stats()["received"], 1)
+        self.assertIsNotNone(message_queue.get_stats()["seconds_since_last_event"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+"""Tests for the streaming media helpers. """
+import base64
+import io
+import json
+import os
+import tempfile
+import unittest
+from smrt.bot.messenger import MediaTooLargeError
+from smrt.bot.messenger.media import Base64JsonBody, JsonBase64FieldDecoder, LimitedFileWriter, write_chunks
+
+
+def split(data: bytes, size: int) -> list[bytes]:
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+class JsonBase64FieldDecoderTests(unittest.TestCase):
+    """Test cases for decoding a base64 field of a streamed json response"""
+    def test_feed_when_split_in_small_chunks_then_decode_field(self):
+        # arrange
+        media = os.urandom(10000)
+        body = json.dumps({"mimetype": "audio/ogg; codecs=opus",
+                           "base64": base64.b64encode(media).decode(),
+                           "filename": "voice.ogg"}).encode()
+
+        for chunk_size in [1, 7, 4096]:
+            output = io.BytesIO()
+            decoder = JsonBase64FieldDecoder("base64", LimitedFileWriter(output))
+
+            # act
+            for chunk in split(body, chunk_size):
+                decoder.feed(chunk)
+
+            # assert
+            self.assertTrue(decoder.is_complete())
+            self.assertEqual(output.getvalue(), media)
+            self.assertEqual(decoder.get_text_field("mimetype"), "audio/ogg; codecs=opus")
+
+    def test_feed_when_slashes_escaped_then_decode_field(self):
+        # arrange
+        media = bytes([0xff] * 30)
+        encoded = base64.b64encode(media).decode().replace("/", "\\/")
+        body = ('{"base64": "' + encoded + '", "mimetype": "image/png"}').encode()
+        output = io.BytesIO()
+        decoder = JsonBase64FieldDecoder("base64", LimitedFileWriter(output))
+
+        # act
+        for chunk in split(body, 3):
+            decoder.feed(chunk)
+
+        # assert
+        self.assertEqual(output.getvalue(), media)
+        self.assertEqual(decoder.get_text_field("mimetype"), "image/png")
+
+    def test_feed_when_larger_than_max_size_then_raise(self):
+        # arrange
+        body = json.dumps({"base64": base64.b64encode(os.urandom(1000)).decode()}).encode()
+        decoder = JsonBase64FieldDecoder("base64", LimitedFileWriter(io.BytesIO(), max_size=500))
+
+        # act / assert
+        with self.assertRaises(MediaTooLargeError):
+            for chunk in split(body, 100):
+                decoder.feed(chunk)
+
+
+class WriteChunksTests(unittest.TestCase):
+    """Test cases for writing chunks to a file"""
+    def test_write_chunks_when_within_limit_then_write_file(self):
+        # arrange
+        with tempfile.TemporaryDirectory() as tmp:
+            file_path = os.path.join(tmp, "media.bin")
+
+            # act
+            size = write_chunks([b"abc", b"", b"def"], file_path, max_size=6)
+
+            # assert
+            self.assertEqual(size, 6)
+            with open(file_path, "rb") as file:
+                self.assertEqual(file.read(), b"abcdef")
+
+
+class Base64JsonBodyTests(unittest.TestCase):
+    """Test cases for the streamed json body with base64 media"""
+    def test_iter_when_file_source_then_equal_to_json(self):
+        # arrange
+        media = os.urandom(Base64JsonBody.CHUNK_SIZE * 2 + 5)
+        with tempfile.TemporaryDirectory() as tmp:
+            file_path = os.path.join(tmp, "image.png")
+            with open(file_path, "wb") as file:
+                file.write(media)
+            body = Base64JsonBody({"recipients": ["+49123"], "base64_attachments": [Base64JsonBody.MEDIA]},
+                                  file_path, "data:image/png;base64,")
+
+            # act
+            first = b"".join(body)
+            second = b"".join(body)
+
+        # assert
+        expected = {"recipients": ["+49123"],
+                    "base64_attachments": ["data:image/png;base64," + base64.b64encode(media).decode()]}
+        self.assertEqual(json.loads(first), expected)
+        self.assertEqual(first, second)
+        self.assertEqual(len(body), len(first))
+
+    def test_init_when_placeholder_missing_then_raise(self):
+        # act / assert
+        with self.assertRaises(ValueError):
+            Base64JsonBody({"base64": "inline"}, b"data")
+
+
+if __name__ == '__main__':
+    unittest.main()
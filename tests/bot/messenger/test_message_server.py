@@ -0,0 +1,106 @@
+"""Tests for the message server. """
+import threading
+import time
+import unittest
+from smrt.bot.messenger import MessageServerFlaskApp, MessengerManager, OutboundQueue
+
+
+class SlowMessenger():
+    """Messenger that takes a while for every message. """
+
+    def __init__(self, name: str, delay: float) -> None:
+        self._name = name
+        self._delay = delay
+        self._lock = threading.Lock()
+        self.sent = []
+
+    def get_name(self):
+        return self._name
+
+    def send_message(self, chat_id, text):
+        time.sleep(self._delay)
+        if chat_id.endswith("broken"):
+            raise ConnectionError("chat not reachable")
+        with self._lock:
+            self.sent.append(chat_id)
+
+
+class MessageServerTests(unittest.TestCase):
+    """Test cases for the message server"""
+    def setUp(self):
+        self._manager = MessengerManager()
+        self._manager.add_messenger(SlowMessenger("signal", 0.2))
+        self._manager.add_messenger(SlowMessenger("whatsapp", 0.2))
+        self._client = MessageServerFlaskApp(self._manager).get_app().test_client()
+
+    def test_send_message_when_many_chats_then_send_in_parallel(self):
+        # arrange
+        chat_ids = [f"signal://+49{i}" for i in range(4)] + [f"whatsapp://{i}@c.us" for i in range(4)]
+
+        # act
+        start = time.monotonic()
+        response = self._client.post("/send_message", json={"chatIds": chat_ids, "message": "hello"})
+        duration = time.monotonic() - start
+
+        # assert
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(response.json["sent_to"]), sorted(chat_ids))
+        self.assertLess(duration, 0.2 * len(chat_ids) / 2)
+
+    def test_send_message_when_outbound_queue_then_send_to_chats_in_parallel(self):
+        # arrange
+        manager = MessengerManager()
+        signal = SlowMessenger("signal", 0.2)
+        manager.add_messenger(signal)
+        outbound = OutboundQueue(signal)
+        manager.set_outbound_queue(outbound)
+        client = MessageServerFlaskApp(manager).get_app().test_client()
+        chat_ids = [f"signal://+49{i}" for i in range(8)]
+
+        # act
+        start = time.monotonic()
+        response = client.post("/send_message", json={"chatIds": chat_ids, "message": "hello"})
+        duration = time.monotonic() - start
+        outbound.stop()
+
+        # assert
+        self.assertEqual(sorted(response.json["sent_to"]), sorted(chat_ids))
+        self.assertLess(duration, 0.2 * len(chat_ids) / 2)
+
+    def test_send_message_when_chat_fails_then_report_per_chat(self):
+        # arrange
+        chat_ids = ["signal://+49123", "signal://broken", "telegram://1"]
+
+        # act
+        response = self._client.post("/send_message", json={"chatIds": chat_ids, "message": "hello"})
+
+        # assert
+        self.assertEqual(response.status_code, 500)
+        results = response.json["results"]
+        self.assertEqual(results["signal://+49123"]["status"], "sent")
+        self.assertEqual(results["signal://broken"]["status"], "error")
+        self.assertEqual(results["telegram://1"]["status"], "error")
+
+    def test_send_message_when_async_then_accept_and_poll_results(self):
+        # arrange
+        chat_ids = ["signal://+49123", "whatsapp://1@c.us"]
+
+        # act
+        response = self._client.post("/send_message", json={"chatIds": chat_ids, "message": "hello", "async": True})
+        job_id = response.json["job_id"]
+        job = self._client.get(f"/send_message/{job_id}").json
+        for _ in range(50):
+            if job["state"] == "done":
+                break
+            time.sleep(0.05)
+            job = self._client.get(f"/send_message/{job_id}").json
+
+        # assert
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(job["state"], "done")
+        self.assertEqual(sorted(job["sent_to"]), sorted(chat_ids))
+        self.assertEqual(self._client.get("/send_message/unknown").status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
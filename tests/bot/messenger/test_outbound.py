@@ -0,0 +1,152 @@
+"""Tests for the rate limited outbound queue. """
+import threading
+import time
+import unittest
+import requests
+from smrt.bot.messenger import MessengerManager, OutboundQueue, TokenBucket
+
+
+class SendRecordingMessenger():
+    """Messenger that records sent messages and fails with the given errors first. """
+
+    def __init__(self, errors: list|None = None) -> None:
+        self.sent = []
+        self.errors = list(errors or [])
+        self._lock = threading.Lock()
+
+    def get_name(self):
+        return "recording"
+
+    def send_message(self, chat_id, text):
+        with self._lock:
+            if len(self.errors) > 0:
+                raise self.errors.pop(0)
+            self.sent.append((chat_id, text, time.monotonic()))
+
+
+def http_error(status_code: int) -> requests.HTTPError:
+    response = requests.Response()
+    response.status_code = status_code
+    return requests.HTTPError(f"{status_code} error", response=response)
+
+
+class TokenBucketTests(unittest.TestCase):
+    """Test cases for the token bucket"""
+    def test_get_wait_time_when_burst_used_then_wait_for_refill(self):
+        # arrange
+        bucket = TokenBucket(rate=2, burst=2)
+        now = time.monotonic()
+
+        # act
+        bucket.consume(now)
+        bucket.consume(now)
+        wait_time = bucket.get_wait_time(now)
+
+        # assert
+        self.assertAlmostEqual(wait_time, 0.5, places=2)
+        self.assertEqual(bucket.get_wait_time(now + 0.5), 0)
+
+
+class OutboundQueueTests(unittest.TestCase):
+    """Test cases for the outbound queue"""
+    def test_send_message_when_chat_limited_then_space_messages(self):
+        # arrange
+        recorder = SendRecordingMessenger()
+        outbound = OutboundQueue(recorder, rate=100, burst=100, chat_rate=10, chat_burst=1)
+
+        # act
+        futures = [outbound.send_message("chat://a", f"message {i}") for i in range(3)]
+        results = [future.result(timeout=5) for future in futures]
+        outbound.stop()
+
+        # assert
+        self.assertEqual(results, [1, 1, 1])
+        self.assertEqual([text for _, text, _ in recorder.sent], ["message 0", "message 1", "message 2"])
+        self.assertGreaterEqual(recorder.sent[2][2] - recorder.sent[0][2], 0.15)
+
+    def test_get_stats_when_messages_waited_for_limit_then_count_each_once(self):
+        # arrange
+        recorder = SendRecordingMessenger()
+        outbound = OutboundQueue(recorder, rate=100, burst=100, chat_rate=10, chat_burst=1)
+
+        # act
+        futures = [outbound.send_message("chat://a", f"message {i}") for i in range(3)]
+        for future in futures:
+            future.result(timeout=5)
+        outbound.stop()
+
+        # assert
+        self.assertEqual(outbound.get_stats()["throttled"], 2)
+
+    def test_send_message_when_rate_limited_by_server_then_retry(self):
+        # arrange
+        recorder = SendRecordingMessenger([http_error(429), http_error(503)])
+        outbound = OutboundQueue(recorder, retry_backoff=0.01)
+
+        # act
+        attempts = outbound.send_message("chat://a", "hello").result(timeout=5)
+        outbound.stop()
+
+        # assert
+        self.assertEqual(attempts, 3)
+        self.assertEqual(outbound.get_stats()["retried"], 2)
+
+    def test_send_message_when_client_error_then_fail_without_retry(self):
+        # arrange
+        recorder = SendRecordingMessenger([http_error(400)])
+        outbound = OutboundQueue(recorder, retry_backoff=0.01)
+
+        # act
+        future = outbound.send_message("chat://a", "hello")
+
+        # assert
+        with self.assertRaises(requests.HTTPError):
+            future.result(timeout=5)
+        outbound.stop()
+        self.assertEqual(outbound.get_stats()["failed"], 1)
+        self.assertEqual(recorder.sent, [])
+
+    def test_send_message_when_queue_full_then_reject(self):
+        # arrange
+        recorder = SendRecordingMessenger()
+        outbound = OutboundQueue(recorder, rate=0.01, burst=1, max_queue_size=1)
+
+        # act
+        outbound.send_message("chat://a", "first").result(timeout=5)
+        outbound.send_message("chat://a", "waiting for a token")
+        future = outbound.send_message("chat://b", "rejected")
+
+        # assert
+        with self.assertRaises(RuntimeError):
+            future.result(timeout=5)
+        self.assertEqual(outbound.get_stats()["rejected"], 1)
+
+
+class MessengerManagerSendTests(unittest.TestCase):
+    """Test cases for sending through the messenger manager with and without outbound queue"""
+    def _send(self, with_queue: bool) -> list:
+        recorder = SendRecordingMessenger([http_error(400)])
+        manager = MessengerManager()
+        manager.add_messenger(recorder)
+        outbound = OutboundQueue(recorder) if with_queue else None
+        if outbound is not None:
+            manager.set_outbound_queue(outbound)
+        failed = manager.send_message("recording://a", "fails")
+        sent = manager.send_message("recording://a", "hello")
+        results = [type(failed.exception(timeout=5)), sent.result(timeout=5)]
+        if outbound is not None:
+            outbound.stop()
+        return results
+
+    def test_send_message_when_no_queue_then_same_future_contract_as_queue(self):
+        # act
+        without_queue = self._send(with_queue=False)
+        with_queue = self._send(with_queue=True)
+
+        # assert
+        self.assertEqual(without_queue, [requests.HTTPError, 1])
+        self.assertEqual(without_queue, with_queue)
+
+
+if __name__ == '__main__':
+    unittest.main()
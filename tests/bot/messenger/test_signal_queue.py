@@ -0,0 +1,68 @@
+"""Tests for receiving signal messages. """
+import json
+import threading
+import time
+import unittest
+from websockets.sync.server import serve
+from smrt.bot.messenger import SignalMessenger, SignalMessageQueue
+
+
+class SignalMessageQueueTests(unittest.TestCase):
+    """Test cases for the signal message queue"""
+    def test_get_messages_when_callback_slow_then_keep_receiving(self):
+        # arrange
+        sent_at = int(time.time() * 1000)
+        messages = [{"envelope": {"timestamp": sent_at, "dataMessage": {"message": f"hi {i}"}}} for i in range(3)]
+        messages.insert(1, {"envelope": {"timestamp": sent_at, "typingMessage": {}}})
+        all_sent = threading.Event()
+        def handler(connection):
+            for message in messages:
+                connection.send(json.dumps(message))
+            all_sent.set()
+            connection.recv()
+        release = threading.Event()
+        processed = []
+        def callback(_, message):
+            release.wait()
+            processed.append(message["envelope"]["dataMessage"]["message"])
+
+        with serve(handler, "127.0.0.1", 0) as server:
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            signal = SignalMessenger("+49123", "127.0.0.1", server.socket.getsockname()[1])
+            message_queue = SignalMessageQueue(signal, callback)
+
+            # act
+            message_queue.run_async()
+            all_sent.wait(5)
+            for _ in range(50):
+                if message_queue.get_stats()["received"] == 3:
+                    break
+                time.sleep(0.02)
+            received_before_processing = message_queue.get_stats()["received"]
+            release.set()
+            message_queue.stop()
+            server.shutdown()
+
+        # assert
+        self.assertEqual(received_before_processing, 3)
+        self.assertEqual(processed, ["hi 0", "hi 1", "hi 2"])
+        self.assertIsNotNone(message_queue.get_stats()["last_lag"])
+
+    def test_get_messages_when_service_unreachable_then_retry_until_stopped(self):
+        # arrange
+        signal = SignalMessenger("+49123", "127.0.0.1", 1)
+        message_queue = SignalMessageQueue(signal, lambda messenger, message: None,
+                                           reconnect_delay=0.01, max_reconnect_delay=0.02)
+
+        # act
+        message_queue.run_async()
+        time.sleep(0.3)
+        message_queue.stop()
+
+        # assert
+        self.assertFalse(message_queue.get_stats()["connected"])
+        self.assertGreaterEqual(message_queue.get_stats()["reconnects"], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
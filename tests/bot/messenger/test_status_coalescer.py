@@ -0,0 +1,105 @@
+"""Tests for the coalescing of progress marks. """
+import time
+import unittest
+from smrt.bot.messenger import StatusCoalescer, SignalMessenger
+
+
+class MarkRecordingMessenger():
+    """Messenger that records the progress marks it was asked to send. """
+
+    def __init__(self) -> None:
+        self.marks = []
+
+    def get_name(self):
+        return "recording"
+
+    def get_message_id(self, message):
+        return message["id"]
+
+    def mark_in_progress_0(self, message):
+        self.marks.append((message["id"], "0"))
+
+    def mark_in_progress_50(self, message):
+        self.marks.append((message["id"], "50"))
+
+    def mark_in_progress_done(self, message):
+        self.marks.append((message["id"], "done"))
+
+    def mark_in_progress_fail(self, message):
+        self.marks.append((message["id"], "fail"))
+
+    def mark_skipped(self, message):
+        self.marks.append((message["id"], "skipped"))
+
+    def reply_message(self, message, text):
+        self.marks.append((message["id"], text))
+
+
+class StatusCoalescerTests(unittest.TestCase):
+    """Test cases for the status coalescer"""
+    def test_set_status_when_finished_within_window_then_send_only_final(self):
+        # arrange
+        recorder = MarkRecordingMessenger()
+        coalescer = StatusCoalescer(window=1.0)
+        wrapped = coalescer.wrap(recorder)
+        message = {"id": 1}
+
+        # act
+        wrapped.mark_in_progress_0(message)
+        wrapped.mark_in_progress_0(message)
+        wrapped.reply_message(message, "pong")
+        wrapped.mark_in_progress_done(message)
+        coalescer.close()
+
+        # assert
+        self.assertEqual(recorder.marks, [(1, "pong"), (1, "done")])
+        self.assertEqual(coalescer.get_stats()["dropped"], 2)
+
+    def test_set_status_when_window_passed_then_send_progress(self):
+        # arrange
+        recorder = MarkRecordingMessenger()
+        coalescer = StatusCoalescer(window=0.05)
+        wrapped = coalescer.wrap(recorder)
+        message = {"id": 1}
+
+        # act
+        wrapped.mark_in_progress_0(message)
+        time.sleep(0.3)
+        wrapped.mark_in_progress_done(message)
+        coalescer.close()
+
+        # assert
+        self.assertEqual(recorder.marks, [(1, "0"), (1, "done")])
+
+    def test_set_status_when_progress_superseded_then_send_latest(self):
+        # arrange
+        recorder = MarkRecordingMessenger()
+        coalescer = StatusCoalescer(window=0.1)
+        wrapped = coalescer.wrap(recorder)
+
+        # act
+        wrapped.mark_in_progress_0({"id": 1})
+        wrapped.mark_in_progress_0({"id": 2})
+        wrapped.mark_in_progress_50({"id": 1})
+        time.sleep(0.4)
+        coalescer.close()
+
+        # assert
+        self.assertEqual(sorted(recorder.marks), [(1, "50"), (2, "0")])
+
+    def test_wrap_when_checking_type_then_unwrap_explicitly(self):
+        # arrange
+        signal = SignalMessenger("+4912345", "127.0.0.1", 8080)
+        coalescer = StatusCoalescer()
+
+        # act
+        wrapped = coalescer.wrap(signal)
+
+        # assert
+        self.assertIsInstance(wrapped.get_wrapped(), SignalMessenger)
+        self.assertIs(signal.get_wrapped(), signal)
+        self.assertEqual(wrapped.get_name(), "signal")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+"""Tests for the telegram messenger. """
+import os
+import tempfile
+import threading
+import types
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import requests
+import telebot
+from smrt.bot.messenger import MediaTooLargeError, TelegramMessenger
+
+VOICE_DATA = os.urandom(200 * 1024)
+
+
+class FileHandler(BaseHTTPRequestHandler):
+    """Serves the voice note for every path. """
+    def do_GET(self):
+        if "missing" in self.path:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(VOICE_DATA)))
+        self.end_headers()
+        self.wfile.write(VOICE_DATA)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def create_message(content_type: str, content: dict) -> telebot.types.Message:
+    return telebot.types.Message.de_json({
+        "message_id": 1,
+        "date": 0,
+        "chat": {"id": 42, "type": "private"},
+        "from": {"id": 42, "is_bot": False, "first_name": "Test"},
+        content_type: content,
+        "caption": "#gallery",
+    })
+
+
+class TelegramMessengerTests(unittest.TestCase):
+    """Test cases for media of the telegram messenger"""
+    def setUp(self):
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), FileHandler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        self._telegram = TelegramMessenger("123:token")
+        self._telegram.FILE_URL = f"http://127.0.0.1:{self._server.server_address[1]}/file/bot{{0}}/{{1}}"
+        # answers getFile without calling the bot api
+        self._telegram.get_telebot().get_file = lambda file_id: types.SimpleNamespace(file_path=f"voice/{file_id}.oga")
+
+    def tearDown(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def test_has_media_when_voice_or_photo_then_detect_type(self):
+        # arrange
+        voice = create_message("voice", {"file_id": "v1", "file_unique_id": "u1", "duration": 3,
+                                         "mime_type": "audio/ogg"})
+        photo = create_message("photo", [{"file_id": "p1", "file_unique_id": "u2", "width": 90, "height": 90},
+                                         {"file_id": "p2", "file_unique_id": "u3", "width": 1280, "height": 1280}])
+
+        # act / assert
+        self.assertTrue(self._telegram.has_audio_data(voice))
+        self.assertFalse(self._telegram.has_image_data(voice))
+        self.assertTrue(self._telegram.has_image_data(photo))
+        self.assertFalse(self._telegram.has_audio_data(photo))
+        self.assertEqual(self._telegram.get_message_text(photo), "#gallery")
+
+    def test_download_media_to_when_voice_then_write_file(self):
+        # arrange
+        voice = create_message("voice", {"file_id": "v1", "file_unique_id": "u1", "duration": 3,
+                                         "mime_type": "audio/ogg", "file_size": len(VOICE_DATA)})
+
+        with tempfile.TemporaryDirectory() as tmp:
+            file_path = os.path.join(tmp, "voice.oga")
+
+            # act
+            mime_type = self._telegram.download_media_to(voice, file_path)
+
+            # assert
+            self.assertEqual(mime_type, "audio/ogg")
+            with open(file_path, "rb") as file:
+                self.assertEqual(file.read(), VOICE_DATA)
+
+    def test_download_media_to_when_too_large_then_raise(self):
+        # arrange
+        voice = create_message("voice", {"file_id": "v1", "file_unique_id": "u1", "duration": 3,
+                                         "mime_type": "audio/ogg"})
+
+        with tempfile.TemporaryDirectory() as tmp:
+            # act / assert
+            with self.assertRaises(MediaTooLargeError):
+                self._telegram.download_media_to(voice, os.path.join(tmp, "voice.oga"), max_size=1024)
+
+    def test_download_media_to_when_not_found_then_raise_without_token(self):
+        # arrange
+        voice = create_message("voice", {"file_id": "missing", "file_unique_id": "u1", "duration": 3,
+                                         "mime_type": "audio/ogg"})
+
+        with tempfile.TemporaryDirectory() as tmp:
+            # act
+            with self.assertRaises(requests.exceptions.HTTPError) as context:
+                self._telegram.download_media_to(voice, os.path.join(tmp, "voice.oga"))
+
+            # assert
+            self.assertIn("404", str(context.exception))
+            self.assertNotIn("123:token", str(context.exception))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+"""Tests for the telethon messenger. """
+import asyncio
+import os
+import tempfile
+import threading
+import time
+import types
+import unittest
+from smrt.bot.messenger import MediaTooLargeError, TelethonMessenger
+
+
+class FakeClient():
+    """Client that records sends on its own event loop. """
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.sent = []
+        self.download_cancelled = False
+        self._thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self._thread.start()
+
+    async def send_message(self, entity, text):
+        await asyncio.sleep(0.01)
+        if text == "fail":
+            raise ConnectionError("send failed")
+        self.sent.append((entity, text))
+
+    async def download_media(self, message, file):
+        # writes 1 KiB parts until the download is cancelled or all parts are written
+        try:
+            for _ in range(message.parts):
+                await asyncio.sleep(0.01)
+                file.write(b"\0" * 1024)
+        except asyncio.CancelledError:
+            self.download_cancelled = True
+            raise
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+
+
+def create_media_message(parts: int) -> types.SimpleNamespace:
+    """Voice note whose size telegram did not tell. """
+    return types.SimpleNamespace(media=object(), photo=None, parts=parts,
+                                 file=types.SimpleNamespace(size=None, mime_type="audio/ogg"))
+
+
+class TelethonMessengerTests(unittest.TestCase):
+    """Test cases for running sends on the telethon loop"""
+    def setUp(self):
+        self._client = FakeClient()
+        self._telethon = TelethonMessenger("1", "hash", "token")
+        self._telethon._client = self._client
+
+    def tearDown(self):
+        self._client.stop()
+
+    def test_send_message_when_many_threads_then_batch_on_loop(self):
+        # arrange
+        threads = [threading.Thread(target=self._telethon.send_message, args=(f"telethon://{i}", "hello"))
+                   for i in range(20)]
+        # keeps the loop busy while the sends arrive
+        self._client.loop.call_soon_threadsafe(time.sleep, 0.2)
+
+        # act
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # assert
+        self.assertEqual(sorted(entity for entity, _ in self._client.sent), list(range(20)))
+        stats = self._telethon.get_send_stats()
+        self.assertEqual(stats["calls"], 20)
+        self.assertLessEqual(stats["batches"], 2)
+
+    def test_send_message_when_send_fails_then_raise(self):
+        # act / assert
+        with self.assertRaises(ConnectionError):
+            self._telethon.send_message("telethon://1", "fail")
+
+    def test_send_message_when_called_on_loop_then_raise(self):
+        # arrange
+        async def send_on_loop():
+            self._telethon.send_message("telethon://1", "hello")
+
+        # act / assert
+        with self.assertRaises(RuntimeError):
+            asyncio.run_coroutine_threadsafe(send_on_loop(), self._client.loop).result(timeout=5)
+
+    def test_get_message_id_when_chat_not_cached_then_use_chat_id(self):
+        # arrange
+        message = types.SimpleNamespace(id=7, chat=None, chat_id=-1001234)
+
+        # act
+        message_id = self._telethon.get_message_id(message)
+
+        # assert
+        self.assertEqual(message_id, "-1001234:7")
+
+    def test_download_media_to_when_size_unknown_then_limit_written_size(self):
+        # arrange
+        message = create_media_message(parts=10)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            file_path = os.path.join(tmp, "voice.oga")
+
+            # act / assert
+            with self.assertRaises(MediaTooLargeError):
+                self._telethon.download_media_to(message, file_path, max_size=4 * 1024)
+            self.assertLessEqual(os.path.getsize(file_path), 4 * 1024)
+
+    def test_download_media_to_when_timeout_then_cancel_before_closing_file(self):
+        # arrange
+        message = create_media_message(parts=1000)
+        self._telethon.DOWNLOAD_TIMEOUT = 0.1
+
+        with tempfile.TemporaryDirectory() as tmp:
+            file_path = os.path.join(tmp, "voice.oga")
+
+            # act
+            with self.assertRaises(TimeoutError):
+                self._telethon.download_media_to(message, file_path)
+
+            # assert
+            self.assertTrue(self._client.download_cancelled)
+            size = os.path.getsize(file_path)
+            time.sleep(0.05)
+            self.assertEqual(os.path.getsize(file_path), size)
+
+
+if __name__ == '__main__':
+    unittest.main()
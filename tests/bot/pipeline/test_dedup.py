@@ -0,0 +1,78 @@
+"""Tests for the duplicate message suppression. """
+import tempfile
+import unittest
+from pathlib import Path
+import smrt.bot.pipeline as pipeline
+import smrt.db
+
+
+class IdMessenger():
+    """Minimal messenger that reads the message id from the message. """
+
+    def get_name(self):
+        return "test"
+
+    def get_message_id(self, message):
+        return message.get("id")
+
+
+class MessageDeduplicatorTests(unittest.TestCase):
+    """Test cases for the message deduplicator"""
+    def test_is_duplicate_when_same_id_again_then_true(self):
+        # arrange
+        deduplicator = pipeline.MessageDeduplicator()
+        messenger = IdMessenger()
+
+        # act
+        first = deduplicator.is_duplicate(messenger, {"id": "a"})
+        second = deduplicator.is_duplicate(messenger, {"id": "a"})
+        other = deduplicator.is_duplicate(messenger, {"id": "b"})
+
+        # assert
+        self.assertFalse(first)
+        self.assertTrue(second)
+        self.assertFalse(other)
+        self.assertEqual(deduplicator.get_stats()["duplicates"], 1)
+
+    def test_is_duplicate_when_no_id_then_never_duplicate(self):
+        # arrange
+        deduplicator = pipeline.MessageDeduplicator()
+        messenger = IdMessenger()
+
+        # act
+        first = deduplicator.is_duplicate(messenger, {})
+        second = deduplicator.is_duplicate(messenger, {})
+
+        # assert
+        self.assertFalse(first)
+        self.assertFalse(second)
+
+    def test_is_duplicate_when_evicted_from_memory_then_forget(self):
+        # arrange
+        deduplicator = pipeline.MessageDeduplicator(max_entries=2)
+        messenger = IdMessenger()
+
+        # act
+        for message_id in ["a", "b", "c"]:
+            deduplicator.is_duplicate(messenger, {"id": message_id})
+        evicted = deduplicator.is_duplicate(messenger, {"id": "a"})
+
+        # assert
+        self.assertFalse(evicted)
+
+    def test_is_duplicate_when_persisted_then_duplicate_after_restart(self):
+        # arrange
+        with tempfile.TemporaryDirectory() as storage_path:
+            seen_db = smrt.db.SeenMessageDatabase(Path(storage_path))
+            messenger = IdMessenger()
+            pipeline.MessageDeduplicator(seen_db=seen_db).is_duplicate(messenger, {"id": "a"})
+
+            # act
+            after_restart = pipeline.MessageDeduplicator(seen_db=seen_db).is_duplicate(messenger, {"id": "a"})
+
+            # assert
+            self.assertTrue(after_restart)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,408 @@
+"""Tests for the pipeline dispatcher. """
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+import smrt.bot.pipeline as pipeline
+import smrt.bot.messenger as messenger
+import smrt.db
+
+
+class BlockingPipeline(pipeline.AbstractPipeline):
+    """Pipeline that records processed messages and blocks until released. """
+
+    def __init__(self) -> None:
+        super().__init__(None, None)
+        self.release = threading.Event()
+        self.processed = []
+        self.running = 0
+        self.max_running = 0
+        self._lock = threading.Lock()
+
+    def matches(self, messenger, message):
+        return True
+
+    def process(self, messenger, message):
+        with self._lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        self.release.wait(5)
+        with self._lock:
+            self.running -= 1
+            self.processed.append(message)
+
+    def get_help_text(self) -> str:
+        return ""
+
+
+class FailingPipeline(BlockingPipeline):
+    """Pipeline that always raises. """
+
+    def process(self, messenger, message):
+        raise RuntimeError("failed on purpose")
+
+
+class ChatMessenger():
+    """Minimal messenger that reads the chat id from the message. """
+
+    def __init__(self) -> None:
+        self.failed = []
+        self.skipped = []
+
+    def get_name(self):
+        return "chat"
+
+    def get_chat_id(self, message):
+        return message["chat"]
+
+    def get_message_text(self, message):
+        return message.get("text")
+
+    def mark_skipped(self, message):
+        self.skipped.append(message["id"])
+
+    def mark_in_progress_fail(self, message):
+        self.failed.append(message)
+
+
+class RecordingPipeline(BlockingPipeline):
+    """Pipeline that records messages without blocking, slower for the first message. """
+
+    def process(self, messenger, message):
+        if message["id"] == 0:
+            time.sleep(0.2)
+        with self._lock:
+            self.processed.append(message["id"])
+
+
+class MediaPipeline(BlockingPipeline):
+    """Blocking pipeline in the media priority class. """
+
+    def get_priority(self) -> str:
+        return self.PRIORITY_MEDIA
+
+
+class OrderPipeline(BlockingPipeline):
+    """Pipeline of a given priority that appends message ids to a shared list. """
+
+    def __init__(self, priority: str, order: list, blocking: bool) -> None:
+        super().__init__()
+        self._priority = priority
+        self._order = order
+        if not blocking:
+            self.release.set()
+
+    def get_priority(self) -> str:
+        return self._priority
+
+    def process(self, messenger, message):
+        self.release.wait(5)
+        self._order.append(message["id"])
+
+
+class PipelineDispatcherTests(unittest.TestCase):
+    """Test cases for the pipeline dispatcher"""
+
+    def test_submit_when_concurrency_limited_then_runs_one_at_a_time(self):
+        # arrange
+        dispatcher = pipeline.PipelineDispatcher(max_workers=4, pipeline_concurrency={"BlockingPipeline": 1})
+        pipe = BlockingPipeline()
+
+        # act
+        for i in range(3):
+            dispatcher.submit(pipe, None, {"id": i})
+        time.sleep(0.2)
+        running_before_release = pipe.running
+        pipe.release.set()
+        dispatcher.stop()
+
+        # assert
+        self.assertEqual(running_before_release, 1)
+        self.assertEqual(pipe.max_running, 1)
+        self.assertEqual(len(pipe.processed), 3)
+
+    def test_submit_when_queue_full_then_reject(self):
+        # arrange
+        dispatcher = pipeline.PipelineDispatcher(max_workers=1, max_queue_size=1)
+        pipe = BlockingPipeline()
+
+        # act
+        first = dispatcher.submit(pipe, None, {"id": 1})
+        time.sleep(0.2)
+        second = dispatcher.submit(pipe, None, {"id": 2})
+        third = dispatcher.submit(pipe, None, {"id": 3})
+        pipe.release.set()
+        dispatcher.stop()
+        stats = dispatcher.get_stats()["pipelines"]["BlockingPipeline"]
+
+        # assert
+        self.assertTrue(first)
+        self.assertTrue(second)
+        self.assertFalse(third)
+        self.assertEqual(stats["rejected"], 1)
+        self.assertEqual(stats["completed"], 2)
+
+    def test_submit_when_pipeline_raises_then_count_failure(self):
+        # arrange
+        dispatcher = pipeline.PipelineDispatcher(max_workers=1)
+        pipe = FailingPipeline()
+
+        # act
+        dispatcher.submit(pipe, None, {"id": 1})
+        dispatcher.stop()
+        stats = dispatcher.get_stats()["pipelines"]["FailingPipeline"]
+
+        # assert
+        self.assertEqual(stats["failed"], 1)
+        self.assertEqual(stats["queued"], 0)
+        self.assertEqual(stats["active"], 0)
+
+    def test_submit_when_ordered_chats_then_same_chat_runs_in_order(self):
+        # arrange
+        dispatcher = pipeline.PipelineDispatcher(max_workers=4, ordered_chats=True)
+        pipe = RecordingPipeline()
+        messenger = ChatMessenger()
+
+        # act
+        for i in range(4):
+            dispatcher.submit(pipe, messenger, {"id": i, "chat": "signal://a"})
+        dispatcher.stop()
+
+        # assert
+        self.assertEqual(pipe.processed, [0, 1, 2, 3])
+
+    def test_submit_when_ordered_chats_then_other_chats_run_in_parallel(self):
+        # arrange
+        dispatcher = pipeline.PipelineDispatcher(max_workers=2, ordered_chats=True)
+        pipe = BlockingPipeline()
+        messenger = ChatMessenger()
+
+        # act
+        dispatcher.submit(pipe, messenger, {"id": 1, "chat": "signal://a"})
+        dispatcher.submit(pipe, messenger, {"id": 2, "chat": "signal://a"})
+        dispatcher.submit(pipe, messenger, {"id": 3, "chat": "signal://b"})
+        time.sleep(0.2)
+        running_before_release = pipe.running
+        pipe.release.set()
+        dispatcher.stop()
+
+        # assert
+        self.assertEqual(running_before_release, 2)
+        self.assertEqual(len(pipe.processed), 3)
+
+    def test_replay_jobs_when_previous_run_did_not_finish_then_process_again(self):
+        # arrange
+        with tempfile.TemporaryDirectory() as storage_path:
+            job_store = smrt.db.JobQueueDatabase(Path(storage_path))
+            chat_messenger = ChatMessenger()
+            manager = messenger.MessengerManager()
+            manager.add_messenger(chat_messenger)
+            # jobs still leased by a run that was killed
+            lease_until = time.time() + 600
+            job_store.add_job("BlockingPipeline", "chat", {"id": 1, "chat": "chat://a"}, "previous", lease_until)
+            job_store.add_job("BlockingPipeline", "chat", {"id": 2, "chat": "chat://a"}, "previous", lease_until)
+            pipe = BlockingPipeline()
+            pipe.release.set()
+            dispatcher = pipeline.PipelineDispatcher(max_workers=1, job_store=job_store,
+                                                     persistent_pipelines=["BlockingPipeline"])
+
+            # act
+            replayed = dispatcher.replay_jobs([pipe], manager)
+            dispatcher.stop()
+            stats = dispatcher.get_stats()
+
+            # assert
+            self.assertEqual(replayed, 2)
+            self.assertEqual(sorted(message["id"] for message in pipe.processed), [1, 2])
+            self.assertEqual(stats["pipelines"]["BlockingPipeline"]["replayed"], 2)
+            self.assertEqual(stats["persisted_jobs"], 0)
+
+    def test_replay_jobs_when_job_outlives_its_lease_then_do_not_run_twice(self):
+        # arrange
+        with tempfile.TemporaryDirectory() as storage_path:
+            job_store = smrt.db.JobQueueDatabase(Path(storage_path))
+            chat_messenger = ChatMessenger()
+            manager = messenger.MessengerManager()
+            manager.add_messenger(chat_messenger)
+            pipe = BlockingPipeline()
+            dispatcher = pipeline.PipelineDispatcher(max_workers=2, job_store=job_store,
+                                                     persistent_pipelines=["BlockingPipeline"],
+                                                     lease_timeout=0.1)
+            dispatcher.submit(pipe, chat_messenger, {"id": 1, "chat": "chat://a"})
+            while pipe.running == 0:
+                time.sleep(0.01)
+            # the lease expires while the job is still running
+            time.sleep(0.3)
+
+            # act
+            replayed = dispatcher.replay_jobs([pipe], manager)
+            pipe.release.set()
+            dispatcher.stop()
+
+            # assert
+            self.assertEqual(replayed, 0)
+            self.assertEqual(pipe.max_running, 1)
+            self.assertEqual(len(pipe.processed), 1)
+            self.assertEqual(job_store.get_job_count(), 0)
+
+    def test_replay_jobs_when_max_attempts_reached_then_drop_and_mark_failed(self):
+        # arrange
+        with tempfile.TemporaryDirectory() as storage_path:
+            job_store = smrt.db.JobQueueDatabase(Path(storage_path))
+            chat_messenger = ChatMessenger()
+            manager = messenger.MessengerManager()
+            manager.add_messenger(chat_messenger)
+            job_id = job_store.add_job("BlockingPipeline", "chat", {"id": 1, "chat": "chat://a"}, "old", 0)
+            job_store.lease_job(job_id, "old", 0, count_attempt=True)
+            pipe = BlockingPipeline()
+            dispatcher = pipeline.PipelineDispatcher(max_workers=1, job_store=job_store,
+                                                     persistent_pipelines=["BlockingPipeline"],
+                                                     max_attempts=1)
+
+            # act
+            replayed = dispatcher.replay_jobs([pipe], manager)
+            dispatcher.stop()
+
+            # assert
+            self.assertEqual(replayed, 0)
+            self.assertEqual(chat_messenger.failed, [{"id": 1, "chat": "chat://a"}])
+            self.assertEqual(job_store.get_job_count(), 0)
+
+    def test_submit_when_worker_busy_then_interactive_runs_before_queued_media(self):
+        # arrange
+        dispatcher = pipeline.PipelineDispatcher(max_workers=1)
+        order = []
+        media = OrderPipeline(pipeline.PipelineInterface.PRIORITY_MEDIA, order, blocking=True)
+        interactive = OrderPipeline(pipeline.PipelineInterface.PRIORITY_INTERACTIVE, order, blocking=False)
+
+        # act
+        dispatcher.submit(media, None, {"id": "media1"})
+        time.sleep(0.2)
+        dispatcher.submit(media, None, {"id": "media2"})
+        dispatcher.submit(interactive, None, {"id": "help"})
+        media.release.set()
+        dispatcher.stop()
+        stats = dispatcher.get_stats()["priorities"]
+
+        # assert
+        self.assertEqual(order, ["media1", "help", "media2"])
+        self.assertEqual(stats["media"]["completed"], 2)
+        self.assertEqual(stats["interactive"]["completed"], 1)
+
+    def test_submit_when_workers_reserved_then_media_keeps_worker_free_for_interactive(self):
+        # arrange
+        dispatcher = pipeline.PipelineDispatcher(max_workers=2, reserved_workers={"interactive": 1})
+        media = MediaPipeline()
+        interactive = BlockingPipeline()
+        interactive.release.set()
+
+        # act
+        dispatcher.submit(media, None, {"id": 1})
+        dispatcher.submit(media, None, {"id": 2})
+        time.sleep(0.2)
+        media_running = media.running
+        dispatcher.submit(interactive, None, {"id": 3})
+        time.sleep(0.2)
+        interactive_processed = len(interactive.processed)
+        media.release.set()
+        dispatcher.stop()
+
+        # assert
+        self.assertEqual(media_running, 1)
+        self.assertEqual(interactive_processed, 1)
+        self.assertEqual(len(media.processed), 2)
+
+    def test_next_job_when_job_starved_then_run_oldest_first(self):
+        # arrange
+        dispatcher = pipeline.PipelineDispatcher(max_workers=1, starvation_timeout=0.1)
+        order = []
+        media = OrderPipeline(pipeline.PipelineInterface.PRIORITY_MEDIA, order, blocking=True)
+        interactive = OrderPipeline(pipeline.PipelineInterface.PRIORITY_INTERACTIVE, order, blocking=False)
+
+        # act
+        dispatcher.submit(media, None, {"id": "media1"})
+        time.sleep(0.1)
+        dispatcher.submit(media, None, {"id": "media2"})
+        time.sleep(0.2)
+        dispatcher.submit(interactive, None, {"id": "help"})
+        media.release.set()
+        dispatcher.stop()
+
+        # assert
+        self.assertEqual(order, ["media1", "media2", "help"])
+
+    def test_init_when_reservations_use_all_workers_then_raise(self):
+        # act / assert
+        with self.assertRaises(ValueError):
+            pipeline.PipelineDispatcher(max_workers=2, reserved_workers={"interactive": 2})
+
+    def test_submit_when_pipeline_queue_full_and_drop_oldest_then_skip_oldest(self):
+        # arrange
+        dispatcher = pipeline.PipelineDispatcher(max_workers=1, pipeline_queues={
+            "BlockingPipeline": {"max_queued": 2, "overflow": "drop_oldest"}})
+        pipe = BlockingPipeline()
+        messenger = ChatMessenger()
+
+        # act
+        dispatcher.submit(pipe, messenger, {"id": 1, "chat": "signal://a"})
+        time.sleep(0.2)
+        for i in range(2, 5):
+            dispatcher.submit(pipe, messenger, {"id": i, "chat": "signal://a"})
+        pipe.release.set()
+        dispatcher.stop()
+        stats = dispatcher.get_stats()["pipelines"]["BlockingPipeline"]
+
+        # assert
+        self.assertEqual(messenger.skipped, [2])
+        self.assertEqual([message["id"] for message in pipe.processed], [1, 3, 4])
+        self.assertEqual(stats["dropped"], 1)
+
+    def test_submit_when_pipeline_queue_full_and_reject_then_skip_new_job(self):
+        # arrange
+        dispatcher = pipeline.PipelineDispatcher(max_workers=1, pipeline_queues={
+            "BlockingPipeline": {"max_queued": 1}})
+        pipe = BlockingPipeline()
+        messenger = ChatMessenger()
+
+        # act
+        dispatcher.submit(pipe, messenger, {"id": 1, "chat": "signal://a"})
+        time.sleep(0.2)
+        second = dispatcher.submit(pipe, messenger, {"id": 2, "chat": "signal://a"})
+        third = dispatcher.submit(pipe, messenger, {"id": 3, "chat": "signal://a"})
+        pipe.release.set()
+        dispatcher.stop()
+
+        # assert
+        self.assertTrue(second)
+        self.assertFalse(third)
+        self.assertEqual(messenger.skipped, [3])
+        self.assertEqual(len(pipe.processed), 2)
+
+    def test_submit_when_coalesce_and_duplicate_queued_then_merge(self):
+        # arrange
+        dispatcher = pipeline.PipelineDispatcher(max_workers=1, pipeline_queues={
+            "BlockingPipeline": {"overflow": "coalesce"}})
+        pipe = BlockingPipeline()
+        messenger = ChatMessenger()
+
+        # act
+        dispatcher.submit(pipe, messenger, {"id": 1, "chat": "signal://a", "text": "#summary"})
+        time.sleep(0.2)
+        dispatcher.submit(pipe, messenger, {"id": 2, "chat": "signal://a", "text": "#summary"})
+        duplicate = dispatcher.submit(pipe, messenger, {"id": 3, "chat": "signal://a", "text": "#summary"})
+        other_chat = dispatcher.submit(pipe, messenger, {"id": 4, "chat": "signal://b", "text": "#summary"})
+        pipe.release.set()
+        dispatcher.stop()
+        stats = dispatcher.get_stats()["pipelines"]["BlockingPipeline"]
+
+        # assert
+        self.assertFalse(duplicate)
+        self.assertTrue(other_chat)
+        self.assertEqual(messenger.skipped, [3])
+        self.assertEqual(stats["coalesced"], 1)
+        self.assertEqual([message["id"] for message in pipe.processed], [1, 2, 4])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -93,7 +93,161 @@ class PipelineHelperTests(unittest.TestCase):
 
         # assert
         self.assertIsNone(return_data)
-        
-        
+
+    def test_command_extraction_when_leading_whitespace_then_extract_command(self):
+        # arrange
+        command_text = "  \n#gpt(fast)  hello  "
+
+        # act
+        parsed = pipeline.PipelineHelper.extract_command_full(command_text)
+
+        # assert
+        self.assertEqual(parsed, ("gpt", "fast", "hello"))
+        self.assertEqual(parsed.command, "gpt")
+        self.assertEqual(parsed.params, "fast")
+        self.assertEqual(parsed.remainder, "hello")
+
+    def test_command_extraction_when_params_not_closed_then_return_none(self):
+        # arrange
+        command_text = "#gpt(fast hello"
+
+        # act
+        return_data = pipeline.PipelineHelper.extract_command_full(command_text)
+        parsed = pipeline.PipelineHelper.parse_command(command_text)
+
+        # assert
+        self.assertIsNone(return_data)
+        self.assertEqual(parsed, ("gpt", None, None))
+
+    def test_command_extraction_when_space_before_parenthesis_then_params_are_text(self):
+        # arrange
+        command_text = "#gpt (fast) hello"
+
+        # act
+        (command, params, text) = pipeline.PipelineHelper.extract_command_full(command_text)
+
+        # assert
+        self.assertEqual(command, "gpt")
+        self.assertEqual(params, "")
+        self.assertEqual(text, "(fast) hello")
+
+    def test_extract_command_when_text_then_return_command_or_empty(self):
+        # arrange
+        cases = {"#help": "help", " #tts_de(x) hi": "tts_de", "#!": "", "hello #help": "", "": ""}
+
+        for command_text, expected in cases.items():
+            # act
+            command = pipeline.PipelineHelper.extract_command(command_text)
+
+            # assert
+            self.assertEqual(command, expected)
+
+
+
+class DictMessenger():
+    """Minimal messenger reading all fields from a plain dict message. """
+
+    def __init__(self):
+        self.id_lookups = 0
+
+    def get_name(self):
+        return "dict"
+
+    def get_message_id(self, message):
+        self.id_lookups += 1
+        return message.get("id")
+
+    def get_message_text(self, message):
+        return message.get("text")
+
+    def get_chat_id(self, message):
+        return message["chat"]
+
+    def is_group_message(self, message):
+        return message.get("group", False)
+
+    def has_audio_data(self, message):
+        return message.get("audio", False)
+
+    def has_image_data(self, message):
+        return message.get("image", False)
+
+
+class WhitelistedPipeline(pipeline.ChatIdPipeline):
+    """Chat id pipeline that is only allowed in some chats. """
+
+    def __init__(self, chat_id_whitelist):
+        pipeline.AbstractPipeline.__init__(self, chat_id_whitelist, None)
+
+
+class MessageEnvelopeTests(unittest.TestCase):
+    """Test Cases for the parsed message envelope"""
+    def test_envelope_when_command_with_params_then_parse_all_parts(self):
+        # arrange
+        message = {"text": "#tinder(context) hello there", "chat": "signal://abc", "group": True}
+
+        # act
+        envelope = pipeline.MessageEnvelope(DictMessenger(), message)
+
+        # assert
+        self.assertEqual(envelope.command, "tinder")
+        self.assertEqual(envelope.params, "context")
+        self.assertEqual(envelope.remainder, "hello there")
+        self.assertEqual(envelope.chat_id, "signal://abc")
+        self.assertTrue(envelope.is_group)
+        self.assertFalse(envelope.has_audio)
+        self.assertIs(envelope.message, message)
+
+    def test_envelope_when_text_is_none_then_empty_text_and_no_command(self):
+        # arrange
+        message = {"text": None, "chat": "telegram://1", "audio": True}
+
+        # act
+        envelope = pipeline.MessageEnvelope(DictMessenger(), message)
+
+        # assert
+        self.assertEqual(envelope.text, "")
+        self.assertEqual(envelope.command, "")
+        self.assertIsNone(envelope.remainder)
+        self.assertTrue(envelope.has_audio)
+
+    def test_envelope_when_params_not_closed_then_still_extract_command(self):
+        # arrange
+        message = {"text": "#gallery(on", "chat": "whatsapp://1@g.us"}
+
+        # act
+        envelope = pipeline.MessageEnvelope(DictMessenger(), message)
+
+        # assert
+        self.assertEqual(envelope.command, "gallery")
+        self.assertIsNone(envelope.params)
+
+    def test_get_message_id_when_used_by_deduplicator_then_resolve_once(self):
+        # arrange
+        messenger = DictMessenger()
+        envelope = pipeline.MessageEnvelope(messenger, {"text": "hi", "chat": "signal://1", "id": "m1"})
+        deduplicator = pipeline.MessageDeduplicator()
+
+        # act
+        duplicate = deduplicator.is_duplicate(messenger, envelope.message, envelope)
+        message_id = envelope.get_message_id()
+
+        # assert
+        self.assertFalse(duplicate)
+        self.assertEqual(message_id, "m1")
+        self.assertEqual(messenger.id_lookups, 1)
+
+    def test_allowed_in_chat_id_when_envelope_given_then_use_its_chat_id(self):
+        # arrange
+        pipe = WhitelistedPipeline(["signal://1"])
+        envelope = pipeline.MessageEnvelope(DictMessenger(), {"text": "", "chat": "signal://1"})
+
+        # act
+        allowed = pipe.allowed_in_chat_id(None, envelope.message, envelope)
+
+        # assert
+        self.assertTrue(allowed)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,84 @@
+"""Tests for routing messages to pipelines. """
+import unittest
+import smrt.bot.pipeline as pipeline
+from tests.bot.pipeline.test_pipeline import DictMessenger
+
+
+class StaticPipeline(pipeline.AbstractPipeline):
+    """Pipeline with configurable commands and media types. """
+
+    def __init__(self, commands, media_types=None) -> None:
+        super().__init__(None, None)
+        self._commands = commands
+        self._media_types = media_types or []
+
+    def get_commands(self):
+        return self._commands
+
+    def get_media_types(self):
+        return self._media_types
+
+    def matches(self, messenger, message, envelope):
+        return True
+
+    def process(self, messenger, message):
+        pass
+
+    def get_help_text(self) -> str:
+        return ""
+
+
+class PipelineRouterTests(unittest.TestCase):
+    """Test cases for the pipeline router"""
+
+    def _envelope(self, message: dict) -> pipeline.MessageEnvelope:
+        message.setdefault("chat", "signal://abc")
+        return pipeline.MessageEnvelope(DictMessenger(), message)
+
+    def test_candidates_when_command_matches_exactly_then_route_to_pipeline(self):
+        # arrange
+        router = pipeline.PipelineRouter()
+        help_pipe = pipeline.HelpPipeline()
+        router.add_pipeline(help_pipe)
+
+        # act
+        exact = router.get_candidates(self._envelope({"text": "#help"}))
+        substring = router.get_candidates(self._envelope({"text": "#helpme"}))
+
+        # assert
+        self.assertEqual(exact, [help_pipe])
+        self.assertEqual(substring, [])
+
+    def test_candidates_when_no_commands_declared_then_always_candidate(self):
+        # arrange
+        router = pipeline.PipelineRouter()
+        catch_all = StaticPipeline(None)
+        router.add_pipeline(catch_all)
+
+        # act
+        candidates = router.get_candidates(self._envelope({"text": "hello"}))
+
+        # assert
+        self.assertEqual(candidates, [catch_all])
+
+    def test_candidates_when_media_and_command_then_keep_registration_order(self):
+        # arrange
+        router = pipeline.PipelineRouter()
+        voice = StaticPipeline([], [pipeline.PipelineInterface.MEDIA_AUDIO])
+        catch_all = StaticPipeline(None)
+        gallery = StaticPipeline(["gallery"], [pipeline.PipelineInterface.MEDIA_IMAGE])
+        router.add_pipeline(voice)
+        router.add_pipeline(catch_all)
+        router.add_pipeline(gallery)
+
+        # act
+        audio = router.get_candidates(self._envelope({"text": "", "audio": True}))
+        image_with_command = router.get_candidates(self._envelope({"text": "#gallery", "image": True}))
+
+        # assert
+        self.assertEqual(audio, [voice, catch_all])
+        self.assertEqual(image_with_command, [catch_all, gallery])
+
+
+if __name__ == '__main__':
+    unittest.main()
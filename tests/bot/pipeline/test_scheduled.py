@@ -0,0 +1,34 @@
+"""Tests for the base of scheduled tasks. """
+import unittest
+from concurrent.futures import Future
+from smrt.bot.pipeline.scheduled import AbstractScheduledTask
+
+
+class FailingMessengerManager():
+    """Messenger manager whose queued messages fail later. """
+    def __init__(self):
+        self.future = Future()
+
+    def send_message(self, chat_id, text):
+        return self.future
+
+
+class AbstractScheduledTaskTests(unittest.TestCase):
+    """Test cases for sending messages from scheduled tasks"""
+    def test_send_message_when_sending_fails_later_then_log_error(self):
+        # arrange
+        manager = FailingMessengerManager()
+        task = AbstractScheduledTask(manager, ["signal://1"])
+
+        # act
+        task.send_message("signal://1", "hello")
+        with self.assertLogs(level="ERROR") as logs:
+            manager.future.set_exception(ConnectionError("send failed"))
+
+        # assert
+        self.assertIn("signal://1", logs.output[0])
+        self.assertIn("send failed", logs.output[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
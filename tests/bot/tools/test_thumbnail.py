@@ -0,0 +1,44 @@
+import os
+import tempfile
+import unittest
+from PIL import Image
+from smrt.bot.tools.thumbnail import Thumbnailer, ProcessThumbnailer
+
+
+class ThumbnailerTests(unittest.TestCase):
+    """Test cases for creating thumbnails in and outside of the bot process"""
+    def _create_thumbnail(self, thumbnailer: Thumbnailer) -> tuple[int, int]:
+        with tempfile.TemporaryDirectory() as tmp:
+            image_path = os.path.join(tmp, "image.blob")
+            thumb_path = os.path.join(tmp, "image_thumb.png")
+            Image.new("RGB", (2000, 1000), "red").save(image_path, format="jpeg")
+
+            thumbnailer.create_thumbnail(image_path, thumb_path)
+
+            with Image.open(thumb_path) as thumb:
+                return thumb.size
+
+    def test_create_thumbnail_when_large_image_then_keep_aspect_ratio(self):
+        # arrange
+        thumbnailer = Thumbnailer()
+
+        # act
+        size = self._create_thumbnail(thumbnailer)
+
+        # assert
+        self.assertEqual(size, (300, 150))
+
+    def test_create_thumbnail_when_worker_process_then_write_same_thumbnail(self):
+        # arrange
+        thumbnailer = ProcessThumbnailer(workers=1)
+
+        # act
+        size = self._create_thumbnail(thumbnailer)
+        thumbnailer.shutdown()
+
+        # assert
+        self.assertEqual(size, (300, 150))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+"""Tests for the audio transcoder. """
+import subprocess
+import sys
+import threading
+import time
+import unittest
+from smrt.utils import AudioTranscoder
+
+# reverses the input, stands in for an encoder that reads stdin and writes stdout
+REVERSE = [sys.executable, "-c", "import sys; sys.stdout.buffer.write(sys.stdin.buffer.read()[::-1])"]
+SLOW = [sys.executable, "-c", "import sys, time; data = sys.stdin.buffer.read(); time.sleep(0.3); sys.stdout.buffer.write(data)"]
+FAIL = [sys.executable, "-c", "import sys; sys.exit(1)"]
+
+
+class AudioTranscoderTests(unittest.TestCase):
+    """Test cases for encoding audio through pipes"""
+    def test_encode_when_same_audio_twice_then_encode_once(self):
+        # arrange
+        transcoder = AudioTranscoder()
+        transcoder.COMMANDS = {AudioTranscoder.FORMAT_OPUS: REVERSE}
+
+        # act
+        first = transcoder.encode(b"abc", AudioTranscoder.FORMAT_OPUS)
+        second = transcoder.encode(b"abc", AudioTranscoder.FORMAT_OPUS)
+
+        # assert
+        self.assertEqual(first, b"cba")
+        self.assertEqual(second, b"cba")
+        self.assertEqual(transcoder.get_stats()["hits"], 1)
+        self.assertEqual(transcoder.get_stats()["misses"], 1)
+
+    def test_encode_when_cache_full_then_evict_oldest(self):
+        # arrange
+        transcoder = AudioTranscoder(cache_size=5)
+        transcoder.COMMANDS = {AudioTranscoder.FORMAT_OPUS: REVERSE}
+
+        # act
+        transcoder.encode(b"abc", AudioTranscoder.FORMAT_OPUS)
+        transcoder.encode(b"def", AudioTranscoder.FORMAT_OPUS)
+        transcoder.encode(b"abc", AudioTranscoder.FORMAT_OPUS)
+
+        # assert
+        stats = transcoder.get_stats()
+        self.assertEqual(stats["entries"], 1)
+        self.assertEqual(stats["cached_bytes"], 3)
+        self.assertEqual(stats["hits"], 0)
+
+    def test_encode_when_more_requests_than_processes_then_wait(self):
+        # arrange
+        transcoder = AudioTranscoder(max_processes=1, cache_size=0)
+        transcoder.COMMANDS = {AudioTranscoder.FORMAT_OPUS: SLOW}
+        threads = [threading.Thread(target=transcoder.encode, args=(bytes([i]), AudioTranscoder.FORMAT_OPUS))
+                   for i in range(2)]
+
+        # act
+        start = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        duration = time.monotonic() - start
+
+        # assert
+        self.assertGreaterEqual(duration, 0.6)
+
+    def test_encode_when_encoder_fails_then_raise(self):
+        # arrange
+        transcoder = AudioTranscoder()
+        transcoder.COMMANDS = {AudioTranscoder.FORMAT_AAC: FAIL}
+
+        # act / assert
+        with self.assertRaises(subprocess.CalledProcessError):
+            transcoder.encode(b"abc", AudioTranscoder.FORMAT_AAC)
+        with self.assertRaises(ValueError):
+            transcoder.encode(b"abc", "mp3")
+
+
+if __name__ == '__main__':
+    unittest.main()
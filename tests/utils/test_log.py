@@ -0,0 +1,95 @@
+"""Tests for the logging helpers. """
+import json
+import logging
+import unittest
+from smrt.utils import JsonFormatter, Lazy, ModuleLevelFilter, Truncated
+
+
+class RenderCounter():
+    """Counts how often it is rendered. """
+    def __init__(self):
+        self.renders = 0
+
+    def __str__(self):
+        self.renders += 1
+        return "rendered"
+
+
+def create_record(pathname: str, level: int, message: str = "hello", args: tuple = ()) -> logging.LogRecord:
+    return logging.LogRecord("root", level, pathname, 1, message, args, None)
+
+
+class TruncatedTests(unittest.TestCase):
+    """Test cases for size capped rendering of payloads"""
+    def test_str_when_payload_has_long_string_then_cut(self):
+        # arrange
+        payload = {"response": {"body": "A" * 100000, "type": "image"}}
+
+        # act
+        text = str(Truncated(payload, max_length=200))
+
+        # assert
+        self.assertLessEqual(len(text), 203)
+        self.assertIn("'type': 'image'", text)
+
+    def test_str_when_payload_small_then_equal_to_str(self):
+        # arrange
+        payload = {"text": "hi", "ids": [1, 2], "group": True}
+
+        # act
+        text = str(Truncated(payload))
+
+        # assert
+        self.assertEqual(text, str(payload))
+
+    def test_log_when_level_disabled_then_not_rendered(self):
+        # arrange
+        counter = RenderCounter()
+        logger = logging.getLogger("smrt.test.truncated")
+        logger.setLevel(logging.WARNING)
+
+        # act
+        logger.info("Message: %s", Lazy(counter.__str__))
+
+        # assert
+        self.assertEqual(counter.renders, 0)
+
+
+class ModuleLevelFilterTests(unittest.TestCase):
+    """Test cases for log levels per module"""
+    def test_filter_when_module_configured_then_use_most_specific_level(self):
+        # arrange
+        log_filter = ModuleLevelFilter(logging.INFO, {"smrt.bot.messenger": logging.WARNING,
+                                                      "smrt.bot.messenger.whatsapp": logging.DEBUG})
+
+        # act
+        whatsapp_debug = log_filter.filter(create_record("/app/smrt/bot/messenger/whatsapp.py", logging.DEBUG))
+        signal_info = log_filter.filter(create_record("/app/smrt/bot/messenger/signal.py", logging.INFO))
+        pipeline_info = log_filter.filter(create_record("/app/smrt/bot/pipeline/dispatcher.py", logging.INFO))
+        pipeline_debug = log_filter.filter(create_record("/app/smrt/bot/pipeline/dispatcher.py", logging.DEBUG))
+
+        # assert
+        self.assertTrue(whatsapp_debug)
+        self.assertFalse(signal_info)
+        self.assertTrue(pipeline_info)
+        self.assertFalse(pipeline_debug)
+
+
+class JsonFormatterTests(unittest.TestCase):
+    """Test cases for json log output"""
+    def test_format_when_record_then_one_json_object(self):
+        # arrange
+        formatter = JsonFormatter()
+        record = create_record("/app/smrt/bot/messenger/signal.py", logging.WARNING, "Lost %s", ("connection",))
+
+        # act
+        entry = json.loads(formatter.format(record))
+
+        # assert
+        self.assertEqual(entry["level"], "WARNING")
+        self.assertEqual(entry["module"], "smrt.bot.messenger.signal")
+        self.assertEqual(entry["message"], "Lost connection")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+import os
+import unittest
+from smrt.utils import ProcessWorkerPool
+
+
+class PidReporter():
+    """Reports the process it lives in. """
+    def get_pid(self):
+        return os.getpid()
+
+
+class ProcessWorkerPoolTests(unittest.TestCase):
+    """Test cases for running methods in worker processes"""
+    def test_call_when_method_of_instance_then_return_result_from_worker(self):
+        # arrange
+        pool = ProcessWorkerPool(dict, workers=1, answer=42)
+
+        # act
+        first = pool.call("get", "answer")
+        second = pool.call("get", "missing", "default")
+        pool.shutdown()
+
+        # assert
+        self.assertEqual(first, 42)
+        self.assertEqual(second, "default")
+
+    def test_call_when_instance_created_then_runs_in_other_process(self):
+        # arrange
+        pool = ProcessWorkerPool(PidReporter, workers=1)
+
+        # act
+        worker_pid = pool.call("get_pid")
+        pool.shutdown()
+
+        # assert
+        self.assertNotEqual(worker_pid, os.getpid())
+
+
+if __name__ == '__main__':
+    unittest.main()